@@ -0,0 +1,99 @@
+import math
+from datetime import datetime, timezone
+from escrita_supabase import upsert_lote
+from leitura_supabase import buscar_tudo
+from lotes_saldos import ids_por_chamada
+
+# --- AGENDA DO SYNC DE ESTOQUE POR GIRO ---
+# Em vez de varrer o catálogo inteiro toda vez, cada SKU cai numa faixa pelo giro de 120 dias
+# (o mesmo v_qtd_120d_geral do dashboard) e pelo risco de ruptura (cobertura em dias):
+#   QUENTE -> toda execução | MORNO -> diário | FRIO -> semanal
+# Os vencidos são atualizados por prioridade até acabar o orçamento de chamadas da execução.
+TABELA_VERIFICACAO = "estoque_verificacao"
+
+FAIXAS = {
+    "QUENTE": 0,           # horas entre verificações
+    "MORNO": 24,
+    "FRIO": 24 * 7
+}
+ORDEM_FAIXAS = ["QUENTE", "MORNO", "FRIO"]
+
+GIRO_QUENTE = 30         # Vendas em 120 dias a partir das quais o SKU é sempre atualizado
+COBERTURA_RISCO = 15     # Dias de cobertura abaixo dos quais há risco de ruptura
+IDS_POR_CHAMADA = ids_por_chamada() # ids por chamada de /estoques/saldos no limite de URL padrão
+ORCAMENTO_PADRAO = 150   # Chamadas de /estoques/saldos por execução (somando as contas)
+
+def classificar(giro_120d, estoque_total, qtd_andamento=0):
+    if giro_120d > 0:
+        cobertura = estoque_total / (giro_120d / 120)
+        if giro_120d >= GIRO_QUENTE or cobertura <= COBERTURA_RISCO:
+            return "QUENTE"
+        return "MORNO"
+    if qtd_andamento > 0:
+        return "MORNO" # Compra chegando: o saldo vai mudar
+    return "FRIO"
+
+def _horas_desde(iso):
+    if not iso: return math.inf
+    momento = datetime.fromisoformat(str(iso).replace("Z", "+00:00"))
+    if momento.tzinfo is None: momento = momento.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - momento).total_seconds() / 3600
+
+def registrar_verificacao(faixas):
+    """Grava o momento da conferência de cada SKU ({sku: faixa})."""
+    agora = datetime.now(timezone.utc).isoformat()
+    registros = [{"sku": s, "faixa": f, "verificado_em": agora} for s, f in faixas.items()]
+    for pos in range(0, len(registros), 1000):
+        upsert_lote(TABELA_VERIFICACAO, registros[pos:pos + 1000])
+
+class AgendaEstoque:
+    def __init__(self, produtos):
+        """'produtos' é o catálogo ativo do sync (sku + ids do Bling em cada conta)."""
+        self.produtos = {p['sku']: p for p in produtos}
+
+        view = {l['sku']: l for l in buscar_tudo("mview_dashboard_completa", select="sku,est_total,v_qtd_120d_geral,qtd_andamento")}
+        verificacao = {l['sku']: l['verificado_em'] for l in buscar_tudo(TABELA_VERIFICACAO, select="sku,verificado_em")}
+
+        self.faixa = {}
+        self.idade = {}
+        self.giro = {}
+        for sku in self.produtos:
+            l = view.get(sku, {})
+            giro = float(l.get('v_qtd_120d_geral') or 0)
+            self.giro[sku] = giro
+            self.faixa[sku] = classificar(giro, float(l.get('est_total') or 0), float(l.get('qtd_andamento') or 0))
+            self.idade[sku] = _horas_desde(verificacao.get(sku))
+
+    def vencidos(self):
+        """SKUs que passaram do intervalo da faixa, do mais prioritário ao menos."""
+        lista = [s for s in self.produtos if self.idade[s] >= FAIXAS[self.faixa[s]]]
+        # Faixa primeiro; dentro dela, nunca verificado / mais antigo primeiro e maior giro primeiro
+        return sorted(lista, key=lambda s: (ORDEM_FAIXAS.index(self.faixa[s]), -min(self.idade[s], 1e9), -self.giro[s]))
+
+    def selecionar(self, orcamento=ORCAMENTO_PADRAO, ids_chamada=IDS_POR_CHAMADA):
+        """Vencidos que cabem no orçamento. Cada SKU custa 1/ids_chamada de chamada em cada conta onde tem id."""
+        selecionados = []
+        custo = 0.0
+        for sku in self.vencidos():
+            p = self.produtos[sku]
+            custo_sku = sum(1 for c in ['id_bling_portfio', 'id_bling_portcasa'] if p.get(c)) / ids_chamada
+            if custo + custo_sku > orcamento: break
+            custo += custo_sku
+            selecionados.append(p)
+        return selecionados
+
+    def marcar_verificados(self, skus):
+        registrar_verificacao({s: self.faixa.get(s, "FRIO") for s in skus})
+        for s in skus:
+            self.idade[s] = 0
+
+    def relatorio(self):
+        print("\n🌡️ Frescor do estoque por faixa:")
+        for faixa in ORDEM_FAIXAS:
+            skus = [s for s in self.produtos if self.faixa[s] == faixa]
+            if not skus: continue
+            vencidos = sum(1 for s in skus if self.idade[s] >= max(FAIXAS[faixa], 1))
+            idades = [self.idade[s] for s in skus if self.idade[s] != math.inf]
+            nunca = len(skus) - len(idades)
+            mais_antigo = f"{max(idades):.0f}h" if idades else "-"
+            print(f"   {faixa:<6} {len(skus):>6} SKUs | vencidos: {vencidos} | mais antigo: {mais_antigo} | nunca verificados: {nunca}")
@@ -0,0 +1,114 @@
+import sys
+import time
+from escrita_supabase import upsert_lote
+from leitura_supabase import buscar_tudo
+
+# --- ÁRVORE DE CATEGORIAS EM MEMÓRIA ---
+# A tabela 'categorias' inteira é carregada UMA vez por processo num índice id -> nó.
+# Ids desconhecidos são resolvidos com a cadeia de pais inteira em passadas em lote no Bling
+# (um nível da árvore por passada), e só nós novos ou alterados são gravados.
+# Ancestrais e caminho saem do índice em O(profundidade), para as rollups por categoria
+# (snapshot 'categorias' do dashboard). Num processo longo (daemon) o índice é recarregado quando
+# passa de IDADE_MAXIMA: categorias criadas por outro processo (webhook) entram no ciclo seguinte.
+TABELA_CATEGORIAS = "categorias"
+IDADE_MAXIMA = 60 * 60 # Segundos (o intervalo do sync de produtos no daemon)
+
+def no_categoria(cat):
+    """Categoria do Bling (listagem ou detalhe) -> linha de 'categorias'."""
+    return {
+        "id": cat.get('id'),
+        "descricao": cat.get('descricao', 'Nova Categoria'),
+        "id_categoria_pai": (cat.get('categoriaPai') or {}).get('id') or None
+    }
+
+class ArvoreCategorias:
+    def __init__(self):
+        self.nos = {}
+        self.carregada = False
+        self.carregada_em = 0.0
+
+    def carregar(self, forcar=False, max_idade=None):
+        """Carrega a tabela se ainda não carregou, se 'forcar' ou se a carga tem mais de 'max_idade' segundos."""
+        vencida = max_idade is not None and time.monotonic() - self.carregada_em > max_idade
+        if self.carregada and not forcar and not vencida: return self
+        self.nos = {l['id']: l for l in buscar_tudo(TABELA_CATEGORIAS, select="id,descricao,id_categoria_pai")}
+        self.carregada = True
+        self.carregada_em = time.monotonic()
+        print(f"📂 Árvore de categorias carregada: {len(self.nos)} nó(s).")
+        return self
+
+    def gravar(self, nos):
+        """Upsert só do que é novo ou mudou em relação ao índice. Retorna quantos foram gravados."""
+        self.carregar()
+        alterados = [n for n in {n['id']: n for n in nos if n.get('id')}.values() if self.nos.get(n['id']) != n]
+        if not alterados: return 0
+
+        rejeitadas = []
+        gravados, _ = upsert_lote(TABELA_CATEGORIAS, alterados, on_conflict="id", rejeitadas=rejeitadas)
+        ids_rejeitados = {n['id'] for n in rejeitadas}
+        for n in alterados:
+            if n['id'] not in ids_rejeitados: self.nos[n['id']] = n
+        return gravados
+
+    def resolver(self, service, ids):
+        """Garante no banco as categorias de 'ids' e toda a cadeia de pais, buscando no Bling só o que falta."""
+        self.carregar()
+        pendentes = {i for i in ids if i and i not in self.nos}
+        novos = {}
+        while pendentes:
+            pais = set()
+            for id_cat, cat, erro in service.buscar_detalhes("/categorias/produtos/{}", sorted(pendentes)):
+                if erro or not cat:
+                    print(f"   ⚠️ Categoria {id_cat} não encontrada no Bling: {erro or 'detalhe vazio'}")
+                    continue
+                no = no_categoria(cat)
+                novos[no['id']] = no
+                if no['id_categoria_pai']: pais.add(no['id_categoria_pai'])
+            pendentes = pais - set(novos) - set(self.nos)
+
+        # Um upsert só com a cadeia inteira: a FK do pai é checada no fim do comando
+        gravados = self.gravar(list(novos.values()))
+        if gravados: print(f"   📂 {gravados} categoria(s) nova(s) cadastrada(s).")
+        return gravados
+
+    def ancestrais(self, id_categoria):
+        """Ids da categoria até a raiz (ela mesma primeiro). Para em ciclo ou pai desconhecido."""
+        cadeia = []
+        atual = id_categoria
+        while atual in self.nos and atual not in cadeia:
+            cadeia.append(atual)
+            atual = self.nos[atual]['id_categoria_pai']
+        return cadeia
+
+    def raiz(self, id_categoria):
+        cadeia = self.ancestrais(id_categoria)
+        return cadeia[-1] if cadeia else None
+
+    def caminho(self, id_categoria, separador=" > "):
+        """Descrição completa, da raiz até a categoria (ex: 'Cama > Lençóis > Avulsos')."""
+        return separador.join(self.nos[i]['descricao'] for i in reversed(self.ancestrais(id_categoria)))
+
+    def somar_por_categoria(self, valores):
+        """
+        Rollup da árvore: {id_categoria: {métrica: valor}} -> o mesmo formato, com cada categoria somando
+        também as subcategorias. Categoria fora do índice fica só com o próprio valor.
+        """
+        totais = {}
+        for id_categoria, metricas in valores.items():
+            for no in self.ancestrais(id_categoria) or [id_categoria]:
+                total = totais.setdefault(no, {})
+                for metrica, valor in metricas.items():
+                    total[metrica] = total.get(metrica, 0) + valor
+        return totais
+
+# Uma árvore por processo: o daemon e os jobs da mesma execução compartilham o índice
+_arvore = ArvoreCategorias()
+
+def obter_arvore(max_idade=IDADE_MAXIMA):
+    return _arvore.carregar(max_idade=max_idade)
+
+if __name__ == "__main__":
+    # Uso: python scripts/arvore_categorias.py ID_CATEGORIA...
+    arvore = obter_arvore()
+    for arg in sys.argv[1:]:
+        print(f"{arg}: {arvore.caminho(int(arg)) or 'desconhecida'}")
@@ -1,11 +1,9 @@
-import os
 import requests
-import pandas as pd
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
+from bling_service import SUPABASE_URL, SUPABASE_KEY
+from leitura_supabase import buscar_tudo
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 HEADERS = {
     "apikey": SUPABASE_KEY,
     "Authorization": f"Bearer {SUPABASE_KEY}",
@@ -13,62 +11,57 @@ HEADERS = {
     "Prefer": "resolution=merge-duplicates"
 }
 
+def _num(v):
+    try: return float(v or 0)
+    except (TypeError, ValueError): return 0.0
+
 def processar_diario():
-    tz = pytz.timezone('America/Sao_Paulo')
-    hoje_br = datetime.now(tz).strftime("%Y-%m-%d")
-    
+    hoje_br = datetime.now(ZoneInfo('America/Sao_Paulo')).strftime("%Y-%m-%d")
+
     print("⏳ Puxando dados da View Materializada...")
-    
-    # 1. Puxamos TODOS os dados necessários para aplicar as regras de negócio
-    url_est = f"{SUPABASE_URL}/rest/v1/mview_dashboard_completa?select=sku,tipo,custo_final,est_total,est_loja,est_site,est_full,v_qtd_120d_geral,qtd_andamento"
-    
-    # Busca com paginação para garantir que vem a base inteira (caso passe de 1000 que é o limite padrão do postgrest)
-    all_data = []
-    offset = 0
-    limit = 5000
-    while True:
-        r = requests.get(f"{url_est}&offset={offset}&limit={limit}", headers=HEADERS)
-        if r.status_code != 200:
-            print(f"❌ Erro ao buscar dados: {r.text}")
-            return
-        
-        lote = r.json()
-        if not lote:
-            break
-            
-        all_data.extend(lote)
-        offset += limit
 
-    df = pd.DataFrame(all_data)
-    if df.empty: 
+    # 1. Puxamos TODOS os dados necessários para aplicar as regras de negócio (paginado: o PostgREST corta em 1000)
+    try:
+        linhas = buscar_tudo(
+            "mview_dashboard_completa",
+            select="sku,tipo,custo_final,est_total,est_loja,est_site,est_full,v_qtd_120d_geral,qtd_andamento"
+        )
+    except Exception as e:
+        print(f"❌ Erro ao buscar dados: {e}")
+        return
+
+    if not linhas:
         print("⚠️ Tabela vazia.")
         return
 
-    # Converte tudo para numérico garantindo que nulos sejam 0
-    cols_numericas = ['custo_final', 'est_total', 'est_loja', 'est_site', 'est_full', 'v_qtd_120d_geral', 'qtd_andamento']
-    for col in cols_numericas:
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    # Custo de entrada mantido pelo motor de custo (custos_sku); o custo_final da view só vale para SKU sem compra atendida
+    try:
+        custos = {c['sku']: c['custo_medio'] for c in buscar_tudo("custos_sku", select="sku,custo_medio") if c.get('custo_medio') is not None}
+    except Exception:
+        custos = {}
+    if not custos:
+        print("⚠️ custos_sku indisponível. Usando o custo_final da view.")
 
-    # 2. APLICAMOS A TRAVA DE KIT (Igual ao React: if p.tipo !== 'E')
-    df = df[df['tipo'] != 'E'].copy()
+    total_est_loja = 0.0
+    total_est_site = 0.0
+    for l in linhas:
+        # 2. APLICAMOS A TRAVA DE KIT (Igual ao React: if p.tipo !== 'E')
+        if l.get('tipo') == 'E': continue
 
-    # 3. APLICAMOS O FILTRO DE PRODUTOS INATIVOS (A mesma lógica do isProductInCanal do React)
-    # No dashboard geral, ele só processa se: est_total != 0 OR v_qtd_120d_geral > 0 OR qtd_andamento > 0
-    filtro_ativo = (df['est_total'] != 0) | (df['v_qtd_120d_geral'] > 0) | (df['qtd_andamento'] > 0)
-    df = df[filtro_ativo]
+        # 3. APLICAMOS O FILTRO DE PRODUTOS INATIVOS (A mesma lógica do isProductInCanal do React)
+        # No dashboard geral, ele só processa se: est_total != 0 OR v_qtd_120d_geral > 0 OR qtd_andamento > 0
+        if not (_num(l.get('est_total')) != 0 or _num(l.get('v_qtd_120d_geral')) > 0 or _num(l.get('qtd_andamento')) > 0):
+            continue
 
-    # 4. Fazemos os cálculos FINAIS DE VALOR
-    # Como já filtramos, agora é só multiplicar a quantidade física atual pelo custo final unitário
-    total_est_loja = (df['est_loja'] * df['custo_final']).sum()
-    
-    # O site soma o físico do site mais o físico do full
-    df['estoque_site_total'] = df['est_site'] + df['est_full']
-    total_est_site = (df['estoque_site_total'] * df['custo_final']).sum()
+        # 4. Quantidade física atual x custo final unitário. O site soma o físico do site mais o físico do full
+        custo = _num(custos.get(l['sku'], l.get('custo_final')))
+        total_est_loja += _num(l.get('est_loja')) * custo
+        total_est_site += (_num(l.get('est_site')) + _num(l.get('est_full'))) * custo
 
     payload = {
         "data": hoje_br,
-        "estoque_loja": float(total_est_loja),
-        "estoque_site": float(total_est_site)
+        "estoque_loja": total_est_loja,
+        "estoque_site": total_est_site
     }
 
     print(f"💰 Loja calculada: R$ {total_est_loja:,.2f}")
@@ -81,4 +74,4 @@ def processar_diario():
         print(f"❌ Erro ao salvar histórico: {r_post.text}")
 
 if __name__ == "__main__":
-    processar_diario()
\ No newline at end of file
+    processar_diario()
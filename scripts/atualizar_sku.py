@@ -0,0 +1,124 @@
+import sys
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from bling_service import BlingService, ErroBling
+from buffer_escrita import BufferEscrita
+from leitura_supabase import buscar_por_ids
+from agenda_estoque import registrar_verificacao
+from sync_estoque import indexar_saldos, juntar_depositos, linhas_estoque_sku
+from indice_catalogo import obter_indice
+from lotes_saldos import EmpacotadorIds, URL_SALDOS, montar_query, url_recusada
+
+# --- ATUALIZAÇÃO RÁPIDA DE SKUs ESPECÍFICOS ---
+# Para quando o time precisa do estoque REAL de poucos produtos agora, sem esperar o sync:
+# resolve os ids do Bling nas duas contas, busca os saldos em paralelo, grava só essas linhas
+# e devolve estoque + compras em andamento + últimas vendas.
+CONTAS_ESTOQUE = {"PORTFIO": "id_bling_portfio", "PORTCASA": "id_bling_portcasa"}
+DIAS_VENDAS_RECENTES = 30
+
+def _buscar_saldos(nome_loja, ids):
+    """Saldos de uma conta por id conferido (id sumido da resposta = {}), em lotes do tamanho que a URL comporta."""
+    service = BlingService(nome_loja)
+    endpoint = URL_SALDOS.replace(service.base_url, "")
+    empacotador = EmpacotadorIds(ids)
+    saldos = {}
+    while True:
+        lote = empacotador.proximo()
+        if not lote: break
+        try:
+            retornados = indexar_saldos(service.get_detalhe(f"{endpoint}?{montar_query(lote)}") or [])
+            saldos.update({id_bling: retornados.get(id_bling, {}) for id_bling in lote})
+            empacotador.enviado(lote)
+        except ErroBling as e:
+            if e.status == 400 and len(lote) == 1:
+                print(f"   ⚠️ {nome_loja}: id {lote[0]} recusado pelo Bling ({e}). Ignorado.")
+                continue
+            if not (url_recusada(e.status, lote) and empacotador.recusado(lote, e.status)): raise
+    return saldos
+
+def _resumo_documentos(skus):
+    """Compras em andamento e vendas recentes, direto do banco (o webhook já mantém esses documentos em dia)."""
+    compras = buscar_por_ids(
+        "compras_pedidos", "sku", skus, select="sku,quantidade,data_prevista,fornecedor", filtros="situacao=eq.Em Andamento"
+    )
+    data_corte = (datetime.now() - timedelta(days=DIAS_VENDAS_RECENTES)).strftime("%Y-%m-%d")
+    vendas = buscar_por_ids(
+        "vendas_diarias", "sku", skus, select="sku,data,canal,qtd_vendida,receita", filtros=f"data=gte.{data_corte}&order=data.desc"
+    )
+    return compras, vendas
+
+def atualizar_skus(skus, atualizar_view=False):
+    """Atualiza o estoque dos SKUs informados e retorna {sku: {estoque, compras_andamento, vendas_30d, ultima_venda}}."""
+    inicio = time.monotonic()
+    skus = list(dict.fromkeys(skus))
+    indice = obter_indice()
+
+    # id do Bling -> SKU, por conta (direto do índice local, sem consultar o banco)
+    mapas = {loja: {indice.id_de(loja, s): s for s in skus if indice.id_de(loja, s)} for loja in CONTAS_ESTOQUE}
+    sem_id = {s for s in skus if indice.codigo(s) is None}
+    if sem_id: print(f"⚠️ SKU(s) fora do catálogo: {', '.join(sorted(sem_id))}")
+
+    # Saldos das duas contas e documentos do banco ao mesmo tempo
+    with ThreadPoolExecutor(max_workers=len(CONTAS_ESTOQUE) + 1) as pool:
+        futuros = {loja: pool.submit(_buscar_saldos, loja, list(mapa.keys())) for loja, mapa in mapas.items() if mapa}
+        futuro_docs = pool.submit(_resumo_documentos, skus)
+
+        conferidos = {}
+        for loja, futuro in futuros.items():
+            try:
+                conferidos[loja] = futuro.result()
+            except Exception as e:
+                print(f"❌ Falha ao buscar saldos em {loja}: {e}")
+        compras, vendas = futuro_docs.result()
+
+    # Mesmas linhas do sync_estoque: depósitos das duas contas juntos; SKU sem resposta de uma conta fica de fora
+    depositos, incompletos = juntar_depositos(mapas, conferidos)
+    if incompletos:
+        print(f"⚠️ {len(incompletos)} SKU(s) não gravados (faltou o saldo de uma das contas): {', '.join(sorted(incompletos))}")
+    verificados = set(depositos)
+
+    buffer_estoque = BufferEscrita("estoque", chave_documento="sku")
+    for sku in verificados:
+        buffer_estoque.adicionar(linhas_estoque_sku(sku, depositos.get(sku, {})))
+    buffer_estoque.descarregar()
+    if verificados:
+        registrar_verificacao({s: "QUENTE" for s in verificados})
+        try:
+            from estoque_kits import atualizar_kits
+            atualizar_kits(sorted(verificados))
+        except Exception as e:
+            print(f"⚠️ Disponibilidade dos kits não atualizada: {e}")
+
+    resultado = {}
+    for sku in skus:
+        linhas = linhas_estoque_sku(sku, depositos.get(sku, {})) if sku in verificados else []
+        vendas_sku = [v for v in vendas if v['sku'] == sku]
+        resultado[sku] = {
+            "estoque": {l['canal']: l['quantidade'] for l in linhas},
+            "compras_andamento": sum(float(c.get('quantidade') or 0) for c in compras if c['sku'] == sku),
+            "vendas_30d": sum(float(v.get('qtd_vendida') or 0) for v in vendas_sku),
+            "ultima_venda": vendas_sku[0]['data'] if vendas_sku else None
+        }
+
+    if atualizar_view:
+        # Import tardio: só quem pede a view paga o custo do refresh + snapshot
+        from snapshots_dashboard import atualizar_dashboard
+        atualizar_dashboard(["estoque"])
+
+    print(f"⚡ {len(verificados)} de {len(skus)} SKU(s) atualizados em {time.monotonic() - inicio:.1f}s.")
+    return resultado
+
+if __name__ == "__main__":
+    # Uso: python scripts/atualizar_sku.py SKU [SKU ...] [--dashboard]
+    skus = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if not skus:
+        print("Uso: python scripts/atualizar_sku.py SKU [SKU ...] [--dashboard]")
+        sys.exit(1)
+
+    for sku, info in atualizar_skus(skus, atualizar_view="--dashboard" in sys.argv).items():
+        est = info['estoque']
+        print(f"\n📦 {sku}")
+        print(f"   Estoque: Loja {est.get('LOJA', '-')} | Site {est.get('SITE', '-')} | Full {est.get('FULL', '-')}")
+        print(f"   Compras em andamento: {info['compras_andamento']:g}")
+        print(f"   Vendas {DIAS_VENDAS_RECENTES}d: {info['vendas_30d']:g} | Última venda: {info['ultima_venda'] or '-'}")
@@ -3,10 +3,17 @@ import requests
 import base64
 import time
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
-# Carrega variáveis de ambiente
+# Carrega variáveis de ambiente (uma vez por processo, mesmo que chamada de novo pela CLI)
+_env_carregado = False
+
 def load_env():
+    global _env_carregado
+    if _env_carregado: return
+    _env_carregado = True
     possible_paths = [
         '.env', 
         '../.env', 
@@ -33,10 +40,81 @@ load_env()
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
+# Limite do Bling: 3 requisições por segundo POR CONTA
+REQ_POR_SEGUNDO = 3
+
+# Renovação do token: validade da trava 'token:<loja>' (segundos). Quem não tem a trava espera o outro terminar
+TRAVA_RENOVACAO = 30
+
+def _expiracao(raw_date):
+    """expires_at do banco -> datetime UTC."""
+    # Limpa a string da data para evitar erro de formato
+    # Ex: "2026-02-19T08:49:34.17+00:00" -> "2026-02-19T08:49:34"
+    clean_date = raw_date.split('+')[0].split('.')[0].replace('Z', '')
+    return datetime.fromisoformat(clean_date).replace(tzinfo=timezone.utc)
+
+class ErroBling(Exception):
+    def __init__(self, status, mensagem):
+        super().__init__(f"{status}: {mensagem}")
+        self.status = status
+
+class LimitadorTaxa:
+    """Espaça as chamadas de todas as threads de uma conta para não passar de N req/s."""
+
+    def __init__(self, req_por_segundo):
+        self.intervalo = 1.0 / req_por_segundo
+        self.proxima = 0.0
+        self.lock = threading.Lock()
+
+    def aguardar(self):
+        with self.lock:
+            agora = time.monotonic()
+            espera = self.proxima - agora
+            self.proxima = max(agora, self.proxima) + self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+# Um limitador por conta, compartilhado por todas as instâncias do processo
+_limitadores = {}
+_limitadores_lock = threading.Lock()
+
+def obter_limitador(nome_loja):
+    with _limitadores_lock:
+        if nome_loja not in _limitadores:
+            _limitadores[nome_loja] = LimitadorTaxa(REQ_POR_SEGUNDO)
+        return _limitadores[nome_loja]
+
+class EstadoConta:
+    """Sessão HTTP e token em memória de uma conta. Compartilhado por todas as instâncias do processo,
+    então um processo longo (daemon) reaproveita conexões e token entre ciclos."""
+
+    def __init__(self):
+        self.sessao = requests.Session()
+        self.token_lock = threading.Lock()
+        self.token_cache = None # (access_token, expires_at) para não consultar o banco a cada chamada
+        self.chamadas = 0       # Chamadas à API do Bling feitas por este processo (cota diária da conta)
+        self.chamadas_lock = threading.Lock()
+
+_estados = {}
+
+def obter_estado(nome_loja):
+    with _limitadores_lock:
+        if nome_loja not in _estados:
+            _estados[nome_loja] = EstadoConta()
+        return _estados[nome_loja]
+
+def chamadas_por_conta():
+    """Total de chamadas ao Bling feitas pelo processo até agora, por conta."""
+    return {loja: estado.chamadas for loja, estado in _estados.items()}
+
 class BlingService:
     def __init__(self, nome_loja):
         self.nome_loja = nome_loja
         self.base_url = "https://www.bling.com.br/Api/v3"
+        self.limitador = obter_limitador(nome_loja)
+        self.estado = obter_estado(nome_loja)
+        self.sessao = self.estado.sessao
+        self._token_lock = self.estado.token_lock
         self.supabase_headers = {
             "apikey": SUPABASE_KEY,
             "Authorization": f"Bearer {SUPABASE_KEY}",
@@ -44,6 +122,10 @@ class BlingService:
             "Prefer": "resolution=merge-duplicates"
         }
 
+    def contar_chamada(self):
+        with self.estado.chamadas_lock:
+            self.estado.chamadas += 1
+
     def _get_tokens_db(self):
         """Busca os tokens salvos no Supabase"""
         url = f"{SUPABASE_URL}/rest/v1/integracoes_bling?nome_loja=eq.{self.nome_loja}&select=*"
@@ -52,13 +134,64 @@ class BlingService:
             return resp.json()[0]
         raise Exception(f"Loja {self.nome_loja} não encontrada no banco.")
 
-    def _update_tokens_db(self, new_data):
-        """Atualiza os tokens no Supabase"""
+    def _update_tokens_db(self, new_data, refresh_anterior=None):
+        """
+        Atualiza os tokens no Supabase. Com 'refresh_anterior' a escrita é condicional (compare-and-swap):
+        só grava se o banco ainda tiver esse refresh_token. Retorna se a linha foi gravada.
+        """
         url = f"{SUPABASE_URL}/rest/v1/integracoes_bling?nome_loja=eq.{self.nome_loja}"
-        requests.patch(url, headers=self.supabase_headers, json=new_data)
+        params = {"refresh_token": f"eq.{refresh_anterior}"} if refresh_anterior else None
+        resp = requests.patch(url, headers={**self.supabase_headers, "Prefer": "return=representation"}, json=new_data, params=params)
+        return resp.status_code == 200 and len(resp.json()) > 0
+
+    def _usar_tokens_db(self, data):
+        """Adota o token de uma linha de integracoes_bling (cache do processo) e o retorna."""
+        self.estado.token_cache = (data['access_token'], _expiracao(data['expires_at']))
+        return data['access_token']
 
     def _refresh_token(self, refresh_token):
-        """Força a renovação do token junto ao Bling"""
+        """
+        Renova o token a partir do 'refresh_token' visto pelo chamador. O Bling gira o refresh_token a cada
+        renovação: dois processos renovando juntos invalidam um ao outro. Só quem tem a trava 'token:<loja>'
+        chama o Bling; os outros esperam o refresh_token do banco mudar e reaproveitam o token novo.
+        """
+        from travas import adquirir_trava, liberar_trava, DONO
+        trava = f"token:{self.nome_loja}"
+        dono = f"{DONO}:{threading.get_ident()}"
+        limite = time.monotonic() + 2 * TRAVA_RENOVACAO
+        while True:
+            obtida = adquirir_trava(trava, TRAVA_RENOVACAO, dono)
+            if obtida is not False: # None: sem a tabela de travas, renova como antes
+                try:
+                    data = self._get_tokens_db()
+                    if data['refresh_token'] != refresh_token:
+                        print(f"🔁 Token de {self.nome_loja} já renovado por outro processo. Reaproveitando.")
+                        return self._usar_tokens_db(data)
+                    return self._renovar_no_bling(refresh_token)
+                finally:
+                    if obtida: liberar_trava(trava, dono)
+
+            if time.monotonic() > limite:
+                raise Exception(f"Renovação do token de {self.nome_loja} travada por outro processo há mais de {2 * TRAVA_RENOVACAO}s")
+            time.sleep(1)
+            data = self._get_tokens_db()
+            if data['refresh_token'] != refresh_token:
+                print(f"🔁 Token de {self.nome_loja} renovado por outro processo. Reaproveitando.")
+                return self._usar_tokens_db(data)
+
+    def _token_rejeitado(self, token_falho):
+        """
+        401 com 'token_falho'. Se o banco já tem outro access_token (outro processo renovou), adota ele;
+        só renova quando o token rejeitado é o do banco, a partir do refresh_token que veio junto com ele.
+        """
+        data = self._get_tokens_db()
+        if data['access_token'] != token_falho:
+            print(f"🔁 Token de {self.nome_loja} já renovado por outro processo. Reaproveitando.")
+            return self._usar_tokens_db(data)
+        return self._refresh_token(data['refresh_token'])
+
+    def _renovar_no_bling(self, refresh_token):
+        """Troca o refresh_token por um par novo junto ao Bling (chamado só por quem tem a trava)."""
         print(f"🔄 Renovando token para {self.nome_loja}...")
         client_id = os.environ.get(f"BLING_CLIENT_ID_{self.nome_loja}")
         client_secret = os.environ.get(f"BLING_SECRET_{self.nome_loja}")
@@ -88,29 +221,29 @@ class BlingService:
                 "expires_at": expires_at.isoformat(),
                 "updated_at": datetime.now().isoformat()
             }
-            self._update_tokens_db(new_db_data)
+            if not self._update_tokens_db(new_db_data, refresh_anterior=refresh_token):
+                # Outro processo gravou no meio (trava expirada?): o banco fica como está, o token novo vale só aqui
+                print(f"⚠️ refresh_token de {self.nome_loja} mudou no banco durante a renovação. Token novo usado só neste processo.")
+            self.estado.token_cache = (data['access_token'], datetime.now(timezone.utc) + timedelta(seconds=data['expires_in']))
             return data['access_token']
         else:
             raise Exception(f"Erro ao renovar token: {resp.text}")
 
     def get_valid_token(self):
         """Retorna um token válido, renovando se necessário (buffer de 5 min)"""
+        cache = self.estado.token_cache
+        if cache and datetime.now(timezone.utc) < (cache[1] - timedelta(minutes=5)):
+            return cache[0]
+
         data = self._get_tokens_db()
-        
-        # Limpa a string da data para evitar erro de formato
-        # Ex: "2026-02-19T08:49:34.17+00:00" -> "2026-02-19T08:49:34"
-        raw_date = data['expires_at']
-        clean_date = raw_date.split('+')[0].split('.')[0].replace('Z', '')
-        
-        # Converte para datetime e aplica o fuso UTC
-        expires_at = datetime.fromisoformat(clean_date).replace(tzinfo=timezone.utc)
-        
+        expires_at = _expiracao(data['expires_at'])
         agora = datetime.now(timezone.utc)
 
         # Se faltam menos de 5 minutos para expirar, renova
         if agora > (expires_at - timedelta(minutes=5)):
             return self._refresh_token(data['refresh_token'])
         
+        self.estado.token_cache = (data['access_token'], expires_at)
         return data['access_token']
 
     def get_all_pages(self, endpoint, params=None):
@@ -129,14 +262,16 @@ class BlingService:
             try:
                 print(f"📥 {self.nome_loja}: Baixando {endpoint} (Pág {pagina})...")
                 resp = requests.get(f"{self.base_url}{endpoint}", headers=headers, params=params)
+                self.contar_chamada()
                 
                 # Caso o token expire EXATAMENTE entre a verificação e a chamada
                 if resp.status_code == 401:
                     print("⚠️ Token invalidado durante a chamada. Tentando refresh forçado...")
-                    data_db = self._get_tokens_db()
-                    token = self._refresh_token(data_db['refresh_token'])
+                    with self._token_lock:
+                        token = self._token_rejeitado(token)
                     headers = {"Authorization": f"Bearer {token}"}
                     resp = requests.get(f"{self.base_url}{endpoint}", headers=headers, params=params)
+                    self.contar_chamada()
 
                 if resp.status_code == 429:
                     print("⏳ Rate limit atingido. Esperando 3 segundos...")
@@ -162,4 +297,42 @@ class BlingService:
             except Exception as e:
                 print(f"⚠️ Erro na requisição da pág {pagina}: {e}")
                 time.sleep(5)
-                continue
\ No newline at end of file
+                continue
+
+    def get_detalhe(self, endpoint, max_retries=3):
+        """GET de um recurso (ex: /pedidos/vendas/123) respeitando o limite da conta. Retorna o 'data' ou lança ErroBling."""
+        for tentativa in range(max_retries):
+            self.limitador.aguardar()
+            with self._token_lock:
+                token = self.get_valid_token()
+            resp = self.sessao.get(f"{self.base_url}{endpoint}", headers={"Authorization": f"Bearer {token}"})
+            self.contar_chamada()
+
+            if resp.status_code == 200:
+                return resp.json().get('data')
+            if resp.status_code == 429:
+                espera = 2 ** tentativa
+                print(f"   ⏳ Rate Limit (429) em {endpoint}. Aguardando {espera}s...")
+                time.sleep(espera)
+                continue
+            if resp.status_code == 401 and tentativa == 0:
+                with self._token_lock:
+                    self._token_rejeitado(token)
+                continue
+            raise ErroBling(resp.status_code, resp.text[:300])
+
+        raise ErroBling(429, f"Rate limit persistente após {max_retries} tentativas")
+
+    def buscar_detalhes(self, endpoint_modelo, ids, max_workers=REQ_POR_SEGUNDO):
+        """
+        Busca vários detalhes em paralelo (ex: "/nfe/{}") sob o limitador da conta.
+        Gera (id, data, erro) na ordem dos ids; erro é None quando deu certo.
+        """
+        def buscar(id_doc):
+            try:
+                return id_doc, self.get_detalhe(endpoint_modelo.format(id_doc)), None
+            except Exception as e:
+                return id_doc, None, e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            yield from pool.map(buscar, ids)
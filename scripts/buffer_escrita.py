@@ -0,0 +1,167 @@
+import time
+from escrita_supabase import upsert_lote
+from hash_documentos import CacheHashes
+from leitura_supabase import buscar_por_ids
+from rollup_vendas import MAPA_ROLLUP, DeltasRollup, colunas_rollup
+
+# --- REGRAS DE MESCLA POR TABELA ---
+# chave: colunas do ON CONFLICT da tabela
+# somar: colunas acumuladas quando o mesmo SKU se repete dentro do documento (valores de linha)
+# media_ponderada: colunas unitárias, ponderadas pela quantidade
+# Colunas fora das listas ficam com o valor da primeira ocorrência.
+REGRAS_MESCLA = {
+    "pedidos_venda": {
+        "chave": ("id", "sku"),
+        "somar": ["quantidade", "desconto", "frete", "valor_total_liquido"],
+        "media_ponderada": ["preco_unitario"]
+    },
+    "nfe_saida": {
+        "chave": ("id", "sku"),
+        "somar": ["quantidade", "desconto", "frete", "valor_total_liquido"],
+        "media_ponderada": ["preco_unitario"]
+    },
+    "devolucoes": {
+        "chave": ("id", "sku"),
+        "somar": ["quantidade", "valor_estorno"]
+    },
+    "compras_pedidos": {
+        "chave": ("id_pedido", "sku"),
+        "somar": ["quantidade"],
+        "media_ponderada": ["preco_unitario", "desconto", "frete", "ipi"]
+    },
+    "estoque": {"chave": ("sku", "canal")},
+    "produtos": {"chave": ("sku",)},
+    "composicoes": {"chave": ("sku_pai", "sku_filho")},
+    "categorias": {"chave": ("id",)}
+}
+
+def mesclar_linha(existente, nova, regra):
+    """Funde 'nova' em 'existente' (mesma chave) seguindo a regra da tabela."""
+    qtd_antiga = float(existente.get("quantidade", 0) or 0)
+    qtd_nova = float(nova.get("quantidade", 0) or 0)
+    qtd_total = qtd_antiga + qtd_nova
+
+    if qtd_total > 0:
+        for col in regra.get("media_ponderada", []):
+            existente[col] = ((float(existente.get(col, 0) or 0) * qtd_antiga) + (float(nova.get(col, 0) or 0) * qtd_nova)) / qtd_total
+
+    for col in regra.get("somar", []):
+        existente[col] = (existente.get(col, 0) or 0) + (nova.get(col, 0) or 0)
+
+class BufferEscrita:
+    """
+    Buffer de escrita que consolida linhas pela chave de conflito da tabela durante TODA a execução.
+    Evita o "ON CONFLICT DO UPDATE cannot affect row a second time" quando um documento repete SKU
+    e descarrega sozinho ao atingir o limite de linhas ou de tempo.
+
+    Com 'chave_documento' (ex: "id", "id_pedido", "sku"), o buffer compara o hash do documento com o
+    último gravado e pula a reescrita dos que não mudaram. Nas tabelas de vendas, cada descarga também
+    aplica na rollup diária a diferença entre as linhas novas e as que elas sobrescreveram.
+    'nome_hash' separa os hashes quando várias contas gravam versões diferentes do mesmo documento (ex: produtos).
+    """
+
+    def __init__(self, tabela, limite_linhas=500, limite_segundos=60, chave_documento=None, ao_gravar=None, nome_hash=None):
+        self.tabela = tabela
+        self.regra = REGRAS_MESCLA.get(tabela, {})
+        self.chave = self.regra.get("chave")
+        self.limite_linhas = limite_linhas
+        self.limite_segundos = limite_segundos
+        self.linhas = {}
+        self.ultima_descarga = time.monotonic()
+        self.total_gravado = 0
+        self.total_rejeitado = 0
+        self.chave_documento = chave_documento
+        self.hashes = CacheHashes(nome_hash or tabela) if chave_documento else None
+        self.documentos = set()
+        self.rollup = DeltasRollup() if chave_documento and tabela in MAPA_ROLLUP else None
+        self.ao_gravar = ao_gravar # Callback com as linhas aceitas pelo banco em cada descarga
+
+    def _chave(self, linha):
+        if not self.chave: return id(linha)
+        return tuple(linha.get(c) for c in self.chave)
+
+    def adicionar(self, linhas, forcar=False):
+        """
+        Recebe as linhas de UM documento. SKUs repetidos dentro do documento são somados;
+        se o mesmo documento já estava no buffer (reprocessado na mesma execução), a versão nova substitui a antiga.
+        'forcar': o documento falta ou diverge no banco, então é gravado mesmo com o hash igual ao último gravado.
+        """
+        documento = {}
+        for linha in linhas:
+            k = self._chave(linha)
+            if k in documento:
+                mesclar_linha(documento[k], linha, self.regra)
+            else:
+                documento[k] = dict(linha)
+
+        if not documento: return
+
+        if self.hashes:
+            id_documento = linhas[0][self.chave_documento]
+            if not self.hashes.alterado(id_documento, list(documento.values()), forcar):
+                return
+            self.documentos.add(id_documento)
+
+        self.linhas.update(documento)
+
+        if len(self.linhas) >= self.limite_linhas or (time.monotonic() - self.ultima_descarga) >= self.limite_segundos:
+            self.descarregar()
+
+    def pre_carregar(self, ids_documentos):
+        """Carrega de uma vez os hashes de uma página de documentos (evita uma consulta por documento)."""
+        if self.hashes: self.hashes.carregar(ids_documentos)
+
+    def descarregar(self):
+        self.ultima_descarga = time.monotonic()
+        if not self.linhas: return 0
+
+        lote = list(self.linhas.values())
+        documentos = self.documentos
+        self.linhas = {}
+        self.documentos = set()
+
+        # Linhas que serão sobrescritas: lidas ANTES do upsert para calcular o delta da rollup
+        anteriores = self._linhas_anteriores(lote) if self.rollup is not None else None
+
+        linhas_rejeitadas = []
+        gravados, rejeitados = upsert_lote(self.tabela, lote, rejeitadas=linhas_rejeitadas)
+        self.total_gravado += gravados
+        self.total_rejeitado += rejeitados
+
+        # Só confirma o hash dos documentos aceitos por inteiro; os outros são reescritos na próxima execução
+        if self.hashes:
+            docs_rejeitados = {str(l.get(self.chave_documento)) for l in linhas_rejeitadas}
+            self.hashes.descartar(docs_rejeitados)
+            self.hashes.confirmar([d for d in documentos if str(d) not in docs_rejeitados])
+
+        chaves_rejeitadas = {self._chave(l) for l in linhas_rejeitadas}
+        aceitas = [l for l in lote if self._chave(l) not in chaves_rejeitadas]
+
+        if anteriores is not None:
+            self.rollup.somar(self.tabela, [anteriores[self._chave(l)] for l in aceitas if self._chave(l) in anteriores], sinal=-1)
+            self.rollup.somar(self.tabela, aceitas)
+            self.rollup.aplicar()
+
+        if self.ao_gravar and aceitas:
+            self.ao_gravar(aceitas)
+
+        if gravados:
+            print(f"   ✅ {gravados} registros em {self.tabela} sincronizados (Upsert).")
+        return gravados
+
+    def _linhas_anteriores(self, lote):
+        """Versão atual no banco das linhas do lote, indexada pela chave de conflito (None se a leitura falhar)."""
+        ids = list({l[self.chave_documento] for l in lote})
+        try:
+            atuais = buscar_por_ids(self.tabela, self.chave_documento, ids, select=colunas_rollup(self.tabela))
+        except Exception as e:
+            # Sem a versão anterior o delta sairia errado: esses dias ficam para a reconstrução da janela
+            print(f"   ⚠️ Rollup de {self.tabela} não atualizada nesta descarga: {e}")
+            return None
+        return {self._chave(l): l for l in atuais}
+
+    def resumo(self):
+        return self.hashes.resumo() if self.hashes else ""
+
+    def __len__(self):
+        return len(self.linhas)
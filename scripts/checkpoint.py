@@ -0,0 +1,89 @@
+import sys
+import time
+import requests
+from datetime import datetime, timezone
+from bling_service import SUPABASE_URL
+from escrita_supabase import cabecalhos_supabase
+from leitura_supabase import buscar_tudo
+
+# --- EXECUÇÃO COM PRAZO E RETOMADA ---
+# O GitHub Actions mata o job no timeout e uma varredura longa cortada no meio recomeça do zero.
+# Com prazo, o job para entre dois passos (página, período...) antes do tempo acabar, grava o cursor
+# em 'sync_checkpoints' e a próxima execução continua dali. Varreduras grandes terminam em várias
+# execuções curtas. A linha é apagada quando a varredura termina.
+TABELA_CHECKPOINTS = "sync_checkpoints"
+FOLGA_PRAZO = 60 # Segundos de reserva para o fechamento (descarga dos buffers, métricas, checkpoint)
+
+class PrazoExecucao:
+    """Orçamento de tempo de uma execução. 'esgotado' já conta com o passo mais lento visto até agora."""
+
+    def __init__(self, segundos, folga=FOLGA_PRAZO):
+        self.segundos = segundos
+        self.folga = folga
+        self.inicio = time.monotonic()
+        self.maior_passo = 0.0
+
+    def restante(self):
+        return self.segundos - (time.monotonic() - self.inicio)
+
+    def passo(self, duracao):
+        self.maior_passo = max(self.maior_passo, duracao)
+
+    def esgotado(self):
+        """Não cabe mais um passo (o mais lento até aqui) com a folga de fechamento."""
+        return self.restante() < self.maior_passo + self.folga
+
+def ler_prazo(argv=None):
+    """--prazo=MINUTOS da linha de comando -> PrazoExecucao (None = sem prazo)."""
+    minutos = next((float(a.split("=", 1)[1]) for a in (argv or sys.argv) if a.startswith("--prazo=")), None)
+    return PrazoExecucao(minutos * 60) if minutos else None
+
+class Checkpoint:
+    """Cursor persistido de uma varredura ('job' identifica a varredura)."""
+
+    def __init__(self, job):
+        self.job = job
+        self.execucoes = 0
+        self.iniciado_em = None
+
+    def carregar(self):
+        """Cursor salvo pela execução anterior (None = começar do início)."""
+        try:
+            linhas = buscar_tudo(TABELA_CHECKPOINTS, select="cursor,execucoes,iniciado_em", filtros=f"job=eq.{self.job}")
+        except Exception as e:
+            print(f"   ⚠️ Checkpoint de {self.job} não lido ({e}). Começando do início.")
+            return None
+        if not linhas: return None
+        self.execucoes = linhas[0]['execucoes']
+        self.iniciado_em = linhas[0]['iniciado_em']
+        print(f"⏯️ Retomando {self.job} (execução {self.execucoes + 1} da varredura iniciada em {self.iniciado_em[:16]}).")
+        return linhas[0]['cursor']
+
+    def salvar(self, cursor):
+        agora = datetime.now(timezone.utc).isoformat()
+        registro = {
+            "job": self.job, "cursor": cursor, "execucoes": self.execucoes + 1,
+            "iniciado_em": self.iniciado_em or agora, "atualizado_em": agora
+        }
+        try:
+            r = requests.post(
+                f"{SUPABASE_URL}/rest/v1/{TABELA_CHECKPOINTS}", headers=cabecalhos_supabase(),
+                json=registro, params={"on_conflict": "job"}
+            )
+            if r.status_code not in [200, 201, 204]:
+                print(f"   ⚠️ Checkpoint de {self.job} não gravado: {r.text}")
+                return False
+        except Exception as e:
+            print(f"   ⚠️ Checkpoint de {self.job} não gravado: {e}")
+            return False
+        print(f"💾 Prazo esgotado: {self.job} continua na próxima execução.")
+        return True
+
+    def concluir(self):
+        """Varredura terminou: a próxima execução começa do início."""
+        if self.iniciado_em is None: return
+        try:
+            requests.delete(f"{SUPABASE_URL}/rest/v1/{TABELA_CHECKPOINTS}?job=eq.{self.job}", headers=cabecalhos_supabase(upsert=False))
+            print(f"🏁 Varredura de {self.job} concluída em {self.execucoes + 1} execução(ões).")
+        except Exception as e:
+            print(f"   ⚠️ Checkpoint de {self.job} não apagado: {e}")
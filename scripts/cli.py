@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import runpy
+import importlib
+
+# --- PONTO DE ENTRADA ÚNICO DOS JOBS ---
+# Uso: python scripts/cli.py <subcomando> [argumentos do script]   (ou: python -m scripts.cli ...)
+# A configuração (.env) é carregada uma vez e só o módulo do subcomando é importado:
+# pandas/numpy entram apenas nos subcomandos que usam. Os argumentos seguem para o script como se
+# ele tivesse sido chamado direto, então o comportamento é o mesmo do 'python scripts/<script>.py'.
+# --profile-startup: importa e inicializa o subcomando, mostra os tempos e sai sem rodar o job.
+PASTA_SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+# subcomando -> (módulo, descrição)
+SUBCOMANDOS = {
+    "estoque": ("sync_estoque", "Saldos de estoque [--escalonado] [--orcamento=N] [--limite-url=N]"),
+    "sku": ("atualizar_sku", "Estoque agora de SKUs específicos: SKU... [--dashboard]"),
+    "kits": ("estoque_kits", "Disponibilidade dos kits pelos componentes [SKU...]"),
+    "compras": ("sync_pedidos_compra", "Pedidos de compra (e custo médio) [--prazo=MINUTOS]"),
+    "pedidos": ("reconciliacao_pedidos", "Reconciliação de pedidos de venda [--completo]"),
+    "nfe": ("reconciliacao_nfe", "Reconciliação de NF-e de venda e devolução [--completo]"),
+    "fila": ("fila_webhook", "Drena a fila do webhook [--continuo]"),
+    "produtos": ("sync_produtos", "Catálogo incremental por data de alteração [--desde=AAAA-MM-DD]"),
+    "categorias": ("sync_categorias", "Árvore de categorias das duas contas"),
+    "composicoes": ("sync_composicoes", "Composições dos kits"),
+    "historico": ("atualizar_historico", "Valor do estoque de hoje em historico_resumo"),
+    "reconstruir-historico": ("reconstruir_historico", "Histórico de estoque de um período: inicio [fim] [--sobrescrever]"),
+    "fechamento": ("fechamento_diario", "Notificação de fechamento do dia anterior"),
+    "backfill": ("rollup_vendas", "Recalcula vendas_diarias de um período: inicio [fim] [--prazo=MINUTOS]"),
+    "custos": ("custo_medio", "Recalcula o custo médio [SKU...]"),
+    "dead-letter": ("dead_letter", "Reprocessa documentos que falharam [job] [loja]"),
+    "quarentena": ("escrita_supabase", "Reenvia linhas em quarentena [tabela]"),
+    "indice": ("indice_catalogo", "Índice local id do Bling <-> SKU [--reconstruir] [SKU...]"),
+    "frescor": ("metricas_sync", "Frescor de cada tabela e conta"),
+    "consumo": ("orcamento_api", "Cota do Bling: planejado x realizado de hoje"),
+    "daemon": ("daemon_sync", "Roda os jobs em micro-lotes num processo só [job=minutos...]"),
+    "orquestrador": ("orquestrador", "Roda os jobs em ordem de dependência: [noturno|horario] [--so=etapa,...]")
+}
+
+MODULOS_PESADOS = ["pandas", "numpy", "requests"]
+
+def ajuda():
+    print("Uso: python scripts/cli.py [--profile-startup] <subcomando> [argumentos]\n")
+    for nome, (_, descricao) in SUBCOMANDOS.items():
+        print(f"  {nome:<23}{descricao}")
+
+def main(argv):
+    perfil = "--profile-startup" in argv
+    argv = [a for a in argv if a != "--profile-startup"]
+    if not argv or argv[0] not in SUBCOMANDOS:
+        ajuda()
+        return 0 if not argv or argv[0] in ("-h", "--help") else 2
+
+    subcomando, args = argv[0], argv[1:]
+    modulo = SUBCOMANDOS[subcomando][0]
+    if PASTA_SCRIPTS not in sys.path: sys.path.insert(0, PASTA_SCRIPTS)
+
+    if perfil:
+        inicio = time.perf_counter()
+        modulos_antes = len(sys.modules)
+        importlib.import_module("bling_service") # Carrega o .env (uma vez) e a sessão HTTP
+        t_config = time.perf_counter()
+        importlib.import_module(modulo)
+        t_modulo = time.perf_counter()
+
+        print(f"⏱️ Startup de '{subcomando}' ({modulo}):")
+        print(f"   config + bling_service: {(t_config - inicio) * 1000:7.0f} ms")
+        print(f"   import de {modulo}: {(t_modulo - t_config) * 1000:7.0f} ms")
+        print(f"   total: {(t_modulo - inicio) * 1000:7.0f} ms | {len(sys.modules) - modulos_antes} módulo(s) carregados")
+        carregados = [m for m in MODULOS_PESADOS if m in sys.modules]
+        print(f"   pesados carregados: {', '.join(carregados) or 'nenhum'}")
+        return 0
+
+    # Mesmo comportamento do 'python scripts/<modulo>.py args'. O módulo não é importado antes:
+    # o código de nível de módulo roda uma vez só, já como __main__
+    sys.argv = [os.path.join(PASTA_SCRIPTS, f"{modulo}.py")] + args
+    runpy.run_module(modulo, run_name="__main__", alter_sys=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
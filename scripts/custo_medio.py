@@ -0,0 +1,141 @@
+import sys
+import bisect
+import requests
+from datetime import datetime
+from bling_service import SUPABASE_URL
+from escrita_supabase import cabecalhos_supabase, upsert_lote
+from leitura_supabase import buscar_por_ids, buscar_tudo
+
+# --- MOTOR DE CUSTO MÉDIO (CUSTO DE ENTRADA POR SKU) ---
+# Custo unitário de entrada = preço - desconto rateado + frete rateado + IPI exato (já calculados pelo sync de compras).
+# O custo do SKU é a média ponderada pela quantidade dos pedidos ATENDIDOS. Só os SKUs tocados na execução
+# (linhas gravadas ou apagadas pela limpeza) são recalculados; o resultado vai para 'custos_sku'
+# e a evolução por data de compra para 'custos_sku_historico' (consultas "custo em tal data").
+TABELA_CUSTOS = "custos_sku"
+TABELA_HISTORICO = "custos_sku_historico"
+SITUACOES_CUSTO = ["Atendido"] # Em Andamento ainda não entrou no estoque
+
+COLUNAS_COMPRA = "sku,data_pedido,quantidade,preco_unitario,desconto,frete,ipi,situacao"
+
+def custo_unitario(linha):
+    return (float(linha.get('preco_unitario') or 0) - float(linha.get('desconto') or 0)
+            + float(linha.get('frete') or 0) + float(linha.get('ipi') or 0))
+
+def calcular_custos(linhas):
+    """
+    Linhas de compra de um conjunto de SKUs -> (custos, historico).
+    A média acumulada é registrada a cada dia de compra, em ordem cronológica.
+    """
+    por_sku = {}
+    for l in linhas:
+        if l.get('situacao') not in SITUACOES_CUSTO: continue
+        qtd = float(l.get('quantidade') or 0)
+        if qtd <= 0: continue
+        por_sku.setdefault(l['sku'], []).append((l.get('data_pedido') or "", qtd, custo_unitario(l)))
+
+    custos = []
+    historico = []
+    agora = datetime.now().isoformat()
+    for sku, compras in por_sku.items():
+        compras.sort(key=lambda c: c[0])
+        qtd_acum = 0.0
+        valor_acum = 0.0
+        pontos = {}
+        for data, qtd, custo in compras:
+            qtd_acum += qtd
+            valor_acum += qtd * custo
+            if data: pontos[data[:10]] = (valor_acum / qtd_acum, qtd_acum)
+
+        ultima = compras[-1]
+        custos.append({
+            "sku": sku,
+            "custo_medio": round(valor_acum / qtd_acum, 4),
+            "qtd_base": qtd_acum,
+            "custo_ultima_compra": round(ultima[2], 4),
+            "data_ultima_compra": ultima[0][:10] or None,
+            "atualizado_em": agora
+        })
+        historico.extend({"sku": sku, "data": d, "custo_medio": round(c, 4), "qtd_acumulada": q} for d, (c, q) in pontos.items())
+    return custos, historico
+
+class MotorCusto:
+    """Acumula os SKUs afetados durante o sync de compras e recalcula só eles no final."""
+
+    def __init__(self):
+        self.skus_afetados = set()
+
+    def marcar_linhas(self, linhas):
+        """Callback do BufferEscrita: linhas de compra aceitas pelo banco."""
+        self.skus_afetados.update(l['sku'] for l in linhas if l.get('sku'))
+
+    def marcar_skus(self, skus):
+        """Linhas apagadas pela limpeza (item removido do pedido / pedido cancelado)."""
+        self.skus_afetados.update(skus)
+
+    def recalcular(self):
+        if not self.skus_afetados: return 0
+        skus = sorted(self.skus_afetados)
+        print(f"\n💲 Recalculando custo médio de {len(skus)} SKU(s) afetado(s)...")
+        try:
+            linhas = buscar_por_ids("compras_pedidos", "sku", skus, select=COLUNAS_COMPRA)
+        except Exception as e:
+            print(f"   ⚠️ Custo médio não recalculado: {e}")
+            return 0
+        gravar_custos(skus, *calcular_custos(linhas))
+        self.skus_afetados = set()
+        return len(skus)
+
+def gravar_custos(skus, custos, historico):
+    """Substitui custo e histórico dos SKUs recalculados. SKU sem compra atendida sai da tabela."""
+    com_custo = {c['sku'] for c in custos}
+    sem_custo = [s for s in skus if s not in com_custo]
+    headers = cabecalhos_supabase(upsert=False)
+
+    # O histórico é reescrito por inteiro para o SKU (uma compra apagada muda todos os pontos seguintes)
+    for pos in range(0, len(skus), 150):
+        lista = ",".join(f'"{s}"' for s in skus[pos:pos + 150])
+        requests.delete(f"{SUPABASE_URL}/rest/v1/{TABELA_HISTORICO}?sku=in.({lista})", headers=headers)
+    for pos in range(0, len(sem_custo), 150):
+        lista = ",".join(f'"{s}"' for s in sem_custo[pos:pos + 150])
+        requests.delete(f"{SUPABASE_URL}/rest/v1/{TABELA_CUSTOS}?sku=in.({lista})", headers=headers)
+
+    for pos in range(0, len(custos), 1000):
+        upsert_lote(TABELA_CUSTOS, custos[pos:pos + 1000])
+    for pos in range(0, len(historico), 1000):
+        upsert_lote(TABELA_HISTORICO, historico[pos:pos + 1000])
+    print(f"   ✅ {len(custos)} custo(s) e {len(historico)} ponto(s) de histórico gravados.")
+
+class CustosEmData:
+    """Consulta em memória do custo médio vigente numa data (carrega o histórico uma vez)."""
+
+    def __init__(self, skus=None):
+        linhas = buscar_por_ids(TABELA_HISTORICO, "sku", skus, select="sku,data,custo_medio") if skus else \
+            buscar_tudo(TABELA_HISTORICO, select="sku,data,custo_medio", filtros="order=sku,data")
+        self.datas = {}
+        self.custos = {}
+        for l in sorted(linhas, key=lambda l: (l['sku'], l['data'])):
+            self.datas.setdefault(l['sku'], []).append(l['data'])
+            self.custos.setdefault(l['sku'], []).append(float(l['custo_medio']))
+
+    def custo_em(self, sku, data):
+        """Custo médio vigente em 'data' (AAAA-MM-DD). Antes da primeira compra, usa o primeiro custo conhecido."""
+        datas = self.datas.get(sku)
+        if not datas: return None
+        pos = bisect.bisect_right(datas, str(data)[:10]) - 1
+        return self.custos[sku][max(pos, 0)]
+
+def recalcular_tudo():
+    """Reconstrução completa (carga inicial ou mudança na regra de custo)."""
+    print("💲 Recalculando o custo médio de todos os SKUs...")
+    linhas = buscar_tudo("compras_pedidos", select=COLUNAS_COMPRA, filtros="situacao=in.(Atendido)")
+    skus = sorted({l['sku'] for l in linhas if l.get('sku')})
+    gravar_custos(skus, *calcular_custos(linhas))
+
+if __name__ == "__main__":
+    # Uso: python scripts/custo_medio.py [SKU ...]   (sem argumentos: recalcula todos)
+    if len(sys.argv) > 1:
+        motor = MotorCusto()
+        motor.marcar_skus(sys.argv[1:])
+        motor.recalcular()
+    else:
+        recalcular_tudo()
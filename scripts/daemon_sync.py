@@ -0,0 +1,127 @@
+import sys
+import time
+import signal
+from datetime import datetime
+
+# --- DAEMON DE SINCRONIZAÇÃO EM MICRO-LOTES ---
+# Roda os jobs de sync em ciclos dentro de UM processo. Entre um ciclo e outro ficam quentes:
+# sessões HTTP e tokens por conta (bling_service), catálogo de produtos (sync_estoque),
+# cache de fornecedores (sync_pedidos_compra). O refresh da view é feito uma vez por ciclo,
+# juntando os datasets de todos os jobs que rodaram.
+# Uso: python scripts/daemon_sync.py [job=minutos ...]   ex: reconciliacao_pedidos=5 sync_estoque=15
+
+def _fila_webhook():
+    from fila_webhook import drenar_tudo
+    drenar_tudo()
+
+def _reconciliacao_pedidos():
+    from reconciliacao_pedidos import processar_reconciliacao, DIAS_BUSCA
+    from rollup_vendas import reconstruir_ultimos_dias
+    processar_reconciliacao()
+    reconstruir_ultimos_dias(DIAS_BUSCA)
+
+def _reconciliacao_nfe():
+    from reconciliacao_nfe import processar_reconciliacao_nfe, DIAS_BUSCA
+    from rollup_vendas import reconstruir_ultimos_dias
+    processar_reconciliacao_nfe()
+    reconstruir_ultimos_dias(DIAS_BUSCA)
+
+def _sync_pedidos_compra():
+    from sync_pedidos_compra import sincronizar_compras
+    sincronizar_compras()
+
+def _sync_produtos():
+    from sync_produtos import sincronizar_produtos
+    sincronizar_produtos()
+
+def _sync_composicoes():
+    from sync_composicoes import sincronizar_composicoes
+    sincronizar_composicoes()
+
+def _sync_estoque():
+    from sync_estoque import main
+    main(escalonado=True, max_idade_catalogo=INTERVALO_CATALOGO, atualizar_view=False)
+
+def _sync_categorias():
+    from sync_categorias import sync_categorias
+    sync_categorias()
+
+# job -> (função, intervalo padrão em minutos, datasets do dashboard afetados)
+JOBS = {
+    # A fila roda a cada minuto: o que ela grava entra na view no próximo refresh das reconciliações
+    "fila_webhook": (_fila_webhook, 1, []),
+    "reconciliacao_pedidos": (_reconciliacao_pedidos, 10, ["estoque", "vendas", "categorias"]),
+    "reconciliacao_nfe": (_reconciliacao_nfe, 15, ["estoque", "vendas", "categorias"]),
+    "sync_pedidos_compra": (_sync_pedidos_compra, 30, ["estoque", "compras"]),
+    "sync_produtos": (_sync_produtos, 60, ["estoque", "categorias"]),
+    "sync_composicoes": (_sync_composicoes, 24 * 60, ["estoque"]),
+    "sync_estoque": (_sync_estoque, 15, ["estoque"]),
+    "sync_categorias": (_sync_categorias, 24 * 60, ["categorias"])
+}
+
+INTERVALO_CATALOGO = 60 * 60 # Catálogo de produtos é rebaixado no máximo 1x por hora
+PASSO_ESPERA = 1             # Granularidade (s) do sono entre ciclos, para responder rápido ao SIGTERM
+
+class DaemonSync:
+    def __init__(self, intervalos):
+        self.intervalos = intervalos # job -> minutos
+        self.proxima = {job: 0.0 for job in intervalos}
+        self.parar = False
+
+    def _sinal(self, signum, frame):
+        print(f"\n🛑 Sinal {signum} recebido. Terminando o job atual antes de sair...")
+        self.parar = True
+
+    def _rodar_job(self, job):
+        funcao, _, datasets = JOBS[job]
+        inicio = time.monotonic()
+        print(f"\n▶️ [{datetime.now():%H:%M:%S}] {job}")
+        try:
+            funcao()
+            print(f"⏱️ {job} concluído em {time.monotonic() - inicio:.0f}s.")
+            return datasets
+        except Exception as e:
+            print(f"❌ {job} falhou após {time.monotonic() - inicio:.0f}s: {e}")
+            return []
+        finally:
+            self.proxima[job] = time.monotonic() + self.intervalos[job] * 60
+
+    def ciclo(self):
+        """Roda os jobs vencidos e, se algum rodou, atualiza a view e os snapshots uma única vez."""
+        datasets = set()
+        rodou = False
+        for job in self.intervalos:
+            if self.parar: break
+            if time.monotonic() >= self.proxima[job]:
+                datasets.update(self._rodar_job(job))
+                rodou = True
+
+        if rodou and datasets and not self.parar:
+            from snapshots_dashboard import atualizar_dashboard
+            atualizar_dashboard(sorted(datasets))
+
+    def executar(self):
+        signal.signal(signal.SIGTERM, self._sinal)
+        signal.signal(signal.SIGINT, self._sinal)
+        print("🔁 Daemon de sync iniciado: " + ", ".join(f"{j} a cada {m}min" for j, m in self.intervalos.items()))
+
+        while not self.parar:
+            self.ciclo()
+            espera = max(0.0, min(self.proxima.values()) - time.monotonic())
+            while espera > 0 and not self.parar:
+                time.sleep(min(PASSO_ESPERA, espera))
+                espera -= PASSO_ESPERA
+        print("👋 Daemon encerrado.")
+
+def ler_intervalos(args):
+    """'job=minutos' sobrescreve o padrão; se algum job for informado, só os informados rodam."""
+    escolhidos = {}
+    for arg in args:
+        job, _, minutos = arg.partition("=")
+        if job not in JOBS:
+            raise SystemExit(f"Job desconhecido: {job}. Opções: {', '.join(JOBS)}")
+        escolhidos[job] = float(minutos) if minutos else JOBS[job][1]
+    return escolhidos or {job: cfg[1] for job, cfg in JOBS.items()}
+
+if __name__ == "__main__":
+    DaemonSync(ler_intervalos(sys.argv[1:])).executar()
@@ -0,0 +1,115 @@
+import sys
+import requests
+from datetime import datetime
+from bling_service import BlingService, SUPABASE_URL
+from escrita_supabase import cabecalhos_supabase
+
+# --- FILA DE DOCUMENTOS QUE FALHARAM (DEAD-LETTER) ---
+# Cada falha de detalhe/transformação fica registrada com conta, endpoint e erro.
+# O reprocessamento busca SÓ esses ids, em paralelo e sob o limitador da conta.
+TABELA_DEAD_LETTER = "sync_dead_letter"
+
+# job -> endpoint de detalhe no Bling
+ENDPOINTS_JOB = {
+    "reconciliacao_pedidos": "/pedidos/vendas/{}",
+    "reconciliacao_nfe": "/nfe/{}",
+    "sync_pedidos_compra": "/pedidos/compras/{}",
+    "sync_produtos": "/produtos/{}",
+    "sync_composicoes": "/produtos/estruturas/{}"
+}
+
+def registrar_falha(job, nome_loja, id_documento, erro):
+    """Registra (ou atualiza) a falha de um documento. Nunca deixa o job principal cair por causa disso."""
+    if getattr(erro, "status", None) == 404:
+        return # Documento não existe mais no Bling: não há o que reprocessar
+    registro = {
+        "job": job,
+        "loja": nome_loja,
+        "endpoint": ENDPOINTS_JOB[job].format(id_documento),
+        "id_documento": id_documento,
+        "erro": str(erro)[:500],
+        "atualizado_em": datetime.now().isoformat()
+    }
+    try:
+        r = requests.post(
+            f"{SUPABASE_URL}/rest/v1/{TABELA_DEAD_LETTER}",
+            headers=cabecalhos_supabase(), json=registro,
+            params={"on_conflict": "job,loja,id_documento"}
+        )
+        if r.status_code not in [200, 201, 204]:
+            print(f"   ⚠️ Não foi possível registrar {id_documento} na dead-letter: {r.text}")
+    except Exception as e:
+        print(f"   ⚠️ Não foi possível registrar {id_documento} na dead-letter: {e}")
+
+def _carregar_pendentes(job=None, nome_loja=None):
+    url = f"{SUPABASE_URL}/rest/v1/{TABELA_DEAD_LETTER}?select=job,loja,id_documento&order=atualizado_em"
+    if job: url += f"&job=eq.{job}"
+    if nome_loja: url += f"&loja=eq.{nome_loja}"
+    r = requests.get(url, headers=cabecalhos_supabase(upsert=False))
+    if r.status_code != 200:
+        print(f"❌ Erro ao ler dead-letter: {r.text}")
+        return []
+    return r.json()
+
+def _remover(job, nome_loja, ids):
+    for pos in range(0, len(ids), 200):
+        lista = ",".join(str(i) for i in ids[pos:pos + 200])
+        requests.delete(
+            f"{SUPABASE_URL}/rest/v1/{TABELA_DEAD_LETTER}?job=eq.{job}&loja=eq.{nome_loja}&id_documento=in.({lista})",
+            headers=cabecalhos_supabase(upsert=False)
+        )
+
+def _processador(job):
+    # Import tardio: cada script importa este módulo para registrar falhas
+    if job == "reconciliacao_pedidos":
+        from reconciliacao_pedidos import reprocessar_documentos
+    elif job == "reconciliacao_nfe":
+        from reconciliacao_nfe import reprocessar_documentos
+    elif job == "sync_pedidos_compra":
+        from sync_pedidos_compra import reprocessar_documentos
+    elif job == "sync_produtos":
+        from sync_produtos import reprocessar_documentos
+    elif job == "sync_composicoes":
+        from sync_composicoes import reprocessar_documentos
+    return reprocessar_documentos
+
+def reprocessar(job=None, nome_loja=None):
+    """Rebusca e regrava só os documentos da dead-letter. Quem passar sai da fila; quem falhar de novo continua lá."""
+    pendentes = _carregar_pendentes(job, nome_loja)
+    print(f"📮 Dead-letter: {len(pendentes)} documento(s) pendente(s).")
+
+    grupos = {}
+    for p in pendentes:
+        grupos.setdefault((p['job'], p['loja']), []).append(p['id_documento'])
+
+    total_ok = 0
+    for (job_doc, loja), ids in grupos.items():
+        print(f"\n🔁 {job_doc} / {loja}: rebuscando {len(ids)} documento(s)...")
+        service = BlingService(loja)
+        documentos = []
+        inexistentes = []
+
+        for id_doc, data, erro in service.buscar_detalhes(ENDPOINTS_JOB[job_doc], ids):
+            if getattr(erro, "status", None) == 404:
+                inexistentes.append(id_doc)
+                continue
+            if erro or not data:
+                registrar_falha(job_doc, loja, id_doc, erro or "Detalhe vazio")
+                continue
+            documentos.append((id_doc, data))
+
+        # O script dono do job aplica a mesma transformação da execução normal e devolve os ids gravados
+        recuperados = _processador(job_doc)(service, documentos) if documentos else []
+        _remover(job_doc, loja, recuperados + inexistentes)
+        total_ok += len(recuperados)
+        print(f"   ✅ {len(recuperados)} de {len(ids)} recuperado(s).")
+
+    print(f"\n🏁 Reprocessamento concluído: {total_ok} documento(s) recuperado(s) com {len(pendentes)} chamada(s) de detalhe.")
+    return total_ok
+
+if __name__ == "__main__":
+    # Uso: python scripts/dead_letter.py [job] [loja]
+    reprocessar(
+        sys.argv[1] if len(sys.argv) > 1 else None,
+        sys.argv[2] if len(sys.argv) > 2 else None
+    )
@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import requests
+from datetime import datetime
+from bling_service import SUPABASE_URL, SUPABASE_KEY
+
+# --- QUARENTENA DE LINHAS REJEITADAS ---
+# Linhas que o PostgREST recusa (SKU nulo, chave duplicada no lote, FK de categoria...)
+# vão para a tabela abaixo com o erro anexado. Se nem a quarentena aceitar, cai no arquivo local.
+TABELA_QUARENTENA = "sync_quarentena"
+ARQUIVO_QUARENTENA = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".quarentena", "quarentena.jsonl")
+
+# Status que indicam problema nos DADOS (vale a pena dividir o lote).
+# 5xx / timeout é problema de infraestrutura: o lote inteiro vai para a quarentena sem bissecção.
+STATUS_ERRO_DADOS = [400, 409, 422]
+
+def cabecalhos_supabase(upsert=True):
+    headers = {
+        "apikey": SUPABASE_KEY,
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+        "Content-Type": "application/json"
+    }
+    if upsert:
+        headers["Prefer"] = "resolution=merge-duplicates"
+    return headers
+
+def _post(tabela, lote, on_conflict=None):
+    params = {"on_conflict": on_conflict} if on_conflict else None
+    return requests.post(f"{SUPABASE_URL}/rest/v1/{tabela}", headers=cabecalhos_supabase(), json=lote, params=params)
+
+def _bissectar(tabela, lote, on_conflict=None, indices=None):
+    """
+    Envia o lote; se o banco recusar por erro de dados, divide ao meio e tenta cada metade.
+    Retorna a lista de falhas [(indice_no_lote_original, erro)] — o resto foi gravado.
+    """
+    if indices is None: indices = list(range(len(lote)))
+    if not indices: return []
+
+    registros = [lote[i] for i in indices]
+    try:
+        r = _post(tabela, registros, on_conflict)
+    except Exception as e:
+        return [(i, f"Conexão: {e}") for i in indices]
+
+    if r.status_code in [200, 201, 204]:
+        return []
+
+    erro = f"{r.status_code}: {r.text[:500]}"
+    if r.status_code not in STATUS_ERRO_DADOS or len(indices) == 1:
+        return [(i, erro) for i in indices]
+
+    meio = len(indices) // 2
+    return _bissectar(tabela, lote, on_conflict, indices[:meio]) + _bissectar(tabela, lote, on_conflict, indices[meio:])
+
+def _salvar_quarentena_local(registros):
+    os.makedirs(os.path.dirname(ARQUIVO_QUARENTENA), exist_ok=True)
+    with open(ARQUIVO_QUARENTENA, "a", encoding="utf-8") as f:
+        for reg in registros:
+            f.write(json.dumps(reg, ensure_ascii=False, default=str) + "\n")
+
+def quarentenar(tabela, falhas, on_conflict=None):
+    """Registra as linhas rejeitadas (com o erro) na tabela de quarentena, ou no arquivo local como último recurso."""
+    if not falhas: return
+    registros = [{
+        "tabela": tabela,
+        "on_conflict": on_conflict,
+        "registro": linha,
+        "erro": erro,
+        "criado_em": datetime.now().isoformat()
+    } for linha, erro in falhas]
+
+    try:
+        r = requests.post(f"{SUPABASE_URL}/rest/v1/{TABELA_QUARENTENA}", headers=cabecalhos_supabase(upsert=False), json=registros)
+        if r.status_code in [200, 201, 204]:
+            print(f"   🧪 {len(registros)} linha(s) de {tabela} enviadas para a quarentena.")
+            return
+        print(f"   ⚠️ Quarentena remota indisponível ({r.status_code}). Gravando em arquivo local...")
+    except Exception as e:
+        print(f"   ⚠️ Quarentena remota indisponível ({e}). Gravando em arquivo local...")
+
+    _salvar_quarentena_local(registros)
+    print(f"   🧪 {len(registros)} linha(s) de {tabela} salvas em {ARQUIVO_QUARENTENA}.")
+
+def upsert_lote(tabela, lote, on_conflict=None, rejeitadas=None):
+    """
+    Upsert resiliente: um lote recusado é dividido ao meio até isolar as linhas ruins.
+    As linhas boas são gravadas e as ruins vão para a quarentena. Retorna (gravadas, quarentenadas).
+    Se 'rejeitadas' for uma lista, recebe as linhas que ficaram de fora.
+    """
+    if not lote: return 0, 0
+
+    falhas = _bissectar(tabela, lote, on_conflict)
+    if rejeitadas is not None:
+        rejeitadas.extend(lote[i] for i, _ in falhas)
+    if falhas:
+        print(f"   ❌ Erro Supabase [{tabela}]: {len(falhas)} de {len(lote)} linha(s) rejeitadas. Ex: {falhas[0][1]}")
+        quarentenar(tabela, [(lote[i], erro) for i, erro in falhas], on_conflict)
+
+    return len(lote) - len(falhas), len(falhas)
+
+# --- REPROCESSAMENTO (REPLAY) ---
+
+def _carregar_quarentena_remota(tabela=None):
+    url = f"{SUPABASE_URL}/rest/v1/{TABELA_QUARENTENA}?select=id,tabela,on_conflict,registro&order=id"
+    if tabela: url += f"&tabela=eq.{tabela}"
+    r = requests.get(url, headers=cabecalhos_supabase(upsert=False))
+    if r.status_code != 200:
+        print(f"❌ Erro ao ler quarentena: {r.text}")
+        return []
+    return r.json()
+
+def _carregar_quarentena_local(tabela=None):
+    if not os.path.exists(ARQUIVO_QUARENTENA): return []
+    with open(ARQUIVO_QUARENTENA, "r", encoding="utf-8") as f:
+        entradas = [json.loads(l) for l in f if l.strip()]
+    return [e for e in entradas if not tabela or e["tabela"] == tabela]
+
+def reprocessar_quarentena(tabela=None):
+    """Reenvia apenas as linhas em quarentena. As que passarem saem da quarentena; as que falharem ficam com o erro atualizado."""
+    remotas = _carregar_quarentena_remota(tabela)
+    locais = _carregar_quarentena_local(tabela)
+    print(f"🧪 Reprocessando quarentena: {len(remotas)} remota(s), {len(locais)} local(is).")
+
+    grupos = {}
+    for origem, entradas in [("remota", remotas), ("local", locais)]:
+        for e in entradas:
+            grupos.setdefault((e["tabela"], e.get("on_conflict")), []).append((origem, e))
+
+    total_ok = 0
+    pendentes_locais = [e for e in _carregar_quarentena_local() if tabela and e["tabela"] != tabela]
+    headers = cabecalhos_supabase(upsert=False)
+
+    for (tab, on_conflict), entradas in grupos.items():
+        lote = [e["registro"] for _, e in entradas]
+        falhas = dict(_bissectar(tab, lote, on_conflict))
+        total_ok += len(lote) - len(falhas)
+        print(f"   ↳ {tab}: {len(lote) - len(falhas)} gravada(s), {len(falhas)} ainda rejeitada(s).")
+
+        ids_ok = [e["id"] for i, (origem, e) in enumerate(entradas) if origem == "remota" and i not in falhas]
+        for pos in range(0, len(ids_ok), 200):
+            ids = ",".join(str(i) for i in ids_ok[pos:pos + 200])
+            requests.delete(f"{SUPABASE_URL}/rest/v1/{TABELA_QUARENTENA}?id=in.({ids})", headers=headers)
+
+        for i, erro in falhas.items():
+            origem, e = entradas[i]
+            if origem == "remota":
+                requests.patch(f"{SUPABASE_URL}/rest/v1/{TABELA_QUARENTENA}?id=eq.{e['id']}", headers=headers, json={"erro": erro})
+            else:
+                pendentes_locais.append({**e, "erro": erro})
+
+    if locais or pendentes_locais:
+        os.makedirs(os.path.dirname(ARQUIVO_QUARENTENA), exist_ok=True)
+        with open(ARQUIVO_QUARENTENA, "w", encoding="utf-8") as f:
+            for e in pendentes_locais:
+                f.write(json.dumps(e, ensure_ascii=False, default=str) + "\n")
+
+    print(f"✅ Reprocessamento concluído: {total_ok} linha(s) recuperadas.")
+    return total_ok
+
+if __name__ == "__main__":
+    # Uso: python scripts/escrita_supabase.py [tabela]
+    reprocessar_quarentena(sys.argv[1] if len(sys.argv) > 1 else None)
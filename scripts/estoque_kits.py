@@ -0,0 +1,128 @@
+import sys
+import numpy as np
+from datetime import datetime
+from buffer_escrita import BufferEscrita
+from leitura_supabase import buscar_tudo, buscar_por_ids
+
+# --- DISPONIBILIDADE DE KITS A PARTIR DO ESTOQUE DOS COMPONENTES ---
+# O sync de estoque pula os kits (formato E). Aqui o saldo vendável de cada kit por canal sai dos componentes:
+#   kit[canal] = min sobre os componentes de floor(estoque_filho[canal] / quantidade_filho)
+# SKUs viram índices de uma matriz SKU x canal. Kit dentro de kit é resolvido por níveis (primeiro os kits
+# que só têm produtos simples, depois os que dependem deles), cada nível numa passada vetorizada.
+# Nenhuma chamada ao Bling: só 'composicoes' e 'estoque' do banco.
+CANAIS = ["LOJA", "SITE", "FULL"]
+
+def carregar_composicoes():
+    """{sku_pai: [(sku_filho, quantidade)]} de todos os kits."""
+    kits = {}
+    for l in buscar_tudo("composicoes", select="sku_pai,sku_filho,quantidade_filho"):
+        qtd = float(l['quantidade_filho'] or 0)
+        if qtd > 0: kits.setdefault(l['sku_pai'], []).append((l['sku_filho'], qtd))
+    return kits
+
+def kits_afetados(kits, skus):
+    """Kits que contêm algum dos SKUs, direta ou indiretamente (kit de kit)."""
+    pais_de = {}
+    for pai, componentes in kits.items():
+        for filho, _ in componentes:
+            pais_de.setdefault(filho, set()).add(pai)
+
+    afetados = set()
+    fronteira = set(skus)
+    while fronteira:
+        novos = {p for s in fronteira for p in pais_de.get(s, ())} - afetados
+        afetados |= novos
+        fronteira = novos
+    return afetados
+
+def _fechamento(kits, raizes):
+    """Kits de 'raizes' e todos os kits que eles usam como componente."""
+    fechados = set()
+    pilha = [k for k in raizes if k in kits]
+    while pilha:
+        k = pilha.pop()
+        if k in fechados: continue
+        fechados.add(k)
+        pilha.extend(f for f, _ in kits[k] if f in kits)
+    return fechados
+
+def _niveis(kits, alvo):
+    """Agrupa os kits por nível: nível 0 só tem componentes simples; nível n depende de kits até n-1."""
+    nivel = {}
+    pendentes = set(alvo)
+    atual = 0
+    while pendentes:
+        prontos = {k for k in pendentes if all(f not in kits or f in nivel for f, _ in kits[k])}
+        if not prontos:
+            print(f"   ⚠️ {len(pendentes)} kit(s) em composição circular ficam com disponibilidade 0: {', '.join(sorted(pendentes)[:5])}")
+            break
+        for k in prontos: nivel[k] = atual
+        pendentes -= prontos
+        atual += 1
+    return [sorted(k for k, n in nivel.items() if n == i) for i in range(atual)]
+
+def calcular_disponibilidade(kits, estoque, alvo=None):
+    """
+    kits: {sku_pai: [(sku_filho, qtd)]} | estoque: {(sku, canal): quantidade} dos componentes.
+    Retorna {sku_kit: {canal: quantidade vendável}} para os kits de 'alvo' (todos se None).
+    """
+    alvo = _fechamento(kits, kits.keys() if alvo is None else alvo)
+    skus = sorted(alvo | {f for k in alvo for f, _ in kits[k]})
+    indice = {s: i for i, s in enumerate(skus)}
+    col = {c: j for j, c in enumerate(CANAIS)}
+
+    # Matriz SKU x canal. Saldo negativo não vende nada
+    matriz = np.zeros((len(skus), len(CANAIS)))
+    for (sku, canal), qtd in estoque.items():
+        if sku in indice and canal in col and sku not in kits:
+            matriz[indice[sku], col[canal]] = max(float(qtd or 0), 0.0)
+
+    for nivel in _niveis(kits, alvo):
+        # Arestas (kit -> componente) do nível como vetores paralelos
+        pais = np.array([indice[k] for k in nivel for _ in kits[k]])
+        filhos = np.array([indice[f] for k in nivel for f, _ in kits[k]])
+        qtds = np.array([q for k in nivel for _, q in kits[k]])
+
+        # Kit sem componente no banco (lista vazia) fica com +inf e vira 0 no fim
+        kits_nivel = np.array([indice[k] for k in nivel])
+        matriz[kits_nivel] = np.inf
+        if len(pais):
+            unidades = np.floor(matriz[filhos] / qtds[:, None])
+            np.minimum.at(matriz, pais, unidades)
+        matriz[kits_nivel] = np.where(np.isinf(matriz[kits_nivel]), 0, matriz[kits_nivel])
+
+    return {k: {c: int(matriz[indice[k], col[c]]) for c in CANAIS} for k in alvo if k in kits}
+
+def atualizar_kits(skus_alterados=None):
+    """
+    Recalcula e grava como linhas de 'estoque' a disponibilidade dos kits.
+    Com 'skus_alterados', só os kits que usam esses SKUs (e apenas o estoque dos componentes deles é lido).
+    Retorna quantas linhas de kit foram regravadas.
+    """
+    kits = carregar_composicoes()
+    alvo = set(kits) if skus_alterados is None else kits_afetados(kits, skus_alterados)
+    if not alvo: return 0
+
+    componentes = {f for k in _fechamento(kits, alvo) for f, _ in kits[k] if f not in kits}
+    if skus_alterados is None:
+        linhas = buscar_tudo("estoque", select="sku,canal,quantidade")
+    else:
+        linhas = buscar_por_ids("estoque", "sku", sorted(componentes), select="sku,canal,quantidade")
+    estoque = {(l['sku'], l['canal']): l['quantidade'] for l in linhas}
+
+    disponibilidade = calcular_disponibilidade(kits, estoque, alvo)
+
+    # Mesmo formato das linhas do sync de estoque; o hash pula os kits cuja disponibilidade não mudou
+    agora = datetime.now().isoformat()
+    buffer_estoque = BufferEscrita("estoque", chave_documento="sku")
+    buffer_estoque.pre_carregar(list(disponibilidade.keys()))
+    for sku, por_canal in disponibilidade.items():
+        buffer_estoque.adicionar([{"sku": sku, "canal": c, "quantidade": q, "updated_at": agora} for c, q in por_canal.items()])
+    buffer_estoque.descarregar()
+
+    print(f"🧩 Disponibilidade de {len(disponibilidade)} kit(s) calculada. {buffer_estoque.resumo()}")
+    return buffer_estoque.total_gravado
+
+if __name__ == "__main__":
+    # Uso: python scripts/estoque_kits.py [SKU_COMPONENTE ...]
+    atualizar_kits(sys.argv[1:] or None)
@@ -0,0 +1,193 @@
+import sys
+import time
+import requests
+from datetime import datetime, timedelta, timezone
+from bling_service import BlingService, SUPABASE_URL
+from escrita_supabase import cabecalhos_supabase
+from buffer_escrita import BufferEscrita
+from dead_letter import registrar_falha
+from metricas_sync import MetricasExecucao, segundos_desde
+from orcamento_api import planejar
+from travas import exclusivo
+
+# --- WORKER DA FILA DO WEBHOOK ---
+# O webhook só grava o evento em 'webhook_fila'. Aqui drenamos em lote:
+# 1. eventos repetidos do mesmo documento viram UMA busca de detalhe;
+# 2. detalhes em paralelo sob o limitador da conta;
+# 3. gravação com os buffers (upsert em lote, hash, rollup) e as mesmas regras da reconciliação.
+TABELA_FILA = "webhook_fila"
+LOTE_FILA = 500
+TABELA_TIPO = {"pedido": "pedidos_venda", "nfe": "nfe_saida"}
+DIAS_RETENCAO = 7 # Eventos processados ficam esse tempo na fila para auditoria
+
+def _tipo_evento(evento):
+    if "order." in evento or "sales." in evento: return "pedido"
+    if "invoice." in evento or "nfe." in evento: return "nfe"
+    return None
+
+def carregar_pendentes(limite=LOTE_FILA):
+    r = requests.get(
+        f"{SUPABASE_URL}/rest/v1/{TABELA_FILA}?select=id,loja,evento,id_documento,recebido_em"
+        f"&processado_em=is.null&order=id&limit={limite}",
+        headers=cabecalhos_supabase(upsert=False)
+    )
+    if r.status_code != 200:
+        raise Exception(f"Erro ao ler a fila: {r.text}")
+    return r.json()
+
+def marcar_processados(ids_fila, erro=None):
+    """Marca os eventos como processados. Retorna quantos o banco de fato marcou; falha no PATCH levanta erro."""
+    agora = datetime.now(timezone.utc).isoformat()
+    headers = {**cabecalhos_supabase(upsert=False), "Prefer": "return=representation"}
+    marcados = 0
+    for pos in range(0, len(ids_fila), 200):
+        lista = ",".join(str(i) for i in ids_fila[pos:pos + 200])
+        r = requests.patch(
+            f"{SUPABASE_URL}/rest/v1/{TABELA_FILA}?id=in.({lista})&select=id",
+            headers=headers, json={"processado_em": agora, "erro": erro}
+        )
+        if r.status_code not in [200, 204]:
+            raise Exception(f"Erro ao marcar eventos da fila: {r.text}")
+        marcados += len(r.json()) if r.status_code == 200 else 0
+    return marcados
+
+def limpar_processados():
+    corte = (datetime.now(timezone.utc) - timedelta(days=DIAS_RETENCAO)).isoformat()
+    requests.delete(f"{SUPABASE_URL}/rest/v1/{TABELA_FILA}?processado_em=lt.{corte}", headers=cabecalhos_supabase(upsert=False))
+
+def _processar_pedidos(service, ids, buffer_pedidos, skus_vendidos):
+    """Mesma regra do webhook: pedido na situação da loja é gravado; fora dela (ou excluído) sai do banco."""
+    from reconciliacao_pedidos import CONFIG_RECONCILIACAO, JOB, processar_pedido, remover_pedido
+    config = next((c for c in CONFIG_RECONCILIACAO if c['loja'] == service.nome_loja), None)
+    falhas = {}
+
+    for id_bling, v, erro in service.buscar_detalhes("/pedidos/vendas/{}", ids):
+        try:
+            if getattr(erro, "status", None) == 404 or (not erro and config is None):
+                remover_pedido(id_bling)
+                continue
+            if erro or not v:
+                raise erro or Exception("Detalhe vazio")
+            skus_vendidos.update(processar_pedido(v, config, buffer_pedidos))
+        except Exception as e:
+            registrar_falha(JOB, service.nome_loja, id_bling, e)
+            falhas[id_bling] = str(e)[:300]
+    return falhas
+
+def _processar_nfes(service, ids, buffer_vendas, buffer_devolucoes):
+    """Mesma regra do webhook: NF de venda/devolução válida é gravada; o resto é removido das duas tabelas."""
+    from reconciliacao_nfe import JOB, processar_nfe, remover_nfe
+    falhas = {}
+
+    for id_nf, nf, erro in service.buscar_detalhes("/nfe/{}", ids):
+        try:
+            if getattr(erro, "status", None) == 404:
+                remover_nfe(id_nf)
+                continue
+            if erro or not nf:
+                raise erro or Exception("Detalhe vazio")
+            if not processar_nfe(nf, service.nome_loja, buffer_vendas, buffer_devolucoes):
+                remover_nfe(id_nf)
+        except Exception as e:
+            registrar_falha(JOB, service.nome_loja, id_nf, e)
+            falhas[id_nf] = str(e)[:300]
+    return falhas
+
+def drenar(limite=LOTE_FILA, atualizar_estoque=True):
+    """Drena um lote da fila. Retorna quantos eventos foram consumidos (marcados como processados)."""
+    inicio = time.monotonic()
+    eventos = carregar_pendentes(limite)
+    if not eventos: return 0
+
+    mais_antigo = min(e['recebido_em'] for e in eventos)
+    atraso = (datetime.now(timezone.utc) - datetime.fromisoformat(mais_antigo.replace("Z", "+00:00"))).total_seconds()
+
+    # (loja, tipo) -> {id_documento: [ids da fila]}: eventos repetidos do mesmo documento colapsam
+    grupos = {}
+    ignorados = []
+    metricas = MetricasExecucao("fila_webhook")
+    for e in eventos:
+        tipo = _tipo_evento(e['evento'])
+        if not tipo:
+            ignorados.append(e['id'])
+            continue
+        grupos.setdefault((e['loja'], tipo), {}).setdefault(e['id_documento'], []).append(e['id'])
+        # Atraso real: evento recebido do Bling -> drenado agora
+        metricas.atraso(TABELA_TIPO[tipo], e['loja'], segundos_desde(e['recebido_em']))
+        metricas.marca_dagua(TABELA_TIPO[tipo], e['loja'], e['recebido_em'])
+
+    # Uma chamada de detalhe por documento distinto. A fila é prioritária: o plano só registra o consumo
+    estimativas = {}
+    for (loja, _), documentos in grupos.items():
+        estimativas[loja] = estimativas.get(loja, 0) + len(documentos)
+    plano = planejar("fila_webhook", list(estimativas.keys()), estimativas)
+
+    buffer_pedidos = BufferEscrita("pedidos_venda", chave_documento="id")
+    buffer_vendas = BufferEscrita("nfe_saida", chave_documento="id")
+    buffer_devolucoes = BufferEscrita("devolucoes", chave_documento="id")
+    skus_vendidos = set()
+    falhas_por_evento = {}
+    total_documentos = 0
+
+    for (loja, tipo), documentos in grupos.items():
+        service = BlingService(loja)
+        ids = list(documentos.keys())
+        total_documentos += len(ids)
+        print(f"📨 {loja}: {len(ids)} {tipo}(s) distintos em {sum(len(v) for v in documentos.values())} evento(s).")
+
+        if tipo == "pedido":
+            buffer_pedidos.pre_carregar(ids)
+            falhas = _processar_pedidos(service, ids, buffer_pedidos, skus_vendidos)
+        else:
+            buffer_vendas.pre_carregar(ids)
+            buffer_devolucoes.pre_carregar(ids)
+            falhas = _processar_nfes(service, ids, buffer_vendas, buffer_devolucoes)
+
+        for id_doc, erro in falhas.items():
+            for id_fila in documentos[id_doc]:
+                falhas_por_evento[id_fila] = erro
+        metricas.contar(TABELA_TIPO[tipo], loja, documentos=len(ids))
+
+    for buffer in [buffer_pedidos, buffer_vendas, buffer_devolucoes]:
+        buffer.descarregar()
+
+    # Como no webhook: venda mexe no estoque, então os SKUs vendidos são conferidos no Bling (em lote)
+    if atualizar_estoque and skus_vendidos:
+        from atualizar_sku import atualizar_skus
+        atualizar_skus(sorted(skus_vendidos))
+
+    # Falhas seguem para a dead-letter; na fila ficam processadas com o erro anotado
+    ok = [e['id'] for e in eventos if e['id'] not in falhas_por_evento]
+    marcados = marcar_processados(ok)
+    metricas.gravar()
+    plano.registrar()
+    for erro in set(falhas_por_evento.values()):
+        marcados += marcar_processados([i for i, er in falhas_por_evento.items() if er == erro], erro=erro)
+
+    duracao = time.monotonic() - inicio
+    print(f"📬 Fila: {len(eventos)} evento(s) -> {total_documentos} documento(s) em {duracao:.1f}s "
+          f"({len(eventos) / max(duracao, 0.001):.1f} eventos/s) | atraso do mais antigo: {atraso:.0f}s "
+          f"| falhas: {len(falhas_por_evento)} | ignorados: {len(ignorados)}")
+    if marcados < len(eventos):
+        print(f"   ⚠️ Só {marcados} de {len(eventos)} evento(s) marcados como processados.")
+    return marcados
+
+@exclusivo("fila_webhook")
+def drenar_tudo():
+    """Drena até esvaziar a fila (usado pelo daemon e pelo cron)."""
+    total = 0
+    while True:
+        consumidos = drenar()
+        total += consumidos
+        # Lote incompleto: a fila esvaziou. Nada marcado: o mesmo lote voltaria igual, então para aqui
+        if consumidos < LOTE_FILA: break
+    limpar_processados()
+    return total
+
+if __name__ == "__main__":
+    # Uso: python scripts/fila_webhook.py [--continuo]
+    if "--continuo" in sys.argv:
+        while True:
+            if not drenar_tudo(): time.sleep(10)
+    else:
+        drenar_tudo()
@@ -0,0 +1,105 @@
+import json
+import hashlib
+import requests
+from datetime import datetime
+from bling_service import SUPABASE_URL
+from escrita_supabase import cabecalhos_supabase
+from leitura_supabase import buscar_por_ids
+
+# --- HASH DE CONTEÚDO POR DOCUMENTO ---
+# Guardamos o hash do payload normalizado de cada documento (pedido, NF, SKU de estoque...)
+# numa tabela lateral. Se o hash não mudou, a reescrita é pulada: menos I/O, menos WAL
+# e menos trabalho no refresh da view do dashboard.
+# Qualquer escrita nas tabelas de detalhe (webhook, fila, SQL manual) apaga o hash do documento por trigger
+# (migração sync_hashes_invalidacao); o sync regrava o hash logo depois de gravar as próprias linhas.
+TABELA_HASHES = "sync_hashes"
+
+# Colunas que mudam a cada execução sem representar mudança de conteúdo
+COLUNAS_VOLATEIS = {"updated_at"}
+
+def _normalizar(valor):
+    if isinstance(valor, float):
+        return round(valor, 4)
+    return valor
+
+def calcular_hash(linhas):
+    """Hash estável das linhas de um documento: independe da ordem das linhas, das chaves e de ruído de float."""
+    normalizadas = sorted(
+        json.dumps({k: _normalizar(v) for k, v in linha.items() if k not in COLUNAS_VOLATEIS}, sort_keys=True, default=str)
+        for linha in linhas
+    )
+    return hashlib.sha1("\n".join(normalizadas).encode("utf-8")).hexdigest()
+
+class CacheHashes:
+    """Hashes já gravados de uma tabela, carregados em lote, com os novos pendentes de confirmação."""
+
+    def __init__(self, tabela):
+        self.tabela = tabela
+        self.gravados = {}
+        self.pendentes = {}
+        self.verificados = 0
+        self.inalterados = 0
+
+    def carregar(self, chaves):
+        """Pré-carrega (uma consulta por lote) os hashes das chaves que ainda não estão na memória."""
+        faltando = [str(c) for c in chaves if str(c) not in self.gravados]
+        if not faltando: return
+        for c in faltando:
+            self.gravados[c] = None
+        linhas = buscar_por_ids(TABELA_HASHES, "chave", faltando, select="chave,hash", filtros=f"tabela=eq.{self.tabela}")
+        for row in linhas:
+            self.gravados[row['chave']] = row['hash']
+
+    def alterado(self, chave, linhas, forcar=False):
+        """
+        True se o documento mudou desde a última gravação (ou nunca foi gravado).
+        'forcar': o chamador já sabe que a linha falta ou diverge no banco; o hash igual não impede a escrita.
+        """
+        chave = str(chave)
+        if chave not in self.gravados:
+            self.carregar([chave])
+
+        self.verificados += 1
+        novo = calcular_hash(linhas)
+        if not forcar and self.gravados.get(chave) == novo:
+            self.inalterados += 1
+            return False
+
+        self.pendentes[chave] = novo
+        return True
+
+    def confirmar(self, chaves=None):
+        """Grava os hashes pendentes (só depois que as linhas foram aceitas pelo banco)."""
+        chaves = list(self.pendentes.keys()) if chaves is None else [str(c) for c in chaves if str(c) in self.pendentes]
+        if not chaves: return
+        agora = datetime.now().isoformat()
+        registros = [{"tabela": self.tabela, "chave": c, "hash": self.pendentes[c], "atualizado_em": agora} for c in chaves]
+        r = requests.post(
+            f"{SUPABASE_URL}/rest/v1/{TABELA_HASHES}", headers=cabecalhos_supabase(),
+            json=registros, params={"on_conflict": "tabela,chave"}
+        )
+        if r.status_code not in [200, 201, 204]:
+            print(f"   ⚠️ Não foi possível gravar hashes de {self.tabela}: {r.text}")
+            return
+        for c in chaves:
+            self.gravados[c] = self.pendentes.pop(c)
+
+    def descartar(self, chaves):
+        """Esquece hashes pendentes de documentos cuja gravação falhou (serão reescritos na próxima execução)."""
+        for c in chaves:
+            self.pendentes.pop(str(c), None)
+
+    def resumo(self):
+        if not self.verificados: return ""
+        taxa = 100 * self.inalterados / self.verificados
+        return f"{self.tabela}: {self.inalterados} de {self.verificados} documentos inalterados ({taxa:.0f}% de escrita evitada)"
+
+def esquecer_hashes(tabela, chaves):
+    """Remove o hash de documentos apagados do banco, para que voltem a ser gravados se reaparecerem iguais."""
+    chaves = [str(c) for c in chaves]
+    for pos in range(0, len(chaves), 150):
+        lista = ",".join(f'"{c}"' for c in chaves[pos:pos + 150])
+        requests.delete(
+            f"{SUPABASE_URL}/rest/v1/{TABELA_HASHES}?tabela=eq.{tabela}&chave=in.({lista})",
+            headers=cabecalhos_supabase(upsert=False)
+        )
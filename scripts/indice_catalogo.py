@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import shutil
+import numpy as np
+from datetime import datetime, timezone
+from leitura_supabase import buscar_tudo
+
+# --- ÍNDICE LOCAL ID DO BLING <-> SKU ---
+# Os três ids por conta ficam em arrays numéricos ordenados (busca binária nos dois sentidos),
+# com os SKUs internados: cada SKU vira um código inteiro, posição dele no array ordenado de SKUs.
+# O índice é salvo em disco como .npy e aberto com memmap: carregar custa milissegundos.
+# A atualização baixa só os produtos com 'atualizado_em' depois da marca d'água do índice.
+COLUNAS_CONTA = {"PORTFIO": "id_bling_portfio", "PORTCASA": "id_bling_portcasa", "CASA_MODELO": "id_bling_casamodelo"}
+PASTA_INDICE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "catalogo")
+ARQUIVO_ATUAL = os.path.join(PASTA_INDICE, "ATUAL")
+IDADE_RECONSTRUCAO = 24 * 3600 # Produto apagado não aparece no delta: 1x por dia o índice é refeito do zero
+SEM_ID = 0
+
+def _utc(momento):
+    m = datetime.fromisoformat(str(momento).replace("Z", "+00:00"))
+    return (m if m.tzinfo else m.replace(tzinfo=timezone.utc)).astimezone(timezone.utc)
+
+class IndiceCatalogo:
+    """
+    skus: array ordenado de SKUs (o código do SKU é a posição nele).
+    Por conta: 'ids' ordenados com 'codigos' alinhados (id -> SKU) e 'id_por_codigo' (SKU -> id, 0 = sem id).
+    """
+
+    def __init__(self, skus, contas, marca_dagua=None, gerado_em=None):
+        self.skus = skus
+        self.contas = contas # conta -> {"ids": int64[], "codigos": int32[], "id_por_codigo": int64[]}
+        self.marca_dagua = marca_dagua
+        self.gerado_em = gerado_em or time.time()
+        self.carregado_em = time.monotonic()
+
+    @classmethod
+    def construir(cls, linhas, marca_dagua=None, gerado_em=None):
+        """Linhas de 'produtos' (sku + colunas de id) -> índice."""
+        skus = np.array(sorted({l['sku'] for l in linhas if l.get('sku')}), dtype=str)
+        contas = {}
+        for conta, coluna in COLUNAS_CONTA.items():
+            pares = [(int(l[coluna]), l['sku']) for l in linhas if l.get('sku') and l.get(coluna)]
+            ids = np.array([p[0] for p in pares], dtype=np.int64)
+            codigos = np.searchsorted(skus, np.array([p[1] for p in pares], dtype=str)).astype(np.int32)
+            ordem = np.argsort(ids, kind="stable")
+            id_por_codigo = np.full(len(skus), SEM_ID, dtype=np.int64)
+            id_por_codigo[codigos] = ids
+            contas[conta] = {"ids": ids[ordem], "codigos": codigos[ordem], "id_por_codigo": id_por_codigo}
+        return cls(skus, contas, marca_dagua, gerado_em)
+
+    def __len__(self):
+        return len(self.skus)
+
+    def codigo(self, sku):
+        pos = int(np.searchsorted(self.skus, sku))
+        return pos if pos < len(self.skus) and self.skus[pos] == sku else None
+
+    def sku_de(self, conta, id_bling):
+        c = self.contas[conta]
+        pos = int(np.searchsorted(c["ids"], int(id_bling)))
+        if pos < len(c["ids"]) and c["ids"][pos] == int(id_bling):
+            return str(self.skus[c["codigos"][pos]])
+        return None
+
+    def skus_de(self, conta, ids_bling):
+        """Vetorizado: lista de SKUs (None para id desconhecido) na ordem dos ids."""
+        c = self.contas[conta]
+        ids = np.asarray(list(ids_bling), dtype=np.int64)
+        if not len(c["ids"]) or not len(ids): return [None] * len(ids)
+        pos = np.minimum(np.searchsorted(c["ids"], ids), len(c["ids"]) - 1)
+        achou = c["ids"][pos] == ids
+        return [str(self.skus[c["codigos"][p]]) if a else None for p, a in zip(pos, achou)]
+
+    def id_de(self, conta, sku):
+        cod = self.codigo(sku)
+        if cod is None: return None
+        id_bling = int(self.contas[conta]["id_por_codigo"][cod])
+        return id_bling if id_bling != SEM_ID else None
+
+    def mapa(self, conta):
+        """{id do Bling (int): SKU} da conta, para quem ainda trabalha com dicionário."""
+        c = self.contas[conta]
+        return dict(zip(c["ids"].tolist(), self.skus[c["codigos"]].tolist()))
+
+    def linhas(self):
+        """Volta para o formato de 'produtos' (usado para aplicar o delta)."""
+        linhas = {str(s): {"sku": str(s)} for s in self.skus}
+        for conta, coluna in COLUNAS_CONTA.items():
+            c = self.contas[conta]
+            for id_bling, cod in zip(c["ids"].tolist(), c["codigos"].tolist()):
+                linhas[str(self.skus[cod])][coluna] = id_bling
+        return linhas
+
+    # --- PERSISTÊNCIA ---
+
+    def salvar(self):
+        """Grava uma versão nova numa pasta própria e só então troca o ponteiro ATUAL (leitores nunca veem meio índice)."""
+        versao = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        pasta = os.path.join(PASTA_INDICE, versao)
+        os.makedirs(pasta, exist_ok=True)
+        np.save(os.path.join(pasta, "skus.npy"), self.skus)
+        for conta, c in self.contas.items():
+            for nome, arr in c.items():
+                np.save(os.path.join(pasta, f"{conta}.{nome}.npy"), arr)
+        with open(os.path.join(pasta, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"marca_dagua": self.marca_dagua, "gerado_em": self.gerado_em, "skus": len(self.skus)}, f)
+
+        temporario = ARQUIVO_ATUAL + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            f.write(versao)
+        os.replace(temporario, ARQUIVO_ATUAL)
+
+        for antiga in os.listdir(PASTA_INDICE):
+            if antiga not in (versao, "ATUAL") and os.path.isdir(os.path.join(PASTA_INDICE, antiga)):
+                shutil.rmtree(os.path.join(PASTA_INDICE, antiga), ignore_errors=True)
+
+    @classmethod
+    def abrir(cls):
+        """Abre a versão atual do disco com memmap (None se não houver)."""
+        try:
+            with open(ARQUIVO_ATUAL, encoding="utf-8") as f:
+                pasta = os.path.join(PASTA_INDICE, f.read().strip())
+            with open(os.path.join(pasta, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            skus = np.load(os.path.join(pasta, "skus.npy"), mmap_mode="r")
+            contas = {
+                conta: {nome: np.load(os.path.join(pasta, f"{conta}.{nome}.npy"), mmap_mode="r") for nome in ("ids", "codigos", "id_por_codigo")}
+                for conta in COLUNAS_CONTA
+            }
+        except (OSError, ValueError) as e:
+            print(f"   ⚠️ Índice de catálogo local indisponível ({e}). Reconstruindo...")
+            return None
+        return cls(skus, contas, meta.get("marca_dagua"), meta.get("gerado_em"))
+
+# --- CARGA E ATUALIZAÇÃO ---
+
+_SELECT = "sku,atualizado_em," + ",".join(COLUNAS_CONTA.values())
+
+def _marca(linhas, anterior=None):
+    momentos = [_utc(l['atualizado_em']) for l in linhas if l.get('atualizado_em')]
+    if anterior: momentos.append(_utc(anterior))
+    return max(momentos).strftime("%Y-%m-%dT%H:%M:%S.%fZ") if momentos else anterior
+
+def reconstruir():
+    inicio = time.monotonic()
+    linhas = buscar_tudo("produtos", select=_SELECT, filtros="sku=not.is.null")
+    indice = IndiceCatalogo.construir(linhas, _marca(linhas))
+    indice.salvar()
+    print(f"🗂️ Índice de catálogo reconstruído: {len(indice)} SKUs em {time.monotonic() - inicio:.1f}s.")
+    return indice
+
+def atualizar(indice):
+    """Aplica só os produtos alterados depois da marca d'água do índice."""
+    if not indice.marca_dagua: return reconstruir()
+    delta = buscar_tudo("produtos", select=_SELECT, filtros=f"atualizado_em=gt.{indice.marca_dagua}&sku=not.is.null")
+    if not delta:
+        indice.carregado_em = time.monotonic()
+        return indice
+
+    linhas = indice.linhas()
+    # Id do Bling que mudou de SKU (SKU renomeado): a entrada antiga com o mesmo id sai, senão o id apareceria duas vezes
+    for coluna in COLUNAS_CONTA.values():
+        ids_delta = {int(l[coluna]) for l in delta if l.get(coluna)}
+        for linha in linhas.values():
+            if linha.get(coluna) in ids_delta: del linha[coluna]
+    for l in delta:
+        linhas[l['sku']] = l
+    novo = IndiceCatalogo.construir(list(linhas.values()), _marca(delta, indice.marca_dagua), indice.gerado_em)
+    novo.salvar()
+    print(f"🗂️ Índice de catálogo: {len(delta)} produto(s) alterado(s) aplicados.")
+    return novo
+
+# Índice do processo: o daemon reaproveita entre ciclos sem nem consultar o delta
+_indice = {"atual": None}
+
+def obter_indice(max_idade=0):
+    """Índice atualizado. Com 'max_idade' (segundos), nem consulta o delta se a última checagem for recente."""
+    indice = _indice["atual"]
+    if indice is not None and time.monotonic() - indice.carregado_em < max_idade:
+        return indice
+
+    if indice is None:
+        indice = IndiceCatalogo.abrir()
+    if indice is None or time.time() - indice.gerado_em > IDADE_RECONSTRUCAO:
+        indice = reconstruir()
+    else:
+        indice = atualizar(indice)
+
+    _indice["atual"] = indice
+    return indice
+
+if __name__ == "__main__":
+    # Uso: python scripts/indice_catalogo.py [--reconstruir] [SKU ...]
+    inicio = time.monotonic()
+    indice = reconstruir() if "--reconstruir" in sys.argv else obter_indice()
+    print(f"⚡ Índice pronto em {(time.monotonic() - inicio) * 1000:.0f} ms ({len(indice)} SKUs).")
+    for sku in (a for a in sys.argv[1:] if not a.startswith("--")):
+        ids = " | ".join(f"{conta}: {indice.id_de(conta, sku) or '-'}" for conta in COLUNAS_CONTA)
+        print(f"   {sku} -> {ids}")
@@ -0,0 +1,46 @@
+import requests
+from urllib.parse import quote
+from bling_service import SUPABASE_URL, SUPABASE_KEY
+
+HEADERS_LEITURA = {
+    "apikey": SUPABASE_KEY,
+    "Authorization": f"Bearer {SUPABASE_KEY}"
+}
+
+# Quantos ids cabem com folga num filtro in.(...) sem estourar a URL
+IDS_POR_CONSULTA = 150
+
+def formatar_in(valores):
+    """Lista para o filtro in.(...) do PostgREST. Texto vai entre aspas (SKU com vírgula, aspas ou parênteses)."""
+    return ",".join('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' if isinstance(v, str) else str(v) for v in valores)
+
+def buscar_por_ids(tabela, coluna, ids, select="*", filtros="", passo=1000):
+    """
+    Busca as linhas de 'tabela' cujo 'coluna' está em 'ids', em consultas de até IDS_POR_CONSULTA ids.
+    Cada consulta é paginada como em buscar_tudo: vários registros por id (linhas por SKU) passam de 1000.
+    """
+    ids = list(ids)
+    linhas = []
+    for pos in range(0, len(ids), IDS_POR_CONSULTA):
+        # Os valores vão codificados na URL: SKU com '&', '#' ou '+' não pode quebrar a query string
+        filtro_ids = f"{coluna}=in.({quote(formatar_in(ids[pos:pos + IDS_POR_CONSULTA]), safe=',')})"
+        linhas.extend(buscar_tudo(tabela, select=select, filtros=f"{filtro_ids}&{filtros}" if filtros else filtro_ids, passo=passo))
+    return linhas
+
+def buscar_tudo(tabela, select="*", filtros="", passo=1000):
+    """Lê a tabela/view inteira paginando pelo header Range (o PostgREST corta em 1000 linhas por resposta)."""
+    linhas = []
+    offset = 0
+    url = f"{SUPABASE_URL}/rest/v1/{tabela}?select={select}"
+    if filtros: url += f"&{filtros}"
+
+    while True:
+        headers = {**HEADERS_LEITURA, "Range-Unit": "items", "Range": f"{offset}-{offset + passo - 1}"}
+        r = requests.get(url, headers=headers)
+        if r.status_code not in [200, 206]:
+            raise Exception(f"Erro ao consultar {tabela}: {r.text}")
+        dados = r.json()
+        linhas.extend(dados)
+        if len(dados) < passo: break
+        offset += passo
+    return linhas
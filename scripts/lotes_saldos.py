@@ -0,0 +1,78 @@
+from collections import deque
+
+# --- LOTES ADAPTATIVOS DE idsProdutos[] PARA /estoques/saldos ---
+# Em vez de um número fixo de ids por chamada, cabe na URL o máximo que o orçamento de tamanho permite
+# (ids do Bling têm ~11 dígitos, então bem mais que 40). Se o servidor recusar uma URL longa,
+# o lote é dividido ao meio e o orçamento baixa para o tamanho que passou. Um 400 num lote com vários
+# ids é tratado como id inválido: o lote é dividido até isolar o id, sem mexer no orçamento.
+URL_SALDOS = "https://www.bling.com.br/Api/v3/estoques/saldos"
+LIMITE_URL_SALDOS = 4000     # Caracteres por URL (folga para proxies/CDN que cortam em 8 KB)
+LIMITE_URL_MINIMO = 1000     # Nunca encolher abaixo disso (~35 ids)
+STATUS_URL_RECUSADA = [414, 431]  # URI Too Long / Request Header Fields Too Large
+DIGITOS_ID = 11
+
+def montar_query(ids):
+    return "&".join(f"idsProdutos[]={i}" for i in ids)
+
+def ids_por_chamada(limite_url=LIMITE_URL_SALDOS, digitos=DIGITOS_ID):
+    """Estimativa de ids por chamada para um orçamento de URL (usada no planejamento de chamadas)."""
+    return max(1, (limite_url - len(URL_SALDOS) - 1) // (len("idsProdutos[]=&") + digitos))
+
+def url_recusada(status, lote):
+    """Recusa que vale dividir o lote: URL longa demais, ou 400 (id inválido) num lote com mais de um id."""
+    return status in STATUS_URL_RECUSADA or (status == 400 and len(lote) > 1)
+
+class EmpacotadorIds:
+    """Fila de lotes de ids que respeita o orçamento de URL e se adapta às recusas do servidor."""
+
+    def __init__(self, ids, limite_url=LIMITE_URL_SALDOS):
+        self.limite_url = limite_url
+        self.pendentes = deque(ids)
+        self.redivididos = deque() # Metades de lotes recusados: vão antes dos ids ainda não empacotados
+        self.chamadas = 0
+        self.ids_enviados = 0
+
+    def _tamanho(self, lote):
+        return len(URL_SALDOS) + 1 + len(montar_query(lote))
+
+    def proximo(self):
+        """Próximo lote (lista de ids) ou None quando acabou."""
+        if self.redivididos:
+            return self.redivididos.popleft()
+        lote = []
+        tamanho = len(URL_SALDOS) + 1
+        while self.pendentes:
+            extra = len(f"idsProdutos[]={self.pendentes[0]}") + (1 if lote else 0)
+            if lote and tamanho + extra > self.limite_url: break
+            lote.append(self.pendentes.popleft())
+            tamanho += extra
+        return lote or None
+
+    def url(self, lote):
+        return f"{URL_SALDOS}?{montar_query(lote)}"
+
+    def enviado(self, lote):
+        self.chamadas += 1
+        self.ids_enviados += len(lote)
+
+    def recusado(self, lote, status):
+        """
+        Lote recusado: divide ao meio. Só 414/431 (URL longa) baixam o orçamento para metade do tamanho recusado;
+        um 400 vem de id inválido e só é dividido até isolar o id. False se não dá para dividir.
+        """
+        self.chamadas += 1
+        if len(lote) < 2: return False
+        meio = len(lote) // 2
+        self.redivididos.extendleft([lote[meio:], lote[:meio]])
+        if status in STATUS_URL_RECUSADA:
+            self.limite_url = max(LIMITE_URL_MINIMO, min(self.limite_url, self._tamanho(lote) // 2))
+            print(f"   ✂️ URL com {len(lote)} ids recusada ({status}). Dividindo; novo limite de URL: {self.limite_url} caracteres.")
+        else:
+            print(f"   ✂️ Lote com {len(lote)} ids recusado ({status}). Dividindo para isolar o id inválido.")
+        return True
+
+    def media(self):
+        return self.ids_enviados / self.chamadas if self.chamadas else 0.0
+
+    def resumo(self):
+        return f"{self.ids_enviados} ids em {self.chamadas} chamada(s) ({self.media():.0f} ids/chamada)"
@@ -0,0 +1,97 @@
+import time
+import requests
+from datetime import datetime, timezone
+from bling_service import SUPABASE_URL
+from escrita_supabase import cabecalhos_supabase
+from leitura_supabase import buscar_tudo
+
+# --- MÉTRICAS DE FRESCOR DOS SYNCS ---
+# Cada job acumula, por tabela e conta: documentos vistos, divergências corrigidas, marca d'água
+# e atraso medido (evento no Bling -> gravação). No fim, uma linha por (job, tabela, loja) em 'sync_metricas'.
+TABELA_METRICAS = "sync_metricas"
+
+def _agora():
+    return datetime.now(timezone.utc)
+
+def segundos_desde(momento):
+    """Segundos entre um timestamp ISO (do Bling ou do banco) e agora."""
+    if not momento: return None
+    m = datetime.fromisoformat(str(momento).replace("Z", "+00:00").replace(" ", "T"))
+    if m.tzinfo is None: m = m.replace(tzinfo=timezone.utc)
+    return max(0.0, (_agora() - m).total_seconds())
+
+class MetricasExecucao:
+    def __init__(self, job):
+        self.job = job
+        self.inicio = time.monotonic()
+        self.linhas = {}
+
+    def _linha(self, tabela, loja):
+        return self.linhas.setdefault((tabela, loja), {
+            "documentos": 0, "divergentes": 0, "marca_dagua": None, "atrasos": [], "erro": None
+        })
+
+    def contar(self, tabela, loja, documentos=0, divergentes=0):
+        l = self._linha(tabela, loja)
+        l["documentos"] += documentos
+        l["divergentes"] += divergentes
+
+    def atraso(self, tabela, loja, segundos):
+        if segundos is not None: self._linha(tabela, loja)["atrasos"].append(segundos)
+
+    def marca_dagua(self, tabela, loja, momento):
+        l = self._linha(tabela, loja)
+        momento = momento.isoformat() if isinstance(momento, datetime) else str(momento)
+        if not l["marca_dagua"] or momento > l["marca_dagua"]: l["marca_dagua"] = momento
+
+    def erro(self, tabela, loja, erro):
+        self._linha(tabela, loja)["erro"] = str(erro)[:300]
+
+    def gravar(self):
+        """
+        Uma linha por (tabela, loja). Execução com erro não avança 'ultima_execucao_ok'
+        e execução sem marca d'água (falhou antes de ler o Bling) não apaga a anterior.
+        """
+        agora = _agora().isoformat()
+        duracao = round(time.monotonic() - self.inicio, 1)
+        lotes = {}
+        for (tabela, loja), l in self.linhas.items():
+            atrasos = l["atrasos"]
+            registro = {
+                "job": self.job, "tabela": tabela, "loja": loja,
+                "ultima_execucao": agora, "duracao_segundos": duracao,
+                "documentos": l["documentos"], "divergentes": l["divergentes"],
+                "atraso_medio_segundos": round(sum(atrasos) / len(atrasos), 1) if atrasos else None,
+                "atraso_max_segundos": round(max(atrasos), 1) if atrasos else None,
+                "erro": l["erro"]
+            }
+            if l["marca_dagua"]: registro["marca_dagua"] = l["marca_dagua"]
+            if not l["erro"]: registro["ultima_execucao_ok"] = agora
+            lotes.setdefault(tuple(registro), []).append(registro)
+
+        # Um lote por conjunto de colunas: no upsert em lote o PostgREST usa as mesmas colunas para todas as linhas
+        for lote in lotes.values():
+            try:
+                r = requests.post(
+                    f"{SUPABASE_URL}/rest/v1/{TABELA_METRICAS}", headers=cabecalhos_supabase(),
+                    json=lote, params={"on_conflict": "job,tabela,loja"}
+                )
+                if r.status_code not in [200, 201, 204]:
+                    print(f"   ⚠️ Métricas de {self.job} não gravadas: {r.text}")
+            except Exception as e:
+                print(f"   ⚠️ Métricas de {self.job} não gravadas: {e}")
+
+def resumo_frescor():
+    """Imprime a view de frescor (uma linha por tabela e conta)."""
+    linhas = buscar_tudo("view_frescor_sync")
+    print(f"{'TABELA':<18}{'LOJA':<13}{'ÚLTIMO OK':>12}{'DOCS':>8}{'DIVERG.':>9}{'ATRASO MÁX':>12}")
+    for l in linhas:
+        minutos = l.get('minutos_desde_ok')
+        ultimo = f"{minutos} min" if minutos is not None else "nunca"
+        atraso = f"{float(l['atraso_max_segundos']):.0f}s" if l.get('atraso_max_segundos') is not None else "-"
+        print(f"{l['tabela']:<18}{l['loja']:<13}{ultimo:>12}{l['documentos']:>8}{l['divergentes']:>9}{atraso:>12}")
+        if l.get('erros'): print(f"   ⚠️ {l['erros']}")
+
+if __name__ == "__main__":
+    # Uso: python scripts/metricas_sync.py
+    resumo_frescor()
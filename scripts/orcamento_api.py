@@ -0,0 +1,187 @@
+import requests
+from datetime import datetime
+from bling_service import SUPABASE_URL, chamadas_por_conta
+from escrita_supabase import cabecalhos_supabase
+from leitura_supabase import buscar_tudo
+
+# --- ORÇAMENTO DA COTA DIÁRIA DO BLING ---
+# Todos os jobs dividem a cota diária de cada conta. Antes de rodar, o job pede um plano:
+# a estimativa vem do histórico de execuções (ou do que o próprio job calcula pelas listagens),
+# e o planejador autoriza, reduz ou adia conforme a prioridade e o que já foi gasto hoje.
+# O plano entra em 'bling_consumo' já no planejamento (realizado nulo, conta o autorizado): execuções
+# em andamento ou que caíram pesam no gasto do dia. No fim, o plano grava o realizado na mesma linha.
+TABELA_CONSUMO = "bling_consumo"
+COTA_DIARIA = 120000         # Requisições por dia por conta (limite da API v3)
+MARGEM_SEGURANCA = 0.9       # Nunca planejar além de 90% da cota
+RESERVA_PRIORITARIOS = 0.2   # Fração da cota guardada para os jobs prioritários do resto do dia
+EXECUCOES_HISTORICO = 10     # Quantas execuções passadas entram na média
+
+# 1 = não pode atrasar (vendas/NF) | 2 = importante | 3+ = pode reduzir ou adiar
+PRIORIDADES = {
+    "fila_webhook": 1,
+    "reconciliacao_pedidos": 1,
+    "reconciliacao_nfe": 1,
+    "sync_pedidos_compra": 2,
+    "sync_produtos": 2,
+    "sync_estoque": 3,
+    "sync_estoque_completo": 4,
+    "sync_categorias": 4,
+    "sync_composicoes": 4,
+    "backfill": 5
+}
+ESTIMATIVA_PADRAO = 200      # Sem histórico e sem estimativa do job
+CONTAS_BLING = ["PORTFIO", "PORTCASA", "CASA_MODELO"]
+
+def gasto_hoje():
+    """Chamadas já feitas hoje por conta (realizado das execuções encerradas, autorizado das que não encerraram)."""
+    hoje = datetime.now().strftime("%Y-%m-%d")
+    gasto = {}
+    for l in buscar_tudo(TABELA_CONSUMO, select="loja,realizado,autorizado", filtros=f"data=eq.{hoje}"):
+        # Execução ainda sem realizado (em andamento ou que caiu): conta o autorizado
+        gasto[l['loja']] = gasto.get(l['loja'], 0) + (l['realizado'] if l['realizado'] is not None else l['autorizado'])
+    return gasto
+
+def estimativa_historica(job, loja):
+    linhas = buscar_tudo(
+        TABELA_CONSUMO, select="realizado",
+        filtros=f"job=eq.{job}&loja=eq.{loja}&realizado=not.is.null&adiado=is.false&order=criado_em.desc&limit={EXECUCOES_HISTORICO}"
+    )
+    if not linhas: return None
+    return int(sum(l['realizado'] for l in linhas) / len(linhas))
+
+class PlanoConsumo:
+    """Plano de uma execução: chamadas autorizadas por conta. Use 'registrar()' no fim para gravar o realizado."""
+
+    def __init__(self, job, autorizados, planejados, prioridade, adiados=()):
+        self.job = job
+        self.autorizados = autorizados
+        self.planejados = planejados
+        self.prioridade = prioridade
+        self.adiados = set(adiados)
+        self.inicio = chamadas_por_conta()
+        self.ids = {} # loja -> id da linha em bling_consumo
+        self._abrir()
+
+    def autorizado(self, loja):
+        return self.autorizados.get(loja, 0)
+
+    def adiado(self, loja):
+        return loja in self.adiados
+
+    def _registro(self, loja, realizado=None):
+        return {
+            "job": self.job, "loja": loja, "prioridade": self.prioridade,
+            "planejado": self.planejados[loja], "autorizado": self.autorizados[loja],
+            "realizado": realizado, "adiado": self.adiado(loja)
+        }
+
+    def _abrir(self):
+        """Grava o plano sem realizado: até 'registrar()', o gasto do dia conta o autorizado."""
+        if not self.planejados: return
+        headers = {**cabecalhos_supabase(upsert=False), "Prefer": "return=representation"}
+        try:
+            r = requests.post(
+                f"{SUPABASE_URL}/rest/v1/{TABELA_CONSUMO}?select=id,loja", headers=headers,
+                json=[self._registro(loja) for loja in self.planejados]
+            )
+            if r.status_code not in [200, 201]:
+                print(f"   ⚠️ Plano de {self.job} não registrado: {r.text}")
+                return
+            self.ids = {l['loja']: l['id'] for l in r.json()}
+        except Exception as e:
+            print(f"   ⚠️ Plano de {self.job} não registrado: {e}")
+
+    def registrar(self):
+        atual = chamadas_por_conta()
+        sem_linha = []
+        for loja, planejado in self.planejados.items():
+            realizado = atual.get(loja, 0) - self.inicio.get(loja, 0)
+            desvio = f" ({realizado - planejado:+d} vs. plano)" if planejado else ""
+            print(f"   📒 {self.job}/{loja}: {realizado} chamada(s) ao Bling{desvio}.")
+            if loja not in self.ids:
+                sem_linha.append(self._registro(loja, realizado))
+                continue
+            try:
+                r = requests.patch(
+                    f"{SUPABASE_URL}/rest/v1/{TABELA_CONSUMO}?id=eq.{self.ids[loja]}",
+                    headers=cabecalhos_supabase(upsert=False), json={"realizado": realizado}
+                )
+                if r.status_code not in [200, 204]:
+                    print(f"   ⚠️ Consumo de {self.job}/{loja} não registrado: {r.text}")
+            except Exception as e:
+                print(f"   ⚠️ Consumo de {self.job}/{loja} não registrado: {e}")
+
+        # O plano não entrou no início (banco fora): grava a linha completa agora
+        if not sem_linha: return
+        try:
+            r = requests.post(f"{SUPABASE_URL}/rest/v1/{TABELA_CONSUMO}", headers=cabecalhos_supabase(upsert=False), json=sem_linha)
+            if r.status_code not in [200, 201, 204]:
+                print(f"   ⚠️ Consumo de {self.job} não registrado: {r.text}")
+        except Exception as e:
+            print(f"   ⚠️ Consumo de {self.job} não registrado: {e}")
+
+def planejar(job, lojas, estimativas=None, redutivel=False):
+    """
+    Monta o plano do job para as contas informadas.
+    estimativas: {loja: chamadas} calculado pelo job (ex: catálogo / 40); sem isso, usa a média histórica.
+    redutivel: o job aceita rodar com menos chamadas que o estimado (ex: sync de estoque escalonado).
+    Jobs prioritários (1-2) só são cortados se a cota inteira estiver no fim.
+    """
+    prioridade = PRIORIDADES.get(job, 3)
+    estimativas = estimativas or {}
+    try:
+        gasto = gasto_hoje()
+    except Exception as e:
+        print(f"⚠️ Sem histórico de consumo ({e}). Seguindo sem orçamento.")
+        gasto = {}
+
+    autorizados, planejados, adiados = {}, {}, []
+    for loja in lojas:
+        estimado = estimativas.get(loja)
+        if estimado is None:
+            try: estimado = estimativa_historica(job, loja)
+            except Exception: estimado = None
+        estimado = int(estimado if estimado is not None else ESTIMATIVA_PADRAO)
+
+        livre = int(COTA_DIARIA * MARGEM_SEGURANCA) - gasto.get(loja, 0)
+        if prioridade >= 3:
+            livre -= int(COTA_DIARIA * RESERVA_PRIORITARIOS)
+
+        if estimado <= livre:
+            autorizado = estimado
+        elif redutivel and livre > 0:
+            autorizado = livre
+            print(f"✂️ {job}/{loja}: reduzido de {estimado} para {autorizado} chamada(s) (gasto hoje: {gasto.get(loja, 0)}).")
+        elif prioridade <= 2 and livre > 0:
+            autorizado = estimado # Prioritário: roda mesmo estourando a estimativa, enquanto houver cota
+        else:
+            autorizado = 0
+            adiados.append(loja)
+            print(f"⏸️ {job}/{loja}: adiado. Estimativa de {estimado} chamada(s), livre: {max(livre, 0)}.")
+
+        planejados[loja] = estimado
+        autorizados[loja] = autorizado
+
+    return PlanoConsumo(job, autorizados, planejados, prioridade, adiados)
+
+def planejar_backfill(descricao):
+    """
+    Backfills (rollup, histórico) não chamam o Bling, mas disputam o banco com os syncs. Com a menor
+    prioridade, só rodam enquanto nenhuma conta gastou a parte da cota que fica para os prioritários.
+    Retorna o plano (0 chamadas por conta; 'registrar()' no fim) ou None se o backfill foi adiado.
+    """
+    plano = planejar("backfill", CONTAS_BLING, {loja: 0 for loja in CONTAS_BLING})
+    if any(plano.adiado(loja) for loja in CONTAS_BLING):
+        plano.registrar()
+        print(f"⏸️ {descricao} adiado: o dia já está pesado para os jobs prioritários. Tente de novo mais tarde.")
+        return None
+    return plano
+
+def relatorio():
+    print(f"{'LOJA':<13}{'JOB':<24}{'EXEC':>6}{'PLANEJADO':>11}{'REALIZADO':>11}{'ADIADAS':>9}")
+    for l in buscar_tudo("view_bling_consumo_hoje"):
+        print(f"{l['loja']:<13}{l['job']:<24}{l['execucoes']:>6}{l['planejado']:>11}{l['realizado']:>11}{l['adiadas']:>9}")
+
+if __name__ == "__main__":
+    # Uso: python scripts/orcamento_api.py   (planejado x realizado de hoje)
+    relatorio()
@@ -0,0 +1,249 @@
+import os
+import sys
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# --- ORQUESTRADOR DOS JOBS (DAG) ---
+# Substitui os crons independentes: cada etapa declara de quem depende e só começa quando todas
+# as dependências terminaram. Ramos independentes (pedidos, NF-e e compras) rodam em paralelo:
+# o limitador de 3 req/s e o token são por conta e compartilhados entre as threads (bling_service).
+# Cada etapa retorna quantos registros mudaram. Etapa 'condicional' é pulada quando nenhuma
+# dependência mudou nada; etapa que falhou conta como "mudou" (não dá para saber o que ficou gravado).
+# No fim sai um relatório único da execução (também no resumo do GitHub Actions).
+# Uso: python scripts/orquestrador.py [noturno|horario] [--so=etapa1,etapa2]
+MAX_PARALELO = 3
+PRAZO_COMPRAS = 20 * 60 # Segundos. A varredura de compras que não couber continua no próximo ciclo (checkpoint)
+
+class Etapa:
+    def __init__(self, nome, funcao, depende_de=(), condicional=False, intervalo_minimo=0, job_metricas=None, datasets=()):
+        self.nome = nome
+        self.funcao = funcao                     # () -> registros alterados (None = desconhecido). Sem função: refresh da view
+        self.depende_de = list(depende_de)
+        self.condicional = condicional
+        self.intervalo_minimo = intervalo_minimo # Minutos desde o último OK em sync_metricas para rodar de novo
+        self.job_metricas = job_metricas or nome
+        self.datasets = list(datasets)           # Snapshots do dashboard afetados quando a etapa muda algo
+        self.status = "pendente"                 # ok | falhou | pulada
+        self.alterados = None
+        self.motivo = ""
+        self.duracao = 0.0
+
+    @property
+    def mudou(self):
+        if self.status == "falhou": return True
+        return self.status == "ok" and (self.alterados is None or self.alterados > 0)
+
+# --- FUNÇÕES DAS ETAPAS (imports tardios: cada uma só carrega o que usa) ---
+
+def _categorias():
+    from sync_categorias import sync_categorias
+    return sync_categorias()
+
+def _produtos():
+    from sync_produtos import sincronizar_produtos
+    return sincronizar_produtos()
+
+def _composicoes():
+    from sync_composicoes import sincronizar_composicoes
+    return sincronizar_composicoes()
+
+def _estoque():
+    from sync_estoque import main
+    return main(escalonado=True, orcamento=150, atualizar_view=False)
+
+def _kits():
+    # Recalculo completo, sem chamadas ao Bling: o estoque escalonado e o webhook só atualizam
+    # os kits dos componentes que eles mesmos conferiram
+    from estoque_kits import atualizar_kits
+    return atualizar_kits()
+
+def _pedidos():
+    from reconciliacao_pedidos import processar_reconciliacao
+    return processar_reconciliacao()
+
+def _nfe():
+    from reconciliacao_nfe import processar_reconciliacao_nfe
+    return processar_reconciliacao_nfe()
+
+def _compras():
+    from sync_pedidos_compra import sincronizar_compras
+    from checkpoint import PrazoExecucao
+    return sincronizar_compras(prazo=PrazoExecucao(PRAZO_COMPRAS))
+
+def _rollup():
+    # Rede de segurança da janela das reconciliações (deltas que falharam ao aplicar, correções manuais).
+    # O webhook inline recalcula sozinho os dias dos documentos que grava; por isso a etapa não é condicional
+    from reconciliacao_pedidos import DIAS_BUSCA as DIAS_PEDIDOS
+    from reconciliacao_nfe import DIAS_BUSCA as DIAS_NFE
+    from rollup_vendas import reconstruir_ultimos_dias
+    if not reconstruir_ultimos_dias(max(DIAS_PEDIDOS, DIAS_NFE)):
+        raise RuntimeError("Falha ao reconstruir a rollup de vendas")
+    return None
+
+def _historico():
+    from atualizar_historico import processar_diario
+    processar_diario()
+
+def _fechamento():
+    from fechamento_diario import gerar_fechamento_diario
+    gerar_fechamento_diario()
+
+def perfil_noturno():
+    """Ciclo completo da madrugada: catálogo inteiro, reconciliações, view e relatórios do dia."""
+    return [
+        Etapa("categorias", _categorias, datasets=["categorias"]),
+        Etapa("produtos", _produtos, ["categorias"], datasets=["estoque", "categorias"]),
+        Etapa("composicoes", _composicoes, ["produtos"], datasets=["estoque"]),
+        Etapa("estoque", _estoque, ["composicoes"], datasets=["estoque"]),
+        Etapa("kits", _kits, ["composicoes", "estoque"], datasets=["estoque"]),
+        Etapa("pedidos", _pedidos, ["estoque"], datasets=["estoque", "vendas", "categorias"]),
+        Etapa("nfe", _nfe, ["estoque"], datasets=["estoque", "vendas", "categorias"]),
+        Etapa("compras", _compras, ["estoque"], job_metricas="sync_pedidos_compra", datasets=["estoque", "compras"]),
+        Etapa("rollup", _rollup, ["pedidos", "nfe"], datasets=["vendas", "categorias"]),
+        Etapa("view", None, ["produtos", "composicoes", "estoque", "kits", "pedidos", "nfe", "compras", "rollup"], condicional=True),
+        Etapa("historico", _historico, ["view"]),
+        Etapa("fechamento", _fechamento, ["view"])
+    ]
+
+def perfil_horario():
+    """
+    Ciclo do horário comercial: só o incremental, cada job no seu ritmo (vendas e NF-e chegam pelo webhook
+    e são reconciliadas de madrugada). Estoque e compras mantêm a cadência de ~2h dos crons antigos.
+    """
+    return [
+        Etapa("produtos", _produtos, datasets=["estoque", "categorias"]),
+        # Kit alterado no Bling muda a data de alteração do produto: sem produto alterado, a composição não mudou
+        Etapa("composicoes", _composicoes, ["produtos"], condicional=True, datasets=["estoque"]),
+        Etapa("estoque", _estoque, ["composicoes"], intervalo_minimo=110, job_metricas="sync_estoque", datasets=["estoque"]),
+        Etapa("kits", _kits, ["composicoes", "estoque"], datasets=["estoque"]),
+        Etapa("compras", _compras, ["estoque"], intervalo_minimo=110, job_metricas="sync_pedidos_compra", datasets=["estoque", "compras"]),
+        Etapa("view", None, ["produtos", "composicoes", "estoque", "kits", "compras"], condicional=True)
+    ]
+
+PERFIS = {"noturno": perfil_noturno, "horario": perfil_horario}
+
+# --- EXECUÇÃO ---
+
+def minutos_desde_ok(job):
+    """Minutos desde a última execução OK do job em sync_metricas (None se nunca rodou ou não deu para ler)."""
+    from leitura_supabase import buscar_tudo
+    from metricas_sync import segundos_desde
+    try:
+        linhas = buscar_tudo("sync_metricas", select="ultima_execucao_ok", filtros=f"job=eq.{job}&ultima_execucao_ok=not.is.null")
+    except Exception as e:
+        print(f"   ⚠️ Última execução de {job} não lida ({e}). Rodando.")
+        return None
+    if not linhas: return None
+    return min(segundos_desde(l['ultima_execucao_ok']) for l in linhas) / 60
+
+class Orquestrador:
+    def __init__(self, etapas, so=None):
+        self.etapas = {e.nome: e for e in etapas}
+        self.so = set(so) if so else None
+        for e in etapas:
+            desconhecidas = [d for d in e.depende_de if d not in self.etapas]
+            if desconhecidas: raise ValueError(f"Etapa {e.nome} depende de etapa inexistente: {', '.join(desconhecidas)}")
+        self._verificar_ciclos()
+        self.inicio = None
+
+    def _verificar_ciclos(self):
+        visitadas, em_curso = set(), set()
+        def visitar(nome):
+            if nome in em_curso: raise ValueError(f"Dependência circular envolvendo a etapa {nome}")
+            if nome in visitadas: return
+            em_curso.add(nome)
+            for d in self.etapas[nome].depende_de: visitar(d)
+            em_curso.discard(nome)
+            visitadas.add(nome)
+        for nome in self.etapas: visitar(nome)
+
+    def _atualizar_view(self):
+        """Refresh da view materializada + snapshots só dos datasets cujas etapas mudaram algo."""
+        from snapshots_dashboard import atualizar_dashboard
+        datasets = sorted({d for e in self.etapas.values() if e.mudou for d in e.datasets})
+        atualizar_dashboard(datasets or None)
+        return None
+
+    def _motivo_pular(self, etapa):
+        if self.so is not None and etapa.nome not in self.so:
+            return "fora de --so"
+        # Etapa pedida explicitamente em --so roda mesmo sem mudança nas dependências (que em geral nem rodaram)
+        explicita = self.so is not None and etapa.nome in self.so
+        if etapa.condicional and etapa.depende_de and not explicita and not any(self.etapas[d].mudou for d in etapa.depende_de):
+            return "nenhuma dependência mudou"
+        if etapa.intervalo_minimo:
+            minutos = minutos_desde_ok(etapa.job_metricas)
+            if minutos is not None and minutos < etapa.intervalo_minimo:
+                return f"último OK há {minutos:.0f} min (mínimo {etapa.intervalo_minimo} min)"
+        return None
+
+    def _rodar(self, etapa):
+        inicio = time.monotonic()
+        print(f"\n▶️ [{datetime.now():%H:%M:%S}] {etapa.nome}")
+        try:
+            etapa.alterados = etapa.funcao() if etapa.funcao else self._atualizar_view()
+            etapa.status = "ok"
+        except Exception as e:
+            etapa.status = "falhou"
+            etapa.motivo = str(e)[:200]
+            print(f"❌ {etapa.nome} falhou: {e}")
+        etapa.duracao = time.monotonic() - inicio
+        return etapa
+
+    def executar(self):
+        self.inicio = time.monotonic()
+        pendentes = dict(self.etapas)
+        em_execucao = {}
+        with ThreadPoolExecutor(max_workers=MAX_PARALELO) as pool:
+            while pendentes or em_execucao:
+                # Dispara (ou pula) tudo que já tem as dependências resolvidas
+                for nome, etapa in list(pendentes.items()):
+                    if any(self.etapas[d].status == "pendente" for d in etapa.depende_de): continue
+                    del pendentes[nome]
+                    motivo = self._motivo_pular(etapa)
+                    if motivo:
+                        etapa.status, etapa.motivo = "pulada", motivo
+                        print(f"\n⏭️ {nome} pulada: {motivo}")
+                        continue
+                    em_execucao[pool.submit(self._rodar, etapa)] = etapa
+                if not em_execucao:
+                    continue
+
+                concluidas, _ = wait(em_execucao, return_when=FIRST_COMPLETED)
+                for futuro in concluidas:
+                    etapa = em_execucao.pop(futuro)
+                    if etapa.status == "ok": print(f"⏱️ {etapa.nome} concluída em {etapa.duracao:.0f}s.")
+        return self.relatorio()
+
+    def relatorio(self):
+        icones = {"ok": "✅", "falhou": "❌", "pulada": "⏭️"}
+        linhas = ["| Etapa | Status | Alterados | Duração | Observação |", "|---|---|---|---|---|"]
+        for e in self.etapas.values():
+            alterados = "-" if e.status != "ok" else ("?" if e.alterados is None else str(e.alterados))
+            duracao = f"{e.duracao:.0f}s" if e.status != "pulada" else "-"
+            linhas.append(f"| {e.nome} | {icones.get(e.status, e.status)} {e.status} | {alterados} | {duracao} | {e.motivo} |")
+
+        falhas = [e.nome for e in self.etapas.values() if e.status == "falhou"]
+        total = time.monotonic() - self.inicio
+        titulo = f"Orquestrador: {len(self.etapas)} etapa(s) em {total:.0f}s" + (f", {len(falhas)} com falha" if falhas else "")
+        texto = "\n".join([f"### {titulo}", ""] + linhas)
+
+        print("\n" + "=" * 60)
+        print(texto)
+        arquivo_resumo = os.environ.get("GITHUB_STEP_SUMMARY")
+        if arquivo_resumo:
+            with open(arquivo_resumo, "a", encoding="utf-8") as f:
+                f.write(texto + "\n")
+        return not falhas
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    perfil = args[0] if args else "horario"
+    if perfil not in PERFIS:
+        raise SystemExit(f"Perfil desconhecido: {perfil}. Opções: {', '.join(PERFIS)}")
+    so = next((a.split("=", 1)[1].split(",") for a in sys.argv if a.startswith("--so=")), None)
+
+    orquestrador = Orquestrador(PERFIS[perfil](), so)
+    print(f"🧭 Orquestrador ({perfil}): {', '.join(orquestrador.etapas)}")
+    sys.exit(0 if orquestrador.executar() else 1)
@@ -1,7 +1,18 @@
+import sys
 import requests
-import time
 from datetime import datetime, timedelta
 from bling_service import BlingService, SUPABASE_URL, SUPABASE_KEY
+from buffer_escrita import BufferEscrita
+from dead_letter import registrar_falha
+from leitura_supabase import buscar_por_ids
+from hash_documentos import esquecer_hashes
+from rollup_vendas import descontar_documentos, reconstruir_ultimos_dias
+from snapshots_dashboard import atualizar_dashboard
+from metricas_sync import MetricasExecucao
+from orcamento_api import planejar
+from travas import exclusivo
+
+JOB = "reconciliacao_nfe"
 
 # --- CONFIGURAÇÕES TÉCNICAS (IGUAL AO WEBHOOK) ---
 DIAS_BUSCA = 2 # Período de segurança para reconciliação
@@ -21,34 +32,160 @@ IDS_NATUREZA_DEVOLUCAO = [
 ]
 
 ID_LOJA_PORTFIO_SITE = 204457689
-IDS_NFE_IGNORAR = [1, 2, 4, 8, 9, 10] # Situações de cancelamento/pendência
+IDS_NFE_IGNORAR = [1, 2, 4, 8, 9, 10] # Situações de cancelamento/pendência (exceto a devolução 888 da PORTCASA)
+SITUACOES_NFE_FINAIS = [5, 6, 7] # Autorizada / Emitida DANFE / Registrada: itens não mudam mais
 
 # --- CONFIGURAÇÃO DE LOJAS PARA SYNC ---
 LOJAS_SYNC = ["PORTFIO", "PORTCASA", "CASA_MODELO"]
 
-def salvar_supabase(tabela, lote):
-    if not lote: return
-    headers = {
-        "apikey": SUPABASE_KEY, 
-        "Authorization": f"Bearer {SUPABASE_KEY}", 
-        "Prefer": "resolution=merge-duplicates", 
-        "Content-Type": "application/json"
-    }
-    url = f"{SUPABASE_URL}/rest/v1/{tabela}"
-    r = requests.post(url, headers=headers, json=lote)
-    if r.status_code not in [200, 201, 204]:
-        print(f"   ❌ Erro Supabase [{tabela}]: {r.text}")
-    else:
-        print(f"   ✅ {len(lote)} registros em {tabela} sincronizados.")
-
-def processar_reconciliacao_nfe():
+def remover_nfe(id_nf):
+    headers_del = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
+    descontar_documentos("nfe_saida", [id_nf])
+    descontar_documentos("devolucoes", [id_nf])
+    requests.delete(f"{SUPABASE_URL}/rest/v1/nfe_saida?id=eq.{id_nf}", headers=headers_del)
+    requests.delete(f"{SUPABASE_URL}/rest/v1/devolucoes?id=eq.{id_nf}", headers=headers_del)
+    esquecer_hashes("nfe_saida", [id_nf])
+    esquecer_hashes("devolucoes", [id_nf])
+
+def processar_nfe(nf, nome_loja, buffer_vendas, buffer_devolucoes, forcar=False):
+    """
+    Classifica a NF (venda ou devolução) com as regras do webhook e coloca as linhas no buffer certo.
+    Retorna "venda", "devolucao" ou None (a NF não gera linha em nenhuma das tabelas).
+    'forcar': a NF falta no banco, grava mesmo com o hash igual ao último gravado.
+    """
+    id_nf = nf['id']
+    nat_id = nf.get('naturezaOperacao', {}).get('id')
+    itens = nf.get('itens', [])
+    if not itens: return
+
+    # --- CÁLCULOS TÉCNICOS DE RATEIO (MATEMÁTICA DO WEBHOOK) ---
+    v_frete = float(nf.get('valorFrete', 0) or 0)
+    v_outras = float(nf.get('outrasDespesas', 0) or 0)
+    v_nota_final = float(nf.get('valorNota', 0) or 0)
+
+    total_bruto_prods = sum([(float(i.get('valor') or i.get('valorUnitario') or 0) * float(i['quantidade'])) for i in itens])
+    if total_bruto_prods == 0: total_bruto_prods = 1
+    
+    v_desc_global = max(0, (total_bruto_prods + v_frete + v_outras) - v_nota_final)
+
+    # Mesmos predicados do webhook: série nula conta como 1; pendente/cancelada não gera linha
+    e_serie_1 = nf.get('serie') is None or str(nf.get('serie')) == "1"
+    e_situacao_valida = nf.get('situacao') not in IDS_NFE_IGNORAR
+
+    # --- ROTA 1: VENDA (SAÍDA TIPO 1) ---
+    if nf['tipo'] == 1 and e_serie_1 and e_situacao_valida and nat_id not in IDS_NATUREZA_BLOQUEADA:
+        linhas_nf = []
+        for item in itens:
+            preco = float(item.get('valor') or item.get('valorUnitario') or 0)
+            peso = (preco * float(item['quantidade'])) / total_bruto_prods
+            
+            desc_rateio = v_desc_global * peso
+            frete_rateio = v_frete * peso
+            liquido = max(0, (preco * float(item['quantidade'])) - desc_rateio + frete_rateio)
+
+            linhas_nf.append({
+                "id": id_nf,
+                "sku": item['codigo'],
+                "data_emissao": nf['dataEmissao'][:10],
+                "origem": "CASA_MODELO" if nome_loja == "CASA_MODELO" else "SITE",
+                "loja": nome_loja,
+                "quantidade": item['quantidade'],
+                "preco_unitario": preco,
+                "desconto": desc_rateio,
+                "frete": frete_rateio,
+                "valor_total_liquido": liquido
+            })
+        buffer_vendas.adicionar(linhas_nf, forcar)
+        return "venda"
+
+    # --- ROTA 2: DEVOLUÇÃO (ENTRADA TIPO 0) ---
+    elif nf['tipo'] == 0 and nat_id in IDS_NATUREZA_DEVOLUCAO:
+        origem_dev = None
+        if nome_loja == 'PORTCASA' and str(nf.get('serie')) == "888" and nf['situacao'] == 1:
+            origem_dev = "LOJA"
+        elif nome_loja == 'PORTFIO' and e_situacao_valida and (nf.get('loja') or {}).get('id') == ID_LOJA_PORTFIO_SITE:
+            origem_dev = "SITE"
+        elif nome_loja == 'CASA_MODELO' and e_situacao_valida:
+            origem_dev = "CASA_MODELO"
+
+        if origem_dev:
+            linhas_nf = []
+            for item in itens:
+                preco = float(item.get('valor') or item.get('valorUnitario') or 0)
+                bruto_linha = preco * float(item['quantidade'])
+                peso = bruto_linha / total_bruto_prods
+                
+                # Estorno = Bruto + Frete + Outras - Desconto
+                estorno = max(0, (bruto_linha + (v_frete * peso) + (v_outras * peso)) - (v_desc_global * peso))
+
+                linhas_nf.append({
+                    "id": id_nf,
+                    "sku": item['codigo'],
+                    "data_devolucao": nf['dataEmissao'][:10],
+                    "origem": origem_dev,
+                    "loja": nome_loja,
+                    "quantidade": item['quantidade'],
+                    "valor_estorno": estorno
+                })
+            buffer_devolucoes.adicionar(linhas_nf, forcar)
+            return "devolucao"
+
+def reprocessar_documentos(service, documentos):
+    """Usado pela dead-letter: regrava as NFs já rebuscadas. Retorna os ids processados."""
+    buffer_vendas = BufferEscrita("nfe_saida", chave_documento="id")
+    buffer_devolucoes = BufferEscrita("devolucoes", chave_documento="id")
+    recuperados = []
+    for id_nf, nf in documentos:
+        try:
+            processar_nfe(nf, service.nome_loja, buffer_vendas, buffer_devolucoes)
+            recuperados.append(id_nf)
+        except Exception as e:
+            registrar_falha(JOB, service.nome_loja, id_nf, e)
+    buffer_vendas.descarregar()
+    buffer_devolucoes.descarregar()
+    return recuperados
+
+def carregar_indice_nfes(ids, nome_loja):
+    """Ids (desta loja) que já têm linhas em nfe_saida ou devolucoes."""
+    filtros = f"loja=eq.{nome_loja}"
+    presentes = {row['id'] for row in buscar_por_ids("nfe_saida", "id", ids, select="id", filtros=filtros)}
+    presentes |= {row['id'] for row in buscar_por_ids("devolucoes", "id", ids, select="id", filtros=filtros)}
+    return presentes
+
+def nfe_precisa_detalhe(nf_resumo, indice):
+    """
+    Modo esparso, decidido só com a listagem:
+    - Natureza da listagem que nunca gera linha (venda bloqueada / entrada que não é devolução) -> ignora
+    - NF autorizada já gravada: os itens de uma NF-e não mudam depois de emitida -> ignora
+    - Pendente / aguardando (ainda editável) -> sempre detalha
+    """
+    nat_id = (nf_resumo.get('naturezaOperacao') or {}).get('id')
+    if nat_id:
+        if nf_resumo.get('tipo') == 1 and nat_id in IDS_NATUREZA_BLOQUEADA: return False
+        if nf_resumo.get('tipo') == 0 and nat_id not in IDS_NATUREZA_DEVOLUCAO: return False
+    if nf_resumo['situacao'] not in SITUACOES_NFE_FINAIS: return True
+    return nf_resumo['id'] not in indice
+
+@exclusivo(JOB)
+def processar_reconciliacao_nfe(modo_esparso=True):
+    """Retorna quantos registros mudaram no banco (linhas gravadas + notas removidas)."""
     hoje = datetime.now()
     data_inicio = (hoje - timedelta(days=DIAS_BUSCA)).strftime("%Y-%m-%d")
     data_fim = hoje.strftime("%Y-%m-%d")
 
     print(f"🕵️ Iniciando Reconciliação de NFes (Vendas e Devoluções): {data_inicio} a {data_fim}")
 
+    # Buffers da execução inteira: SKUs repetidos na mesma nota são somados antes do upsert
+    buffer_vendas = BufferEscrita("nfe_saida", chave_documento="id")
+    buffer_devolucoes = BufferEscrita("devolucoes", chave_documento="id")
+    total_listadas = 0
+    total_detalhadas = 0
+    total_removidas = 0
+    metricas = MetricasExecucao(JOB)
+    plano = planejar(JOB, LOJAS_SYNC)
+
     for nome_loja in LOJAS_SYNC:
+        if plano.adiado(nome_loja): continue
         print(f"\n🚀 Sincronizando {nome_loja}...")
         service = BlingService(nome_loja)
         
@@ -64,119 +201,67 @@ def processar_reconciliacao_nfe():
 
             try:
                 for lote in service.get_all_pages("/nfe", params=params):
-                    buffer_vendas = []
-                    buffer_devolucoes = []
-
+                    ids_detalhar = []
                     for nf_resumo in lote:
                         id_nf = nf_resumo['id']
 
                         # --- NOVO: LÓGICA DE EXCLUSÃO (NOTAS CANCELADAS) ---
                         if nf_resumo['situacao'] in [2, 4]: 
                             print(f"   🗑️ NF {id_nf} cancelada/rejeitada. Removendo do banco...")
-                            headers_del = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
-                            requests.delete(f"{SUPABASE_URL}/rest/v1/nfe_saida?id=eq.{id_nf}", headers=headers_del)
-                            requests.delete(f"{SUPABASE_URL}/rest/v1/devolucoes?id=eq.{id_nf}", headers=headers_del)
+                            remover_nfe(id_nf)
+                            total_removidas += 1
                             continue
+                        ids_detalhar.append(id_nf)
 
-                        try:
-                            time.sleep(0.35)
-                            id_nf = nf_resumo['id']
-                            token = service.get_valid_token()
-                            resp = requests.get(f"https://www.bling.com.br/Api/v3/nfe/{id_nf}", headers={"Authorization": f"Bearer {token}"})
-                            
-                            if resp.status_code != 200: continue
-                            nf = resp.json().get('data')
-                            if not nf: continue
-
-                            nat_id = nf.get('naturezaOperacao', {}).get('id')
-                            itens = nf.get('itens', [])
-                            if not itens: continue
-
-                            # --- CÁLCULOS TÉCNICOS DE RATEIO (MATEMÁTICA DO WEBHOOK) ---
-                            v_frete = float(nf.get('valorFrete', 0) or 0)
-                            v_outras = float(nf.get('outrasDespesas', 0) or 0)
-                            v_nota_final = float(nf.get('valorNota', 0) or 0)
-
-                            total_bruto_prods = sum([(float(i.get('valor') or i.get('valorUnitario') or 0) * float(i['quantidade'])) for i in itens])
-                            if total_bruto_prods == 0: total_bruto_prods = 1
-                            
-                            v_desc_global = max(0, (total_bruto_prods + v_frete + v_outras) - v_nota_final)
-
-                            # --- ROTA 1: VENDA (SAÍDA TIPO 1) ---
-                            if nf['tipo'] == 1 and str(nf.get('serie')) == "1" and nat_id not in IDS_NATUREZA_BLOQUEADA:
-                                for item in itens:
-                                    preco = float(item.get('valor') or item.get('valorUnitario') or 0)
-                                    peso = (preco * float(item['quantidade'])) / total_bruto_prods
-                                    
-                                    desc_rateio = v_desc_global * peso
-                                    frete_rateio = v_frete * peso
-                                    liquido = max(0, (preco * float(item['quantidade'])) - desc_rateio + frete_rateio)
-
-                                    buffer_vendas.append({
-                                        "id": id_nf,
-                                        "sku": item['codigo'],
-                                        "data_emissao": nf['dataEmissao'][:10],
-                                        "origem": "CASA_MODELO" if nome_loja == "CASA_MODELO" else "SITE",
-                                        "loja": nome_loja,
-                                        "quantidade": item['quantidade'],
-                                        "preco_unitario": preco,
-                                        "desconto": desc_rateio,
-                                        "frete": frete_rateio,
-                                        "valor_total_liquido": liquido
-                                    })
-
-                            # --- ROTA 2: DEVOLUÇÃO (ENTRADA TIPO 0) ---
-                            elif nf['tipo'] == 0 and nat_id in IDS_NATUREZA_DEVOLUCAO:
-                                origem_dev = None
-                                if nome_loja == 'PORTCASA' and str(nf.get('serie')) == "888" and nf['situacao'] == 1:
-                                    origem_dev = "LOJA"
-                                elif nome_loja == 'PORTFIO' and nf.get('loja', {}).get('id') == ID_LOJA_PORTFIO_SITE:
-                                    origem_dev = "SITE"
-                                elif nome_loja == 'CASA_MODELO':
-                                    origem_dev = "CASA_MODELO"
-
-                                if origem_dev:
-                                    for item in itens:
-                                        preco = float(item.get('valor') or item.get('valorUnitario') or 0)
-                                        bruto_linha = preco * float(item['quantidade'])
-                                        peso = bruto_linha / total_bruto_prods
-                                        
-                                        # Estorno = Bruto + Frete + Outras - Desconto
-                                        estorno = max(0, (bruto_linha + (v_frete * peso) + (v_outras * peso)) - (v_desc_global * peso))
-
-                                        buffer_devolucoes.append({
-                                            "id": id_nf,
-                                            "sku": item['codigo'],
-                                            "data_devolucao": nf['dataEmissao'][:10],
-                                            "origem": origem_dev,
-                                            "loja": nome_loja,
-                                            "quantidade": item['quantidade'],
-                                            "valor_estorno": estorno
-                                        })
+                    total_listadas += len(ids_detalhar)
+                    metricas.contar("nfe_saida" if tipo_nfe == 1 else "devolucoes", nome_loja, documentos=len(ids_detalhar))
+                    ausentes = set()
+                    if modo_esparso and ids_detalhar:
+                        indice = carregar_indice_nfes(ids_detalhar, nome_loja)
+                        ausentes = {i for i in ids_detalhar if i not in indice}
+                        ids_detalhar = [nf['id'] for nf in lote if nf['id'] in ids_detalhar and nfe_precisa_detalhe(nf, indice)]
+                    total_detalhadas += len(ids_detalhar)
+                    buffer_vendas.pre_carregar(ids_detalhar)
+                    buffer_devolucoes.pre_carregar(ids_detalhar)
 
+                    # Detalhes em paralelo, respeitando o limite de 3 req/s da conta
+                    for id_nf, nf, erro in service.buscar_detalhes("/nfe/{}", ids_detalhar):
+                        if erro or not nf:
+                            print(f"   ⚠️ Erro na NF {id_nf}: {erro or 'detalhe vazio'}")
+                            registrar_falha(JOB, nome_loja, id_nf, erro or "Detalhe vazio")
+                            continue
+                        try:
+                            # NF que falta no banco é gravada mesmo que o hash diga que já foi (apagada por fora)
+                            rota = processar_nfe(nf, nome_loja, buffer_vendas, buffer_devolucoes, forcar=id_nf in ausentes)
+                            if rota: metricas.contar("nfe_saida" if rota == "venda" else "devolucoes", nome_loja, divergentes=1)
                         except Exception as e_nf:
-                            print(f"   ⚠️ Erro na NF {nf_resumo.get('id')}: {e_nf}")
-
-                    # Salva os lotes processados
-                    if buffer_vendas: salvar_supabase("nfe_saida", buffer_vendas)
-                    if buffer_devolucoes: salvar_supabase("devolucoes", buffer_devolucoes)
+                            print(f"   ⚠️ Erro na NF {id_nf}: {e_nf}")
+                            registrar_falha(JOB, nome_loja, id_nf, e_nf)
 
             except Exception as e_loja:
                 print(f"❌ Erro crítico no processo de {nome_loja}: {e_loja}")
+                metricas.erro("nfe_saida" if tipo_nfe == 1 else "devolucoes", nome_loja, e_loja)
+
+            metricas.marca_dagua("nfe_saida" if tipo_nfe == 1 else "devolucoes", nome_loja, hoje.astimezone())
+
+    buffer_vendas.descarregar()
+    buffer_devolucoes.descarregar()
+    metricas.gravar()
+    plano.registrar()
+    for resumo in [buffer_vendas.resumo(), buffer_devolucoes.resumo()]:
+        if resumo: print(f"🔁 {resumo}")
+
+    if total_listadas:
+        evitadas = 100 * (1 - total_detalhadas / total_listadas)
+        print(f"\n📉 {total_detalhadas} de {total_listadas} NFs detalhadas ({evitadas:.0f}% das chamadas de detalhe evitadas).")
+    return buffer_vendas.total_gravado + buffer_devolucoes.total_gravado + total_removidas
 
 if __name__ == "__main__":
-    processar_reconciliacao_nfe()
-
-    # --- NOVO: GATILHO DE ATUALIZAÇÃO DA VIEW DO DASHBOARD ---
-    print("\n🔄 Sincronização concluída. Disparando atualização da View Gerencial no Banco...")
-    try:
-        r = requests.post(
-            f"{SUPABASE_URL}/rest/v1/rpc/refresh_mview_dashboard", 
-            headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}", "Content-Type": "application/json"}
-        )
-        if r.status_code in [200, 204]:
-            print("✨ View do Dashboard recarregada com sucesso e pronta para uso!")
-        else:
-            print(f"⚠️ Aviso: Falha ao recarregar a View. O site usará dados do último ciclo. ({r.text})")
-    except Exception as e:
-        print(f"⚠️ Erro ao acionar o gatilho da View: {e}")
+    # --completo: detalha todas as NFs da janela, mesmo as que já estão no banco
+    processar_reconciliacao_nfe(modo_esparso="--completo" not in sys.argv)
+
+    # As NFs gravadas direto pelo webhook não passam pelo buffer: recalcula os dias da janela na rollup
+    reconstruir_ultimos_dias(DIAS_BUSCA)
+
+    # Recarrega a view do dashboard e publica os snapshots afetados por este job
+    atualizar_dashboard(["estoque", "vendas"])
@@ -1,12 +1,25 @@
+import sys
 import requests
-import time
 from datetime import datetime, timedelta
 from bling_service import BlingService, SUPABASE_URL, SUPABASE_KEY
+from buffer_escrita import BufferEscrita
+from dead_letter import registrar_falha
+from leitura_supabase import buscar_por_ids
+from hash_documentos import esquecer_hashes
+from rollup_vendas import descontar_documentos, reconstruir_ultimos_dias
+from snapshots_dashboard import atualizar_dashboard
+from metricas_sync import MetricasExecucao
+from orcamento_api import planejar
+from travas import exclusivo
+from reconciliacao_nfe import IDS_NATUREZA_BLOQUEADA
+
+JOB = "reconciliacao_pedidos"
 
 # --- CONFIGURAÇÕES DE RECONCILIAÇÃO ---
 DIAS_BUSCA = 2 # Busca as alterações das últimas 48h
 ID_SIT_ATENDIDO = 9
 ID_SIT_FULL = 375989 # Situação específica do FULL no seu Bling
+TOLERANCIA_TOTAL = 0.05 # Diferença (R$) entre o total da listagem e o total gravado no banco que ainda conta como "igual"
 
 CONFIG_RECONCILIACAO = [
     {
@@ -21,32 +34,160 @@ CONFIG_RECONCILIACAO = [
     }
 ]
 
-def salvar_pedidos_supabase(lote):
-    if not lote: return
-    headers = {
-        "apikey": SUPABASE_KEY, 
-        "Authorization": f"Bearer {SUPABASE_KEY}", 
-        "Prefer": "resolution=merge-duplicates", 
-        "Content-Type": "application/json"
-    }
-    url = f"{SUPABASE_URL}/rest/v1/pedidos_venda"
+def remover_pedido(id_bling):
+    descontar_documentos("pedidos_venda", [id_bling])
+    requests.delete(
+        f"{SUPABASE_URL}/rest/v1/pedidos_venda?id=eq.{id_bling}",
+        headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
+    )
+    esquecer_hashes("pedidos_venda", [id_bling])
+
+def processar_pedido(v, config, buffer_pedidos, forcar=False):
+    """
+    Aplica ao detalhe do pedido a mesma lógica do webhook e coloca as linhas no buffer.
+    'forcar': o pedido falta ou diverge no banco (índice esparso), grava mesmo com o hash igual.
+    Retorna os SKUs gravados (vazio se o pedido saiu do banco ou não tem item válido).
+    """
+    id_bling = v['id']
+    nome_loja = config['loja']
+
+    if v.get('situacao', {}).get('id') != config['situacao']:
+        print(f"   🗑️ Pedido {id_bling} mudou de status. Removendo do banco...")
+        remover_pedido(id_bling)
+        return []
+
+    itens = v.get('itens', [])
+    if not itens: return []
+    linhas_pedido = []
+
+    # --- LÓGICA IDENTICA AO WEBHOOK ---
     
-    r = requests.post(url, headers=headers, json=lote)
-    if r.status_code not in [200, 201, 204]:
-        print(f"   ❌ Erro Supabase: {r.text}")
-    else:
-        print(f"   ✅ {len(lote)} itens de pedidos sincronizados (Upsert).")
+    # 1. Calcula Desconto Global (converte % para R$ se necessário)
+    total_produtos_v3 = float(v.get('totalProdutos', 0) or 0)
+    val_desc_global = float(v.get('desconto', {}).get('valor', 0) or 0)
+    if v.get('desconto', {}).get('unidade') == 'PERCENTUAL':
+        val_desc_global = (total_produtos_v3 * val_desc_global) / 100
 
-def processar_reconciliacao():
+    val_frete_total = float(v.get('transporte', {}).get('frete', 0) or 0)
+    
+    # Base de rateio (Soma o que está no campo 'valor' do item no V3)
+    total_venda_base = sum([(float(i.get('valor', 0)) * float(i.get('quantidade', 0))) for i in itens])
+    if total_venda_base == 0: total_venda_base = 1
+
+    for item in itens:
+        sku = item.get('codigo', '').strip()
+        if not sku: continue
+        # Como no webhook: item com natureza bloqueada (bonificação, remessa...) não é venda
+        if (item.get('naturezaOperacao') or {}).get('id') in IDS_NATUREZA_BLOQUEADA: continue
+
+        # No V3 o item['valor'] já vem com desconto de item. 
+        # O rateio é sobre o Desconto Global e Frete.
+        preco_unitario = float(item.get('valor', 0))
+        
+        # CORREÇÃO: Força quantidade para ser Integer limpo
+        qtd = int(float(item.get('quantidade', 0)))
+        if qtd <= 0: continue
+        
+        valor_bruto_linha = preco_unitario * qtd
+        peso = valor_bruto_linha / total_venda_base
+        
+        desc_global_rateado = val_desc_global * peso
+        frete_rateado = val_frete_total * peso
+        
+        # Valor Líquido Final da Linha (Fórmula do Webhook)
+        valor_liquido_final = max(0, valor_bruto_linha - desc_global_rateado + frete_rateado)
+
+        linhas_pedido.append({
+            "id": id_bling,
+            "sku": sku,
+            "data_pedido": v.get('data'),
+            "origem": config['origem_label'],
+            "loja": nome_loja,
+            "quantidade": qtd,
+            "preco_unitario": preco_unitario,
+            "desconto": desc_global_rateado + float(item.get('desconto', 0) or 0),
+            "frete": frete_rateado,
+            "valor_total_liquido": valor_liquido_final,
+            "total_pedido": float(v.get('total', 0) or 0) # Comparado com a listagem no modo esparso
+        })
+
+    if linhas_pedido: buffer_pedidos.adicionar(linhas_pedido, forcar)
+    return [l['sku'] for l in linhas_pedido]
+
+def reprocessar_documentos(service, documentos):
+    """Usado pela dead-letter: regrava os pedidos já rebuscados. Retorna os ids processados."""
+    config = next(c for c in CONFIG_RECONCILIACAO if c['loja'] == service.nome_loja)
+    buffer_pedidos = BufferEscrita("pedidos_venda", chave_documento="id")
+    recuperados = []
+    for id_bling, v in documentos:
+        try:
+            processar_pedido(v, config, buffer_pedidos)
+            recuperados.append(id_bling)
+        except Exception as e:
+            registrar_falha(JOB, service.nome_loja, id_bling, e)
+    buffer_pedidos.descarregar()
+    return recuperados
+
+def carregar_indice_pedidos(ids, nome_loja):
+    """
+    Índice compacto do que já está no banco: id do pedido -> total do Bling gravado junto com o pedido.
+    Linha antiga, de antes da coluna total_pedido, cai na soma do valor líquido das linhas.
+    """
+    totais, somas = {}, {}
+    for row in buscar_por_ids("pedidos_venda", "id", ids, select="id,valor_total_liquido,total_pedido", filtros=f"loja=eq.{nome_loja}"):
+        somas[row['id']] = somas.get(row['id'], 0) + float(row.get('valor_total_liquido') or 0)
+        if row.get('total_pedido') is not None: totais[row['id']] = float(row['total_pedido'])
+    return {id_pedido: totais.get(id_pedido, soma) for id_pedido, soma in somas.items()}
+
+def selecionar_pedidos_alterados(lote, config):
+    """
+    Modo esparso: decide só com os dados da LISTAGEM quais pedidos precisam de detalhe.
+    - Na situação alvo e ausente do banco, ou com total diferente -> detalhar
+    - Fora da situação alvo mas presente no banco -> remover (sem gastar chamada de detalhe)
+    - O resto já foi gravado corretamente pelo webhook -> ignorar
+    Retorna (ids a detalhar, quantidade de pedidos removidos).
+    """
+    indice = carregar_indice_pedidos([p['id'] for p in lote], config['loja'])
+    detalhar = []
+    removidos = 0
+    for p_resumo in lote:
+        id_bling = p_resumo['id']
+        na_situacao = p_resumo.get('situacao', {}).get('id') == config['situacao']
+
+        if not na_situacao:
+            if id_bling in indice:
+                print(f"   🗑️ Pedido {id_bling} mudou de status. Removendo do banco...")
+                remover_pedido(id_bling)
+                removidos += 1
+            continue
+
+        total_listagem = float(p_resumo.get('total', 0) or 0)
+        if id_bling not in indice or abs(indice[id_bling] - total_listagem) > TOLERANCIA_TOTAL:
+            detalhar.append(id_bling)
+    return detalhar, removidos
+
+@exclusivo(JOB)
+def processar_reconciliacao(modo_esparso=True):
+    """Retorna quantos registros mudaram no banco (linhas gravadas + pedidos removidos)."""
     hoje = datetime.now()
     # Para data de alteração, o Bling exige data e hora: "YYYY-MM-DD HH:MM:SS"
     data_inicio = (hoje - timedelta(days=DIAS_BUSCA)).strftime("%Y-%m-%d %H:%M:%S")
     data_fim = hoje.strftime("%Y-%m-%d %H:%M:%S")
 
-    print(f"🔍 Iniciando Reconciliação de Pedidos (Por Alteração): {data_inicio} até {data_fim}")
+    print(f"🔍 Iniciando Reconciliação de Pedidos (Por Alteração{', Esparsa' if modo_esparso else ''}): {data_inicio} até {data_fim}")
+
+    # Consolida (id, sku) durante toda a execução, não só dentro da página
+    buffer_pedidos = BufferEscrita("pedidos_venda", chave_documento="id")
+    total_listados = 0
+    total_detalhados = 0
+    total_removidos = 0
+    metricas = MetricasExecucao(JOB)
+    plano = planejar(JOB, [c['loja'] for c in CONFIG_RECONCILIACAO])
 
     for config in CONFIG_RECONCILIACAO:
         nome_loja = config['loja']
+        if plano.adiado(nome_loja): continue
+        listados_antes, detalhados_antes = total_listados, total_detalhados
         origem_alvo = config['origem_label']
         print(f"\n🚀 Verificando {nome_loja} (Buscando {origem_alvo})...")
         
@@ -54,108 +195,61 @@ def processar_reconciliacao():
         params = {
             "dataAlteracaoInicial": data_inicio,
             "dataAlteracaoFinal": data_fim,
-            "idsSituacoes[]": config['situacao'],
             "limite": 100
         }
+        # No modo esparso listamos TODAS as situações: quem saiu da situação alvo é removido direto pela listagem
+        if not modo_esparso:
+            params["idsSituacoes[]"] = config['situacao']
 
         try:
             for lote in service.get_all_pages("/pedidos/vendas", params=params):
-                buffer_pedidos = []
-                
-                for p_resumo in lote:
+                if modo_esparso:
+                    total_listados += sum(1 for p in lote if p.get('situacao', {}).get('id') == config['situacao'])
+                    ids, removidos = selecionar_pedidos_alterados(lote, config)
+                    total_removidos += removidos
+                else:
+                    total_listados += len(lote)
+                    ids = [p_resumo['id'] for p_resumo in lote]
+                total_detalhados += len(ids)
+                buffer_pedidos.pre_carregar(ids)
+
+                # Detalhes em paralelo, respeitando o limite de 3 req/s da conta
+                for id_bling, v, erro in service.buscar_detalhes("/pedidos/vendas/{}", ids):
+                    if erro or not v:
+                        print(f"   ⚠️ Erro no pedido {id_bling}: {erro or 'detalhe vazio'}")
+                        registrar_falha(JOB, nome_loja, id_bling, erro or "Detalhe vazio")
+                        continue
                     try:
-                        time.sleep(0.35) # Respeita o rate limit de 3 req/s
-                        
-                        id_bling = p_resumo['id']
-                        url_det = f"https://www.bling.com.br/Api/v3/pedidos/vendas/{id_bling}"
-                        token = service.get_valid_token()
-                        resp = requests.get(url_det, headers={"Authorization": f"Bearer {token}"})
-
-                        if resp.status_code != 200: continue
-                        v = resp.json().get('data')
-                        if not v: continue
-                        
-                        if v.get('situacao', {}).get('id') != config['situacao']:
-                            print(f"   🗑️ Pedido {id_bling} mudou de status. Removendo do banco...")
-                            requests.delete(
-                                f"{SUPABASE_URL}/rest/v1/pedidos_venda?id=eq.{id_bling}",
-                                headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
-                            )
-                            continue
-
-                        itens = v.get('itens', [])
-                        if not itens: continue
-
-                        # --- LÓGICA IDENTICA AO WEBHOOK ---
-                        
-                        # 1. Calcula Desconto Global (converte % para R$ se necessário)
-                        total_produtos_v3 = float(v.get('totalProdutos', 0) or 0)
-                        val_desc_global = float(v.get('desconto', {}).get('valor', 0) or 0)
-                        if v.get('desconto', {}).get('unidade') == 'PERCENTUAL':
-                            val_desc_global = (total_produtos_v3 * val_desc_global) / 100
-
-                        val_frete_total = float(v.get('transporte', {}).get('frete', 0) or 0)
-                        
-                        # Base de rateio (Soma o que está no campo 'valor' do item no V3)
-                        total_venda_base = sum([(float(i.get('valor', 0)) * float(i.get('quantidade', 0))) for i in itens])
-                        if total_venda_base == 0: total_venda_base = 1
-
-                        for item in itens:
-                            sku = item.get('codigo', '').strip()
-                            if not sku: continue
-
-                            # No V3 o item['valor'] já vem com desconto de item. 
-                            # O rateio é sobre o Desconto Global e Frete.
-                            preco_unitario = float(item.get('valor', 0))
-                            
-                            # CORREÇÃO: Força quantidade para ser Integer limpo
-                            qtd = int(float(item.get('quantidade', 0)))
-                            if qtd <= 0: continue
-                            
-                            valor_bruto_linha = preco_unitario * qtd
-                            peso = valor_bruto_linha / total_venda_base
-                            
-                            desc_global_rateado = val_desc_global * peso
-                            frete_rateado = val_frete_total * peso
-                            
-                            # Valor Líquido Final da Linha (Fórmula do Webhook)
-                            valor_liquido_final = max(0, valor_bruto_linha - desc_global_rateado + frete_rateado)
-
-                            buffer_pedidos.append({
-                                "id": id_bling,
-                                "sku": sku,
-                                "data_pedido": v.get('data'),
-                                "origem": origem_alvo,
-                                "loja": nome_loja,
-                                "quantidade": qtd,
-                                "preco_unitario": preco_unitario,
-                                "desconto": desc_global_rateado + float(item.get('desconto', 0) or 0),
-                                "frete": frete_rateado,
-                                "valor_total_liquido": valor_liquido_final
-                            })
-
+                        # No modo esparso só é detalhado o pedido que falta ou diverge no banco
+                        processar_pedido(v, config, buffer_pedidos, forcar=modo_esparso)
                     except Exception as e_item:
-                        print(f"   ⚠️ Erro no pedido {p_resumo.get('id')}: {e_item}")
-
-                if buffer_pedidos:
-                    salvar_pedidos_supabase(buffer_pedidos)
+                        print(f"   ⚠️ Erro no pedido {id_bling}: {e_item}")
+                        registrar_falha(JOB, nome_loja, id_bling, e_item)
 
         except Exception as e_loja:
             print(f"❌ Erro crítico na loja {nome_loja}: {e_loja}")
+            metricas.erro("pedidos_venda", nome_loja, e_loja)
+
+        # Divergentes = pedidos que o webhook não tinha gravado (ou gravou diferente) e precisaram de detalhe
+        metricas.contar("pedidos_venda", nome_loja, total_listados - listados_antes, total_detalhados - detalhados_antes)
+        metricas.marca_dagua("pedidos_venda", nome_loja, hoje.astimezone())
+
+    buffer_pedidos.descarregar()
+    metricas.gravar()
+    plano.registrar()
+    if buffer_pedidos.resumo(): print(f"\n🔁 {buffer_pedidos.resumo()}")
+
+    if total_listados:
+        evitados = 100 * (1 - total_detalhados / total_listados)
+        print(f"\n📉 {total_detalhados} de {total_listados} pedidos detalhados ({evitados:.0f}% das chamadas de detalhe evitadas).")
+    return buffer_pedidos.total_gravado + total_removidos
 
 if __name__ == "__main__":
-    processar_reconciliacao()
-
-    # --- NOVO: GATILHO DE ATUALIZAÇÃO DA VIEW DO DASHBOARD ---
-    print("\n🔄 Sincronização concluída. Disparando atualização da View Gerencial no Banco...")
-    try:
-        r = requests.post(
-            f"{SUPABASE_URL}/rest/v1/rpc/refresh_mview_dashboard", 
-            headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}", "Content-Type": "application/json"}
-        )
-        if r.status_code in [200, 204]:
-            print("✨ View do Dashboard recarregada com sucesso e pronta para uso!")
-        else:
-            print(f"⚠️ Aviso: Falha ao recarregar a View. O site usará dados do último ciclo. ({r.text})")
-    except Exception as e:
-        print(f"⚠️ Erro ao acionar o gatilho da View: {e}")
+    # --completo: ignora o índice e detalha todos os pedidos da janela (comportamento antigo)
+    processar_reconciliacao(modo_esparso="--completo" not in sys.argv)
+
+    # Os pedidos gravados direto pelo webhook não passam pelo buffer: recalcula os dias da janela na rollup
+    reconstruir_ultimos_dias(DIAS_BUSCA)
+
+    # Recarrega a view do dashboard e publica os snapshots afetados por este job
+    atualizar_dashboard(["estoque", "vendas"])
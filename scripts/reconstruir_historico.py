@@ -0,0 +1,136 @@
+import sys
+import pandas as pd
+from datetime import datetime, timedelta
+from escrita_supabase import upsert_lote
+from leitura_supabase import buscar_tudo
+from orcamento_api import planejar_backfill
+
+# --- RECONSTRUÇÃO DO HISTÓRICO DE ESTOQUE (historico_resumo) ---
+# Parte do estoque ATUAL e anda para trás no tempo desfazendo as movimentações:
+#   estoque(fim do dia d) = estoque atual - entradas depois de d + saídas depois de d
+# Saídas = vendas da rollup diária; entradas = devoluções + compras atendidas.
+# Tudo numa matriz SKU x dia (uma passada vetorizada), valorizada pelo custo médio vigente em cada dia.
+
+# Canal da rollup / do estoque -> lado do histórico (o site soma site + full, igual ao dashboard)
+LADO_CANAL = {"LOJA": "loja", "SITE": "site", "SITE_FULL": "site", "FULL": "site"}
+LADO_LOJA_COMPRA = {"PORTCASA": "loja", "PORTFIO": "site"}
+
+def _num(serie):
+    return pd.to_numeric(serie, errors='coerce').fillna(0)
+
+def carregar_movimentos(data_inicio):
+    """Entrada líquida (compras + devoluções - vendas) por SKU, lado e dia, a partir de data_inicio."""
+    vendas = pd.DataFrame(buscar_tudo(
+        "vendas_diarias", select="data,sku,canal,qtd_vendida,qtd_devolvida", filtros=f"data=gte.{data_inicio}"
+    ), columns=["data", "sku", "canal", "qtd_vendida", "qtd_devolvida"])
+    vendas['lado'] = vendas['canal'].map(LADO_CANAL)
+    vendas['entrada'] = _num(vendas['qtd_devolvida']) - _num(vendas['qtd_vendida'])
+
+    # O Bling não informa a data de recebimento: usa a data prevista e, na falta dela, a data do pedido
+    compras = pd.DataFrame(buscar_tudo(
+        "compras_pedidos", select="sku,loja,data_pedido,data_prevista,quantidade", filtros="situacao=eq.Atendido"
+    ), columns=["sku", "loja", "data_pedido", "data_prevista", "quantidade"])
+    compras['data'] = compras['data_prevista'].fillna(compras['data_pedido'])
+    compras['lado'] = compras['loja'].map(LADO_LOJA_COMPRA)
+    compras['entrada'] = _num(compras['quantidade'])
+
+    movimentos = pd.concat([vendas[['sku', 'lado', 'data', 'entrada']], compras[['sku', 'lado', 'data', 'entrada']]])
+    movimentos = movimentos.dropna(subset=['sku', 'lado', 'data'])
+    movimentos['data'] = pd.to_datetime(movimentos['data'].astype(str).str[:10], errors='coerce')
+    return movimentos[movimentos['data'] >= pd.Timestamp(data_inicio)]
+
+def carregar_estoque_atual():
+    estoque = pd.DataFrame(buscar_tudo("estoque", select="sku,canal,quantidade"), columns=["sku", "canal", "quantidade"])
+    estoque['lado'] = estoque['canal'].map(LADO_CANAL)
+    estoque['quantidade'] = _num(estoque['quantidade'])
+    return estoque.dropna(subset=['lado']).groupby(['sku', 'lado'])['quantidade'].sum()
+
+def matriz_custos(skus, dias):
+    """Custo médio vigente de cada SKU em cada dia (histórico do motor de custo, com o custo_final da view como reserva)."""
+    historico = pd.DataFrame(buscar_tudo("custos_sku_historico", select="sku,data,custo_medio"), columns=["sku", "data", "custo_medio"])
+    historico['data'] = pd.to_datetime(historico['data'])
+    historico['custo_medio'] = _num(historico['custo_medio'])
+    historico = historico.sort_values('data')
+
+    # Pontos anteriores ao período entram como o custo vigente no primeiro dia
+    historico['data'] = historico['data'].clip(lower=dias[0])
+    custos = historico.pivot_table(index='sku', columns='data', values='custo_medio', aggfunc='last')
+    custos = custos.reindex(index=skus, columns=dias).ffill(axis=1).bfill(axis=1)
+
+    view = pd.DataFrame(buscar_tudo("mview_dashboard_completa", select="sku,tipo,custo_final"), columns=["sku", "tipo", "custo_final"])
+    view = view.drop_duplicates('sku').set_index('sku')
+    reserva = _num(view['custo_final']).reindex(skus).fillna(0)
+    return custos.apply(lambda col: col.fillna(reserva)), view['tipo']
+
+def reconstruir(data_inicio, data_fim):
+    """Valoriza loja e site no fim de cada dia do intervalo. Retorna um DataFrame indexado pela data."""
+    hoje = pd.Timestamp(datetime.now().date())
+    dias_movimento = pd.date_range(pd.Timestamp(data_inicio), hoje, freq='D')
+
+    print(f"⏳ Carregando movimentações desde {data_inicio}...")
+    movimentos = carregar_movimentos(data_inicio)
+    atual = carregar_estoque_atual()
+
+    # Matriz (sku, lado) x dia com a entrada líquida de cada dia
+    entradas = movimentos.pivot_table(index=['sku', 'lado'], columns='data', values='entrada', aggfunc='sum')
+    indice = atual.index.union(entradas.index)
+    entradas = entradas.reindex(index=indice, columns=dias_movimento, fill_value=0).fillna(0)
+
+    # Soma das entradas POSTERIORES a cada dia: cumsum da direita para a esquerda, menos o próprio dia
+    posteriores = entradas.iloc[:, ::-1].cumsum(axis=1).iloc[:, ::-1] - entradas
+    estoque = posteriores.rsub(atual.reindex(indice).fillna(0), axis=0)
+
+    dias = pd.date_range(pd.Timestamp(data_inicio), min(pd.Timestamp(data_fim), hoje), freq='D')
+    estoque = estoque[dias]
+
+    skus = estoque.index.get_level_values('sku').unique()
+    custos, tipos = matriz_custos(skus, dias)
+
+    # Kits (formato E) não têm estoque próprio: mesma trava do dashboard
+    kits = set(tipos[tipos == 'E'].index)
+    estoque = estoque[~estoque.index.get_level_values('sku').isin(kits)]
+
+    custo_linhas = custos.reindex(estoque.index.get_level_values('sku')).to_numpy()
+    valores = pd.DataFrame(estoque.to_numpy() * custo_linhas, index=estoque.index, columns=dias)
+    resumo = valores.groupby(level='lado').sum().T
+    return resumo.reindex(columns=['loja', 'site'], fill_value=0)
+
+def gravar_historico(resumo, sobrescrever=False):
+    """Grava os dias reconstruídos. Sem 'sobrescrever', só preenche os dias que faltam no histórico."""
+    existentes = set()
+    if not sobrescrever:
+        inicio, fim = resumo.index[0].strftime("%Y-%m-%d"), resumo.index[-1].strftime("%Y-%m-%d")
+        existentes = {l['data'][:10] for l in buscar_tudo("historico_resumo", select="data", filtros=f"data=gte.{inicio}&data=lte.{fim}")}
+
+    payload = [{
+        "data": dia.strftime("%Y-%m-%d"),
+        "estoque_loja": round(float(linha['loja']), 2),
+        "estoque_site": round(float(linha['site']), 2)
+    } for dia, linha in resumo.iterrows() if dia.strftime("%Y-%m-%d") not in existentes]
+
+    gravados, _ = upsert_lote("historico_resumo", payload)
+    print(f"✅ {gravados} dia(s) gravados em historico_resumo ({len(existentes)} já existiam e foram mantidos).")
+
+if __name__ == "__main__":
+    # Uso: python scripts/reconstruir_historico.py AAAA-MM-DD [AAAA-MM-DD] [--sobrescrever]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if not args:
+        print("Uso: python scripts/reconstruir_historico.py data_inicio [data_fim] [--sobrescrever]")
+        sys.exit(1)
+    for data in args[:2]: datetime.strptime(data, "%Y-%m-%d") # Valida o formato antes de consultar qualquer coisa
+    ontem = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    data_inicio = args[0]
+    data_fim = min(args[1], ontem) if len(args) > 1 else ontem # O dia de hoje ainda não fechou
+    if data_inicio > data_fim:
+        print(f"❌ Período vazio: {data_inicio} a {data_fim} (o início deve ser anterior ou igual ao fim, e o histórico vai no máximo até ontem).")
+        print("Uso: python scripts/reconstruir_historico.py data_inicio [data_fim] [--sobrescrever]")
+        sys.exit(1)
+
+    plano = planejar_backfill("Reconstrução do histórico de estoque")
+    if plano is None: sys.exit(0)
+    try:
+        resumo = reconstruir(data_inicio, data_fim)
+        print(f"💰 {len(resumo)} dia(s) reconstruídos. Último: Loja R$ {resumo['loja'].iloc[-1]:,.2f} | Site R$ {resumo['site'].iloc[-1]:,.2f}")
+        gravar_historico(resumo, sobrescrever="--sobrescrever" in sys.argv)
+    finally:
+        plano.registrar()
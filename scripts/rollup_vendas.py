@@ -0,0 +1,144 @@
+import sys
+import time
+import requests
+from datetime import datetime, timedelta
+from bling_service import SUPABASE_URL
+from escrita_supabase import cabecalhos_supabase
+from leitura_supabase import buscar_por_ids
+from checkpoint import Checkpoint, ler_prazo
+from travas import exclusivo
+from orcamento_api import planejar_backfill
+
+# --- ROLLUP DIÁRIA DE VENDAS (SKU x CANAL x DIA) ---
+# Os scripts de sync mantêm a tabela 'vendas_diarias' aplicando só a DIFERENÇA de cada documento
+# gravado, alterado ou removido. O giro de 120d vira uma soma sobre poucas linhas por SKU.
+TABELA_ROLLUP = "vendas_diarias"
+DELTAS_POR_CHAMADA = 1000
+DIAS_POR_BLOCO = 30 # Backfill: um mês por chamada de reconstrução
+JOB_BACKFILL = "backfill_vendas"
+
+# tabela de detalhe -> (coluna de data, {coluna do detalhe: coluna da rollup})
+MAPA_ROLLUP = {
+    "pedidos_venda": ("data_pedido", {"quantidade": "qtd_vendida", "valor_total_liquido": "receita"}),
+    "nfe_saida": ("data_emissao", {"quantidade": "qtd_vendida", "valor_total_liquido": "receita"}),
+    "devolucoes": ("data_devolucao", {"quantidade": "qtd_devolvida", "valor_estorno": "valor_estorno"})
+}
+
+def colunas_rollup(tabela):
+    """Colunas do detalhe necessárias para calcular a contribuição de uma linha na rollup."""
+    col_data, metricas = MAPA_ROLLUP[tabela]
+    return ",".join(["id", "sku", "origem", col_data] + list(metricas.keys()))
+
+class DeltasRollup:
+    """Acumula em memória as diferenças por (dia, sku, canal) e aplica tudo numa chamada de RPC."""
+
+    def __init__(self):
+        self.deltas = {}
+
+    def somar(self, tabela, linhas, sinal=1):
+        col_data, metricas = MAPA_ROLLUP[tabela]
+        for linha in linhas:
+            if not linha.get(col_data) or not linha.get("sku") or not linha.get("origem"): continue
+            chave = (str(linha[col_data])[:10], linha["sku"], linha["origem"])
+            balde = self.deltas.setdefault(chave, {})
+            for col_det, col_roll in metricas.items():
+                balde[col_roll] = balde.get(col_roll, 0) + sinal * float(linha.get(col_det) or 0)
+
+    def aplicar(self):
+        """Envia os deltas não nulos. Em caso de erro, mantém os deltas para uma nova tentativa."""
+        deltas = [
+            {"data": k[0], "sku": k[1], "canal": k[2], **{c: round(v, 4) for c, v in balde.items()}}
+            for k, balde in self.deltas.items()
+            if any(abs(v) > 1e-9 for v in balde.values())
+        ]
+        for pos in range(0, len(deltas), DELTAS_POR_CHAMADA):
+            r = requests.post(
+                f"{SUPABASE_URL}/rest/v1/rpc/aplicar_deltas_vendas", headers=cabecalhos_supabase(upsert=False),
+                json={"deltas": deltas[pos:pos + DELTAS_POR_CHAMADA]}
+            )
+            if r.status_code not in [200, 204]:
+                print(f"   ⚠️ Falha ao atualizar a rollup de vendas: {r.text}")
+                return 0
+        self.deltas = {}
+        return len(deltas)
+
+    def __len__(self):
+        return len(self.deltas)
+
+def descontar_documentos(tabela, ids):
+    """Antes de apagar documentos do detalhe: tira da rollup o que eles tinham contribuído."""
+    if not ids: return
+    try:
+        linhas = buscar_por_ids(tabela, "id", ids, select=colunas_rollup(tabela))
+    except Exception as e:
+        print(f"   ⚠️ Rollup de {tabela} não descontada para {ids}: {e}")
+        return
+    deltas = DeltasRollup()
+    deltas.somar(tabela, linhas, sinal=-1)
+    deltas.aplicar()
+
+def reconstruir_periodo(data_inicio, data_fim):
+    """Recalcula os baldes do intervalo a partir do detalhe (carga inicial e o que o webhook gravou direto)."""
+    r = requests.post(
+        f"{SUPABASE_URL}/rest/v1/rpc/reconstruir_vendas_diarias", headers=cabecalhos_supabase(upsert=False),
+        json={"data_inicio": data_inicio, "data_fim": data_fim}
+    )
+    if r.status_code not in [200, 204]:
+        print(f"⚠️ Falha ao reconstruir a rollup de vendas ({data_inicio} a {data_fim}): {r.text}")
+        return False
+    print(f"📊 Rollup de vendas recalculada de {data_inicio} a {data_fim}.")
+    return True
+
+def reconstruir_ultimos_dias(dias):
+    hoje = datetime.now()
+    return reconstruir_periodo((hoje - timedelta(days=dias)).strftime("%Y-%m-%d"), hoje.strftime("%Y-%m-%d"))
+
+@exclusivo(JOB_BACKFILL)
+def reconstruir_intervalo(data_inicio, data_fim=None, prazo=None):
+    """
+    Carga inicial / correção de um período longo, um bloco de DIAS_POR_BLOCO por chamada (timeout do PostgREST).
+    Com 'prazo', para entre dois blocos e grava o próximo bloco em checkpoint; a mesma chamada (mesmo início)
+    continua dali. Bloco que falhar também fica no checkpoint para ser tentado de novo.
+    Retorna None se o planejador adiou o backfill (o checkpoint, se houver, continua valendo).
+    """
+    plano = planejar_backfill("Backfill da rollup de vendas")
+    if plano is None: return None
+    try:
+        return _reconstruir_blocos(data_inicio, data_fim, prazo)
+    finally:
+        plano.registrar()
+
+def _reconstruir_blocos(data_inicio, data_fim, prazo):
+    checkpoint = Checkpoint(JOB_BACKFILL)
+    cursor = checkpoint.carregar()
+    if cursor and cursor.get("inicio") != data_inicio:
+        print(f"⚠️ Checkpoint de outro backfill ({cursor['inicio']} a {cursor['fim']}) descartado.")
+        cursor = None
+    data_fim = data_fim or (cursor or {}).get("fim") or datetime.now().strftime("%Y-%m-%d")
+
+    inicio = datetime.strptime(cursor["proximo"] if cursor else data_inicio, "%Y-%m-%d")
+    fim = datetime.strptime(data_fim, "%Y-%m-%d")
+    while inicio <= fim:
+        if prazo and prazo.esgotado():
+            checkpoint.salvar({"inicio": data_inicio, "fim": data_fim, "proximo": inicio.strftime("%Y-%m-%d")})
+            return False
+        inicio_bloco = time.monotonic()
+        fim_bloco = min(inicio + timedelta(days=DIAS_POR_BLOCO), fim)
+        if not reconstruir_periodo(inicio.strftime("%Y-%m-%d"), fim_bloco.strftime("%Y-%m-%d")):
+            checkpoint.salvar({"inicio": data_inicio, "fim": data_fim, "proximo": inicio.strftime("%Y-%m-%d")})
+            return False
+        if prazo: prazo.passo(time.monotonic() - inicio_bloco)
+        inicio = fim_bloco + timedelta(days=1)
+
+    checkpoint.concluir()
+    return True
+
+if __name__ == "__main__":
+    # Uso: python scripts/rollup_vendas.py AAAA-MM-DD [AAAA-MM-DD] [--prazo=MINUTOS]  (carga inicial / correção de um período)
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if not args:
+        print("Uso: python scripts/rollup_vendas.py data_inicio [data_fim] [--prazo=MINUTOS]")
+        sys.exit(1)
+    for data in args: datetime.strptime(data, "%Y-%m-%d") # Valida o formato antes de gravar qualquer checkpoint
+    if reconstruir_intervalo(args[0], args[1] if len(args) > 1 else None, prazo=ler_prazo()) is False:
+        sys.exit(1)
@@ -0,0 +1,218 @@
+import gzip
+import json
+import requests
+from datetime import datetime, timedelta
+from bling_service import SUPABASE_URL, SUPABASE_KEY
+from escrita_supabase import cabecalhos_supabase
+from leitura_supabase import buscar_tudo
+
+# --- SNAPSHOTS PRÉ-AGREGADOS DO DASHBOARD ---
+# Depois de cada sync geramos um arquivo pequeno por dataset (JSON colunar + gzip) no Storage,
+# com versão. O dashboard baixa um artefato em vez de paginar dezenas de milhares de linhas.
+BUCKET_SNAPSHOTS = "dashboard-snapshots"
+TABELA_VERSOES = "dashboard_snapshots"
+DIAS_VENDAS = 120 # Janela da rollup de vendas (cobre os 30/60/90 dias do dashboard e o giro de 120d)
+VERSOES_MANTIDAS = 3 # Versões de cada dataset que ficam no Storage (a atual e as anteriores mais recentes)
+
+def _colunar(linhas, colunas):
+    """Lista de dicts -> {coluna: [valores]} (bem menor depois do gzip do que repetir as chaves)."""
+    return {c: [l.get(c) for l in linhas] for c in colunas}
+
+def _num(v):
+    try: return float(v or 0)
+    except (TypeError, ValueError): return 0.0
+
+def dataset_estoque():
+    """Estoque e cobertura por SKU, direto da view materializada."""
+    linhas = buscar_tudo("mview_dashboard_completa", filtros="sku=not.is.null")
+    for l in linhas:
+        venda_dia = _num(l.get('v_qtd_120d_geral')) / 120
+        l['cobertura_dias'] = round(_num(l.get('est_total')) / venda_dia, 1) if venda_dia > 0 else None
+    colunas = sorted({c for l in linhas for c in l.keys()})
+    return _colunar(linhas, colunas), len(linhas)
+
+def dataset_vendas():
+    """Receita e nº de vendas por dia / canal / fornecedor / categoria."""
+    data_corte = (datetime.now() - timedelta(days=DIAS_VENDAS)).strftime("%Y-%m-%d")
+    linhas = buscar_tudo(
+        "view_vendas_detalhadas",
+        select="id_venda,data_venda,receita,canal_macro,canal_detalhado,fornecedor,categoria",
+        filtros=f"data_venda=gte.{data_corte}"
+    )
+
+    grupos = {}
+    for l in linhas:
+        chave = (str(l.get('data_venda'))[:10], l.get('canal_macro'), l.get('canal_detalhado'), l.get('fornecedor'), l.get('categoria'))
+        g = grupos.setdefault(chave, {"receita": 0.0, "vendas": set()})
+        g["receita"] += _num(l.get('receita'))
+        g["vendas"].add(l.get('id_venda'))
+
+    rollup = [{
+        "dia": k[0], "canal_macro": k[1], "canal_detalhado": k[2], "fornecedor": k[3], "categoria": k[4],
+        "receita": round(g["receita"], 2), "vendas": len(g["vendas"])
+    } for k, g in sorted(grupos.items(), key=lambda x: x[0][0])]
+
+    colunas = ["dia", "canal_macro", "canal_detalhado", "fornecedor", "categoria", "receita", "vendas"]
+    return _colunar(rollup, colunas), len(rollup)
+
+def dataset_categorias():
+    """Receita e quantidade vendida por categoria (120d e 30d), cada nível da árvore somando as subcategorias."""
+    from arvore_categorias import obter_arvore
+    arvore = obter_arvore()
+    corte_120 = (datetime.now() - timedelta(days=DIAS_VENDAS)).strftime("%Y-%m-%d")
+    corte_30 = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+
+    categoria_sku = {l['sku']: l['categoria_id'] for l in buscar_tudo("produtos", select="sku,categoria_id", filtros="categoria_id=not.is.null")}
+    diretas = {}
+    for l in buscar_tudo("vendas_diarias", select="data,sku,qtd_vendida,receita", filtros=f"data=gte.{corte_120}"):
+        id_categoria = categoria_sku.get(l.get('sku'))
+        if not id_categoria: continue
+        d = diretas.setdefault(id_categoria, {"receita_120d": 0.0, "qtd_120d": 0.0, "receita_30d": 0.0, "qtd_30d": 0.0})
+        d["receita_120d"] += _num(l.get('receita'))
+        d["qtd_120d"] += _num(l.get('qtd_vendida'))
+        if str(l.get('data'))[:10] >= corte_30:
+            d["receita_30d"] += _num(l.get('receita'))
+            d["qtd_30d"] += _num(l.get('qtd_vendida'))
+
+    rollup = []
+    for id_categoria, total in arvore.somar_por_categoria(diretas).items():
+        cadeia = arvore.ancestrais(id_categoria)
+        raiz = arvore.raiz(id_categoria)
+        rollup.append({
+            "id_categoria": id_categoria,
+            "id_categoria_pai": cadeia[1] if len(cadeia) > 1 else None,
+            "caminho": arvore.caminho(id_categoria) or f"Categoria {id_categoria}",
+            "raiz": arvore.nos[raiz]['descricao'] if raiz else None,
+            "nivel": max(len(cadeia) - 1, 0),
+            **{m: round(v, 2) for m, v in total.items()}
+        })
+    rollup.sort(key=lambda r: r["caminho"])
+
+    colunas = ["id_categoria", "id_categoria_pai", "caminho", "raiz", "nivel", "receita_120d", "qtd_120d", "receita_30d", "qtd_30d"]
+    return _colunar(rollup, colunas), len(rollup)
+
+def dataset_compras():
+    """Pedidos de compra em andamento: quantidade, valor (custo de entrada) e nº de pedidos por fornecedor/loja/previsão."""
+    linhas = buscar_tudo(
+        "compras_pedidos",
+        select="id_pedido,sku,fornecedor,loja,data_prevista,quantidade,preco_unitario,desconto,frete,ipi",
+        filtros="situacao=eq.Em Andamento"
+    )
+
+    grupos = {}
+    for l in linhas:
+        chave = (l.get('fornecedor'), l.get('loja'), l.get('data_prevista'))
+        g = grupos.setdefault(chave, {"quantidade": 0.0, "valor": 0.0, "pedidos": set(), "skus": set()})
+        qtd = _num(l.get('quantidade'))
+        custo_un = _num(l.get('preco_unitario')) - _num(l.get('desconto')) + _num(l.get('frete')) + _num(l.get('ipi'))
+        g["quantidade"] += qtd
+        g["valor"] += qtd * custo_un
+        g["pedidos"].add(l.get('id_pedido'))
+        g["skus"].add(l.get('sku'))
+
+    rollup = [{
+        "fornecedor": k[0], "loja": k[1], "data_prevista": k[2],
+        "quantidade": g["quantidade"], "valor": round(g["valor"], 2),
+        "pedidos": len(g["pedidos"]), "skus": len(g["skus"])
+    } for k, g in grupos.items()]
+
+    colunas = ["fornecedor", "loja", "data_prevista", "quantidade", "valor", "pedidos", "skus"]
+    return _colunar(rollup, colunas), len(rollup)
+
+DATASETS = {
+    "estoque": dataset_estoque,
+    "vendas": dataset_vendas,
+    "categorias": dataset_categorias,
+    "compras": dataset_compras
+}
+
+def _cabecalhos_storage(**extras):
+    return {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}", **extras}
+
+def limpar_versoes_antigas(dataset, caminho_atual, manter=VERSOES_MANTIDAS):
+    """Apaga do Storage as versões de 'dataset' além das 'manter' mais recentes. Nunca apaga a do ponteiro."""
+    nomes = []
+    offset = 0
+    while True:
+        r = requests.post(
+            f"{SUPABASE_URL}/storage/v1/object/list/{BUCKET_SNAPSHOTS}", headers=_cabecalhos_storage(),
+            json={"prefix": dataset, "limit": 1000, "offset": offset, "sortBy": {"column": "name", "order": "desc"}}
+        )
+        if r.status_code != 200:
+            raise Exception(f"Erro ao listar versões de {dataset}: {r.text}")
+        lote = r.json()
+        nomes += [o['name'] for o in lote if o.get('name')]
+        if len(lote) < 1000: break
+        offset += 1000
+
+    # A versão é o timestamp no nome: ordem alfabética = ordem cronológica
+    caminhos = sorted((f"{dataset}/{n}" for n in nomes), reverse=True)
+    # Relê o ponteiro: se outro processo publicou no meio, a versão dele também fica
+    protegidos = {caminho_atual} | {l['caminho'] for l in buscar_tudo(TABELA_VERSOES, select="caminho", filtros=f"dataset=eq.{dataset}")}
+    antigos = [c for c in caminhos[manter:] if c not in protegidos]
+    if not antigos: return 0
+
+    r = requests.delete(
+        f"{SUPABASE_URL}/storage/v1/object/{BUCKET_SNAPSHOTS}", headers=_cabecalhos_storage(**{"Content-Type": "application/json"}),
+        json={"prefixes": antigos}
+    )
+    if r.status_code != 200:
+        raise Exception(f"Erro ao apagar versões antigas de {dataset}: {r.text}")
+    return len(antigos)
+
+def publicar_snapshot(dataset, dados, linhas, versao):
+    """Sobe o blob versionado no Storage e atualiza o ponteiro da versão atual na tabela."""
+    corpo = gzip.compress(json.dumps({"dataset": dataset, "versao": versao, "dados": dados}, default=str, separators=(",", ":")).encode("utf-8"))
+    caminho = f"{dataset}/{versao}.json.gz"
+
+    r = requests.post(
+        f"{SUPABASE_URL}/storage/v1/object/{BUCKET_SNAPSHOTS}/{caminho}",
+        headers=_cabecalhos_storage(**{"Content-Type": "application/gzip", "x-upsert": "true"}),
+        data=corpo
+    )
+    if r.status_code not in [200, 201]:
+        raise Exception(f"Erro ao enviar {caminho} ao Storage: {r.text}")
+
+    r = requests.post(
+        f"{SUPABASE_URL}/rest/v1/{TABELA_VERSOES}", headers=cabecalhos_supabase(),
+        json={"dataset": dataset, "versao": versao, "caminho": caminho, "linhas": linhas, "bytes": len(corpo), "gerado_em": datetime.now().isoformat()}
+    )
+    if r.status_code not in [200, 201, 204]:
+        raise Exception(f"Erro ao registrar versão de {dataset}: {r.text}")
+
+    print(f"   📦 Snapshot {dataset}: {linhas} linhas, {len(corpo) / 1024:.0f} KB ({caminho})")
+
+    # Só depois do ponteiro trocado: as versões antigas já não são lidas por ninguém
+    try:
+        apagadas = limpar_versoes_antigas(dataset, caminho)
+        if apagadas: print(f"   🧹 {dataset}: {apagadas} versão(ões) antiga(s) removida(s) do Storage.")
+    except Exception as e:
+        print(f"   ⚠️ Versões antigas de {dataset} não removidas: {e}")
+
+def gerar_snapshots(datasets=None):
+    """Etapa pós-sync: reconstrói os datasets pedidos (ou todos) e publica uma nova versão de cada."""
+    versao = datetime.now().strftime("%Y%m%d%H%M%S")
+    print(f"\n🗂️ Gerando snapshots do dashboard (versão {versao})...")
+    for nome in datasets or DATASETS.keys():
+        try:
+            dados, linhas = DATASETS[nome]()
+            publicar_snapshot(nome, dados, linhas, versao)
+        except Exception as e:
+            print(f"   ⚠️ Falha no snapshot {nome}: {e}")
+
+def atualizar_dashboard(datasets=None):
+    """Recarrega a view materializada e, em seguida, regenera os snapshots que dependem dela."""
+    print("\n🔄 Sincronização concluída. Disparando atualização da View Gerencial no Banco...")
+    try:
+        r = requests.post(f"{SUPABASE_URL}/rest/v1/rpc/refresh_mview_dashboard", headers=cabecalhos_supabase(upsert=False))
+        if r.status_code in [200, 204]:
+            print("✨ View do Dashboard recarregada com sucesso e pronta para uso!")
+        else:
+            print(f"⚠️ Aviso: Falha ao recarregar a View. O site usará dados do último ciclo. ({r.text})")
+    except Exception as e:
+        print(f"⚠️ Erro ao acionar o gatilho da View: {e}")
+
+    gerar_snapshots(datasets)
+
+if __name__ == "__main__":
+    gerar_snapshots()
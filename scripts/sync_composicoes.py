@@ -0,0 +1,138 @@
+import requests
+from bling_service import BlingService, SUPABASE_URL, SUPABASE_KEY
+from escrita_supabase import upsert_lote, cabecalhos_supabase
+from leitura_supabase import buscar_por_ids, formatar_in
+from indice_catalogo import obter_indice
+from dead_letter import registrar_falha
+from metricas_sync import MetricasExecucao
+from orcamento_api import planejar
+from travas import exclusivo
+from snapshots_dashboard import atualizar_dashboard
+
+# --- SYNC DAS COMPOSIÇÕES DE KITS ---
+# Lista os kits (tipo E) de cada conta e busca as estruturas em paralelo sob o limitador da conta
+# (o token é renovado pelo BlingService). O conjunto de componentes de cada kit é comparado com
+# 'composicoes': só vínculos novos ou com quantidade diferente são gravados, e componentes que
+# saíram do kit são apagados.
+JOB = "sync_composicoes"
+LOJAS = ["PORTFIO", "CASA_MODELO"]
+
+def componentes_kit(estrutura, mapa):
+    """Estrutura do Bling -> ({sku_filho: quantidade}, completo). Incompleto se algum filho não está no banco."""
+    componentes = {}
+    completo = True
+    for comp in (estrutura or {}).get('componentes', []):
+        sku_filho = mapa.get(comp.get("produto", {}).get("id"))
+        if not sku_filho:
+            completo = False
+            continue
+        componentes[sku_filho] = componentes.get(sku_filho, 0) + float(comp.get("quantidade", 1) or 1)
+    return componentes, completo
+
+def aplicar_diferencas(kits, incompletos=()):
+    """
+    kits: {sku_pai: {sku_filho: quantidade}} vindos do Bling. Compara com o banco e grava só a diferença.
+    Kits incompletos (filho fora do banco) não perdem vínculos: sem o SKU não dá para saber se o filho saiu.
+    Retorna (gravados, removidos).
+    """
+    if not kits: return 0, 0
+    atuais = {}
+    for l in buscar_por_ids("composicoes", "sku_pai", list(kits.keys()), select="sku_pai,sku_filho,quantidade_filho"):
+        atuais.setdefault(l['sku_pai'], {})[l['sku_filho']] = float(l['quantidade_filho'] or 0)
+
+    novos = []
+    remover = {}
+    for sku_pai, componentes in kits.items():
+        no_banco = atuais.get(sku_pai, {})
+        for sku_filho, qtd in componentes.items():
+            if no_banco.get(sku_filho) != qtd:
+                novos.append({"sku_pai": sku_pai, "sku_filho": sku_filho, "quantidade_filho": qtd})
+        if sku_pai not in incompletos:
+            saiu = sorted(set(no_banco) - set(componentes))
+            if saiu: remover[sku_pai] = saiu
+
+    gravados, _ = upsert_lote("composicoes", novos, on_conflict="sku_pai,sku_filho")
+
+    removidos = 0
+    for sku_pai, filhos in remover.items():
+        r = requests.delete(
+            f"{SUPABASE_URL}/rest/v1/composicoes", headers=cabecalhos_supabase(upsert=False),
+            params={"sku_pai": f"eq.{sku_pai}", "sku_filho": f"in.({formatar_in(filhos)})"}
+        )
+        if r.status_code in [200, 204]:
+            removidos += len(filhos)
+        else:
+            print(f"   ❌ Erro ao remover componentes de {sku_pai}: {r.text}")
+
+    return gravados, removidos
+
+def estrutura_valida(estrutura):
+    """Resposta sem 'componentes' é falha da API, não kit vazio: aplicada, apagaria todos os vínculos do kit."""
+    return bool(estrutura) and bool(estrutura.get('componentes'))
+
+def coletar_kits(service, ids_pai, mapa, kits, incompletos):
+    """Busca as estruturas em paralelo e acumula em 'kits'. Se o kit já veio de outra conta, a primeira vence."""
+    for id_pai, estrutura, erro in service.buscar_detalhes("/produtos/estruturas/{}", ids_pai):
+        sku_pai = mapa[id_pai]
+        if erro or not estrutura_valida(estrutura):
+            registrar_falha(JOB, service.nome_loja, id_pai, erro or "Estrutura vazia")
+            continue
+        if sku_pai in kits: continue
+        componentes, completo = componentes_kit(estrutura, mapa)
+        kits[sku_pai] = componentes
+        if not completo: incompletos.add(sku_pai)
+
+def reprocessar_documentos(service, documentos):
+    """Usado pela dead-letter: aplica as estruturas já rebuscadas. Retorna os ids processados."""
+    mapa = obter_indice().mapa(service.nome_loja)
+    kits, incompletos = {}, set()
+    recuperados = []
+    for id_pai, estrutura in documentos:
+        sku_pai = mapa.get(id_pai)
+        if not sku_pai:
+            recuperados.append(id_pai)
+            continue
+        if not estrutura_valida(estrutura):
+            registrar_falha(JOB, service.nome_loja, id_pai, "Estrutura vazia")
+            continue
+        componentes, completo = componentes_kit(estrutura, mapa)
+        kits[sku_pai] = componentes
+        if not completo: incompletos.add(sku_pai)
+        recuperados.append(id_pai)
+    aplicar_diferencas(kits, incompletos)
+    return recuperados
+
+@exclusivo(JOB)
+def sincronizar_composicoes():
+    """Retorna quantos vínculos mudaram (gravados + removidos)."""
+    metricas = MetricasExecucao(JOB)
+    plano = planejar(JOB, LOJAS)
+    kits, incompletos = {}, set()
+
+    for loja in LOJAS:
+        if plano.adiado(loja): continue
+        print(f"\n🧩 Composições {loja}")
+        try:
+            mapa = obter_indice().mapa(loja)
+            service = BlingService(loja)
+            for lote in service.get_all_pages("/produtos", params={"tipo": "E", "criterio": 5}):
+                ids_pai = [p['id'] for p in lote if p.get('id') in mapa]
+                metricas.contar("composicoes", loja, documentos=len(ids_pai))
+                coletar_kits(service, ids_pai, mapa, kits, incompletos)
+        except Exception as e:
+            print(f"❌ Erro geral {loja}: {e}")
+            metricas.erro("composicoes", loja, e)
+
+    gravados, removidos = aplicar_diferencas(kits, incompletos)
+    print(f"🔗 {len(kits)} kit(s) conferidos: {gravados} vínculo(s) gravados, {removidos} removido(s), {len(incompletos)} kit(s) com filho fora do banco.")
+    metricas.gravar()
+    plano.registrar()
+    return gravados + removidos
+
+if __name__ == "__main__":
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ Erro: SUPABASE_URL e SUPABASE_KEY são obrigatórios.")
+        exit(1)
+
+    if sincronizar_composicoes():
+        atualizar_dashboard(["estoque"])
@@ -1,8 +1,16 @@
 import os
+import sys
 import requests
 import time
 from datetime import datetime
 from bling_service import BlingService, SUPABASE_URL, SUPABASE_KEY
+from buffer_escrita import BufferEscrita
+from agenda_estoque import AgendaEstoque, ORCAMENTO_PADRAO
+from lotes_saldos import EmpacotadorIds, LIMITE_URL_SALDOS, url_recusada, ids_por_chamada
+from metricas_sync import MetricasExecucao
+from orcamento_api import planejar
+from travas import exclusivo
+from snapshots_dashboard import atualizar_dashboard
 
 # --- DEPOSITOS BASEADOS NO WEBHOOK ---
 DEPOSITOS = {
@@ -18,11 +26,14 @@ HEADERS = {
     "Content-Type": "application/json"
 }
 
-# Divide listas grandes em lotes menores
-def chunker(seq, size):
-    return (seq[pos:pos + size] for pos in range(0, len(seq), size))
+# Catálogo em memória: num processo longo (daemon) não precisa ser baixado a cada ciclo
+_cache_catalogo = {"produtos": None, "carregado_em": 0.0}
+
+def obter_produtos_ativos(max_idade=0):
+    """Catálogo ativo. Com 'max_idade' (segundos), reaproveita o último download se ainda estiver fresco."""
+    if _cache_catalogo["produtos"] is not None and time.monotonic() - _cache_catalogo["carregado_em"] < max_idade:
+        return _cache_catalogo["produtos"]
 
-def obter_produtos_ativos():
     print("📥 Buscando catálogo de produtos no Supabase...")
     produtos = []
     offset = 0
@@ -51,27 +62,58 @@ def obter_produtos_ativos():
         offset += limit
         
     print(f"✅ {len(produtos)} produtos válidos (sem composições e ativos) encontrados.")
+    _cache_catalogo.update(produtos=produtos, carregado_em=time.monotonic())
     return produtos
 
-def salvar_estoque(lote):
-    if not lote: return
-    url = f"{SUPABASE_URL}/rest/v1/estoque"
-    r = requests.post(url, headers=HEADERS, json=lote)
-    if r.status_code not in [200, 201, 204]:
-        print(f"   ❌ Erro ao salvar lote de estoque no Supabase: {r.text}")
-    else:
-        print(f"   ✅ Lote de {len(lote)} saldos de estoque sincronizado (Upsert).")
+def indexar_saldos(saldos):
+    """Resposta de /estoques/saldos -> {id_produto: {id_deposito: saldo físico}}"""
+    return {
+        s.get('produto', {}).get('id'): {dep.get('id'): dep.get('saldoFisico', 0) for dep in s.get('depositos', [])}
+        for s in saldos
+    }
+
+def linhas_estoque_sku(sku, depositos_do_item):
+    """As 3 linhas de estoque (LOJA, SITE e FULL) do SKU. Depósito ausente (ou produto sumido) assume 0."""
+    agora = datetime.now().isoformat()
+    return [{
+        "sku": sku,
+        "canal": nome_canal,
+        "quantidade": depositos_do_item.get(id_dep_monitorado, 0),
+        "updated_at": agora
+    } for id_dep_monitorado, nome_canal in DEPOSITOS.items()]
 
-def processar_conta_bling(nome_loja, map_id_sku):
+def juntar_depositos(mapas, conferidos):
+    """
+    Depósitos são exclusivos de cada conta: junta por SKU o que as contas devolveram.
+    'mapas' é conta -> {id do Bling: SKU} com TODOS os ids do SKU; 'conferidos' é conta -> {id: depósitos} dos ids
+    que a conta respondeu. SKU com id numa conta que não o conferiu fica de fora (os depósitos dela iriam a 0).
+    Retorna ({sku: depósitos}, SKUs incompletos).
+    """
+    depositos = {}
+    incompletos = set()
+    for conta, mapa in mapas.items():
+        saldos = conferidos.get(conta, {})
+        for id_bling, sku in mapa.items():
+            if id_bling in saldos:
+                depositos.setdefault(sku, {}).update(saldos[id_bling])
+            else:
+                incompletos.add(sku)
+    return {sku: d for sku, d in depositos.items() if sku not in incompletos}, incompletos
+
+def buscar_saldos_conta(nome_loja, map_id_sku, limite_url=LIMITE_URL_SALDOS):
+    """Saldos da conta: {id do Bling: {id_deposito: saldo}} de cada id conferido (id sumido da resposta = {})."""
     ids_bling = list(map_id_sku.keys())
-    if not ids_bling: return
+    conferidos = {}
+    if not ids_bling: return conferidos
 
     print(f"\n🚀 Sincronizando {len(ids_bling)} itens na conta: {nome_loja}")
     service = BlingService(nome_loja)
-    buffer_estoque = []
 
-    # O Bling aceita múltiplos IDs na URL. Lotes de 40 para evitar URLs gigantescas.
-    for lote_ids in chunker(ids_bling, 40):
+    # O Bling aceita múltiplos IDs na URL: cada chamada leva quantos ids couberem no limite de tamanho da URL
+    empacotador = EmpacotadorIds(ids_bling, limite_url)
+    while True:
+        lote_ids = empacotador.proximo()
+        if not lote_ids: break
         max_retries = 3
         sucesso = False
         
@@ -79,41 +121,18 @@ def processar_conta_bling(nome_loja, map_id_sku):
             time.sleep(0.35)
             token = service.get_valid_token()
             
-            # Formata a query string: idsProdutos[]=1&idsProdutos[]=2...
-            qs = "&".join([f"idsProdutos[]={id_b}" for id_b in lote_ids])
-            url = f"https://www.bling.com.br/Api/v3/estoques/saldos?{qs}"
-            
-            r = requests.get(url, headers={"Authorization": f"Bearer {token}"})
+            r = requests.get(empacotador.url(lote_ids), headers={"Authorization": f"Bearer {token}"})
+            service.contar_chamada()
             
             if r.status_code == 200:
-                saldos = r.json().get('data', [])
-                
+                empacotador.enviado(lote_ids)
                 # 1. Indexa o que o Bling retornou (Caso o ID exista e tenha depósitos)
-                estoques_retornados = {}
-                for s in saldos:
-                    id_retornado = s.get('produto', {}).get('id')
-                    # Cria um dicionário interno mapeando: {id_deposito: quantidade}
-                    estoques_retornados[id_retornado] = { dep.get('id'): dep.get('saldoFisico', 0) for dep in s.get('depositos', []) }
+                estoques_retornados = indexar_saldos(r.json().get('data', []))
                 
                 # 2. Varre TODOS os IDs que pedimos neste lote (A mágica de zerar os perdidos)
                 for id_req in lote_ids:
-                    sku = map_id_sku.get(id_req)
-                    if not sku: continue
-                    
-                    # Tenta pegar os depósitos que vieram do Bling para este ID. Se o ID sumiu da resposta, retorna {}
-                    depositos_do_item = estoques_retornados.get(id_req, {})
-                    
-                    # Garante que as 3 linhas de estoque (LOJA, SITE e FULL) sejam enviadas ao Supabase
-                    for id_dep_monitorado, nome_canal in DEPOSITOS.items():
-                        # Se o depósito não veio no JSON (ou se o produto todo sumiu), a quantidade assume 0
-                        qtd_final = depositos_do_item.get(id_dep_monitorado, 0)
-                        
-                        buffer_estoque.append({
-                            "sku": sku,
-                            "canal": nome_canal,
-                            "quantidade": qtd_final,
-                            "updated_at": datetime.now().isoformat()
-                        })
+                    # Se o ID sumiu da resposta, fica {} e os depósitos dele vão a 0
+                    conferidos[id_req] = estoques_retornados.get(id_req, {})
                         
                 sucesso = True
                 break
@@ -121,45 +140,104 @@ def processar_conta_bling(nome_loja, map_id_sku):
                 espera = 2 ** tentativa
                 print(f"   ⏳ Rate Limit (429). Aguardando {espera}s para retentar...")
                 time.sleep(espera)
+            elif url_recusada(r.status_code, lote_ids) and empacotador.recusado(lote_ids, r.status_code):
+                # As metades voltam para a fila do empacotador
+                sucesso = True
+                break
             else:
                 print(f"   ⚠️ Erro na API do Bling {r.status_code}: {r.text}")
                 break
         
         if not sucesso:
             print("   ❌ Falha ao buscar lote após retentativas.")
-            
-        # Descarrega buffer se estiver grande para não pesar a memória
-        if len(buffer_estoque) >= 500:
-            salvar_estoque(buffer_estoque)
-            buffer_estoque = []
 
-    # Salva o resto
-    if buffer_estoque:
-        salvar_estoque(buffer_estoque)
+    print(f"   📏 {nome_loja}: {empacotador.resumo()}")
+    return conferidos
 
-def main():
+@exclusivo("sync_estoque")
+def main(escalonado=False, orcamento=ORCAMENTO_PADRAO, max_idade_catalogo=0, atualizar_view=True, limite_url=LIMITE_URL_SALDOS):
     if not SUPABASE_URL or not SUPABASE_KEY:
         print("❌ Erro: Credenciais Supabase ausentes.")
         return
 
-    produtos = obter_produtos_ativos()
+    produtos = obter_produtos_ativos(max_idade_catalogo)
+
+    agenda = None
+    if escalonado:
+        # Só os SKUs vencidos na faixa de giro, do mais prioritário ao menos, até o orçamento de chamadas
+        agenda = AgendaEstoque(produtos)
+        produtos = agenda.selecionar(orcamento, ids_por_chamada(limite_url))
+        print(f"📅 Modo escalonado: {len(produtos)} SKU(s) vencido(s) cabem no orçamento de {orcamento} chamada(s).")
     
     # Criamos os mapas de ID Bling -> SKU para saber de quem é o estoque
     map_portfio = {int(p['id_bling_portfio']): p['sku'] for p in produtos if p.get('id_bling_portfio')}
     map_portcasa = {int(p['id_bling_portcasa']): p['sku'] for p in produtos if p.get('id_bling_portcasa')}
+
+    # Cota diária: o escalonado pode encolher (os mapas já estão em ordem de prioridade); a varredura completa é adiada
+    mapas = {"PORTFIO": map_portfio, "PORTCASA": map_portcasa}
+    plano = planejar(
+        "sync_estoque" if escalonado else "sync_estoque_completo", list(mapas.keys()),
+        estimativas={loja: -(-len(m) // ids_por_chamada(limite_url)) for loja, m in mapas.items()}, redutivel=escalonado
+    )
+    for loja, mapa in mapas.items():
+        limite_ids = plano.autorizado(loja) * ids_por_chamada(limite_url)
+        if len(mapa) > limite_ids:
+            mapas[loja] = dict(list(mapa.items())[:limite_ids])
+    map_portfio, map_portcasa = mapas["PORTFIO"], mapas["PORTCASA"]
     
-    processar_conta_bling("PORTFIO", map_portfio)
-    processar_conta_bling("PORTCASA", map_portcasa)
-    
-    print("\n🔄 Processo de Estoque finalizado. Atualizando View do Dashboard...")
+    metricas = MetricasExecucao("sync_estoque")
+    if agenda:
+        # Atraso = há quanto tempo o saldo desses SKUs não era conferido (só dá para medir no modo escalonado)
+        for loja, mapa in [("PORTFIO", map_portfio), ("PORTCASA", map_portcasa)]:
+            for sku in mapa.values():
+                if agenda.idade[sku] != float("inf"): metricas.atraso("estoque", loja, agenda.idade[sku] * 3600)
+
+    conferidos = {loja: buscar_saldos_conta(loja, mapa, limite_url) for loja, mapa in mapas.items()}
+    # Mesmas linhas do atualizar_sku: depósitos das duas contas juntos por SKU, gravados uma vez só
+    depositos, incompletos = juntar_depositos({"PORTFIO": map_portfio, "PORTCASA": map_portcasa}, conferidos)
+    if incompletos:
+        print(f"   ⚠️ {len(incompletos)} SKU(s) não gravados: falta o saldo de uma das contas (ficam para a próxima execução).")
+
+    buffer_estoque = BufferEscrita("estoque", limite_linhas=500, chave_documento="sku")
+    # Hashes de todos os SKUs de uma vez: SKU com saldo igual ao último gravado não é reescrito
+    buffer_estoque.pre_carregar(list(depositos))
+    pendentes = dict(depositos)
+    for loja, mapa in mapas.items():
+        # SKU presente nas duas contas conta para a primeira
+        hashes = buffer_estoque.hashes
+        divergentes_antes = hashes.verificados - hashes.inalterados
+        skus_loja = [sku for sku in mapa.values() if sku in pendentes]
+        for sku in skus_loja:
+            buffer_estoque.adicionar(linhas_estoque_sku(sku, pendentes.pop(sku)))
+        metricas.contar("estoque", loja, len(skus_loja), hashes.verificados - hashes.inalterados - divergentes_antes)
+        if conferidos[loja]: metricas.marca_dagua("estoque", loja, datetime.now().astimezone())
+    # Salva o resto (o buffer já descarrega sozinho a cada 500 linhas)
+    buffer_estoque.descarregar()
+    if buffer_estoque.resumo(): print(f"   🔁 {buffer_estoque.resumo()}")
+    verificados = set(depositos)
+    alterados = buffer_estoque.total_gravado
+    metricas.gravar()
+    plano.registrar()
+
+    # Kits não têm saldo no Bling: a disponibilidade sai dos componentes recém-conferidos (sem chamadas extras)
     try:
-        r = requests.post(f"{SUPABASE_URL}/rest/v1/rpc/refresh_mview_dashboard", headers=HEADERS)
-        if r.status_code in [200, 204]:
-            print("✨ View do Dashboard recarregada com sucesso e pronta para uso!")
-        else:
-            print(f"⚠️ Aviso: Falha ao recarregar a View. ({r.text})")
+        from estoque_kits import atualizar_kits
+        atualizar_kits(sorted(verificados) if escalonado else None)
     except Exception as e:
-        print(f"⚠️ Erro ao acionar o gatilho da View: {e}")
+        print(f"⚠️ Disponibilidade dos kits não atualizada: {e}")
+
+    if agenda:
+        agenda.marcar_verificados(sorted(verificados))
+        agenda.relatorio()
+    
+    # Recarrega a view do dashboard e publica o snapshot de estoque
+    if atualizar_view:
+        atualizar_dashboard(["estoque"])
+    return alterados
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # --escalonado: atualiza por faixa de giro (quente/morno/frio) | --orcamento=N: chamadas por execução
+    # --limite-url=N: tamanho máximo (caracteres) da URL de /estoques/saldos
+    orcamento = next((int(a.split("=", 1)[1]) for a in sys.argv if a.startswith("--orcamento=")), ORCAMENTO_PADRAO)
+    limite_url = next((int(a.split("=", 1)[1]) for a in sys.argv if a.startswith("--limite-url=")), LIMITE_URL_SALDOS)
+    main(escalonado="--escalonado" in sys.argv, orcamento=orcamento, limite_url=limite_url)
\ No newline at end of file
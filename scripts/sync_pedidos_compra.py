@@ -1,7 +1,20 @@
 import os
 import requests
 import time
+from datetime import datetime
 from bling_service import BlingService, SUPABASE_URL, SUPABASE_KEY
+from escrita_supabase import upsert_lote
+from buffer_escrita import BufferEscrita
+from dead_letter import registrar_falha
+from hash_documentos import esquecer_hashes
+from custo_medio import MotorCusto
+from metricas_sync import MetricasExecucao
+from orcamento_api import planejar
+from travas import exclusivo
+from checkpoint import Checkpoint, ler_prazo
+from snapshots_dashboard import atualizar_dashboard
+
+JOB = "sync_pedidos_compra"
 
 # --- CONFIGURAÇÕES DE SITUAÇÃO (VALORES) ---
 SITUACOES_MAP = {
@@ -14,12 +27,16 @@ SITUACOES_MAP = {
 
 SITUACOES_SALVAR = [1, 3] # Apenas Atendido e Em Andamento
 
+# Na retomada, volta uma página: pedidos novos entram no topo da listagem e empurram os já vistos para a frente
+SOBREPOSICAO_PAGINAS = 1
+
 BLACKLIST_FORNECEDORES = [
     "COM DE FIOS E TECIDOS PORTFIO", "COMERCIO DE FIOS E TECIDOS PORTFIO LTDA",
     "PORTCASA ON LINE LTDA", "SONO E CONFORTO COMERCIO LTDA"
 ]
 
 cache_fornecedores = {}
+motor_custo = MotorCusto() # SKUs com compra gravada/apagada nesta execução têm o custo médio recalculado no final
 
 def limpar_data(data_str):
     if not data_str or str(data_str).startswith("0000"): 
@@ -32,12 +49,9 @@ def get_nome_fornecedor(service, id_fornecedor):
     if not id_fornecedor: return "FORNECEDOR NAO INFORMADO"
     if id_fornecedor in cache_fornecedores: return cache_fornecedores[id_fornecedor]
     try:
-        token = service.get_valid_token()
-        r = requests.get(f"https://www.bling.com.br/Api/v3/contatos/{id_fornecedor}", headers={"Authorization": f"Bearer {token}"})
-        if r.status_code == 200:
-            nome = r.json().get('data', {}).get('nome', 'DESCONHECIDO').upper()
-            cache_fornecedores[id_fornecedor] = nome
-            return nome
+        nome = (service.get_detalhe(f"/contatos/{id_fornecedor}") or {}).get('nome', 'DESCONHECIDO').upper()
+        cache_fornecedores[id_fornecedor] = nome
+        return nome
     except: pass
     return f"ID {id_fornecedor}"
 
@@ -50,7 +64,8 @@ def operacao_banco(metodo, tabela, dados=None, params=None):
     
     try:
         if metodo == "POST":
-            r = requests.post(url, headers=headers, json=dados)
+            upsert_lote(tabela, dados)
+            return
         elif metodo == "DELETE":
             r = requests.delete(f"{url}?{params}", headers=headers)
             
@@ -59,137 +74,155 @@ def operacao_banco(metodo, tabela, dados=None, params=None):
     except Exception as e:
         print(f"      ❌ Erro Conexão Supabase: {e}")
 
-def processar_loja(loja_nome):
-    print(f"\n🚀 Sincronizando {loja_nome}...")
-    service = BlingService(loja_nome)
-    
-    itens_processados_agora = set() # ADICIONADO: Agora rastreia a dupla (id_pedido, sku)
-    params = {"limite": 100}
-    
-    try:
-        for lote in service.get_all_pages("/pedidos/compras", params=params):
-            if not lote: continue
+def processar_pedido_compra(service, p, loja_nome, buffer_compras, itens_processados_agora):
+    """Rateia frete/desconto, calcula o IPI exato de cada item e coloca as linhas do pedido no buffer."""
+    id_pedido = p['id']
+    sit_valor = p.get('situacao', {}).get('valor')
 
-            itens_consolidados = {}
-            
-            for p_resumo in lote:
-                id_pedido = p_resumo['id']
-                sit_valor = p_resumo.get('situacao', {}).get('valor')
-                
-                if sit_valor not in SITUACOES_SALVAR:
-                    continue
+    id_forn = p.get('fornecedor', {}).get('id')
+    nome_forn = get_nome_fornecedor(service, id_forn)
+    
+    if sit_valor == 1 and any(b in nome_forn for b in BLACKLIST_FORNECEDORES):
+        print(f"   🚫 Ignorando {nome_forn} (Blacklist)")
+        return
 
-                try:
-                    # --- NOVO: MECANISMO DE RETRY PARA ERRO 429 ---
-                    max_retries = 3
-                    sucesso = False
-                    
-                    for tentativa in range(max_retries):
-                        time.sleep(0.35) # Aumentado um pouco o descanso padrão
-                        token = service.get_valid_token()
-                        resp = requests.get(f"https://www.bling.com.br/Api/v3/pedidos/compras/{id_pedido}", headers={"Authorization": f"Bearer {token}"})
-                        
-                        if resp.status_code == 200:
-                            sucesso = True
-                            break
-                        elif resp.status_code == 429:
-                            espera = 2 ** tentativa # Espera 1s, depois 2s, depois 4s...
-                            print(f"   ⏳ Rate Limit (429) no pedido {id_pedido}. Aguardando {espera}s para retentar (Tentativa {tentativa+1}/{max_retries})...")
-                            time.sleep(espera)
-                        else:
-                            print(f"   ⚠️ Erro crítico ao baixar pedido {id_pedido}: {resp.status_code}")
-                            break # Sai do loop se não for 429
-                            
-                    if not sucesso:
-                        print(f"   ❌ Pedido {id_pedido} ignorado após {max_retries} tentativas falhas.")
-                        continue
+    val_frete_nota = p.get('transporte', {}).get('frete', 0) or 0
                         
-                    p = resp.json().get('data')
-                    if not p: continue
-                    
-                    id_forn = p.get('fornecedor', {}).get('id')
-                    nome_forn = get_nome_fornecedor(service, id_forn)
-                    
-                    if sit_valor == 1 and any(b in nome_forn for b in BLACKLIST_FORNECEDORES):
-                        print(f"   🚫 Ignorando {nome_forn} (Blacklist)")
-                        continue
+    desc_obj = p.get('desconto', {})
+    val_desc_nota = desc_obj.get('valor', 0) or 0
+    if desc_obj.get('unidade') == 'PERCENTUAL':
+        val_desc_nota = (p.get('totalProdutos', 0) * val_desc_nota) / 100
 
-                    val_frete_nota = p.get('transporte', {}).get('frete', 0) or 0
-                                        
-                    desc_obj = p.get('desconto', {})
-                    val_desc_nota = desc_obj.get('valor', 0) or 0
-                    if desc_obj.get('unidade') == 'PERCENTUAL':
-                        val_desc_nota = (p.get('totalProdutos', 0) * val_desc_nota) / 100
+    itens = p.get('itens', [])
+    if not itens: return
 
-                    itens = p.get('itens', [])
-                    if not itens: continue
+    soma_bruta_nota = sum([(i.get('valor', 0) or 0) * (i.get('quantidade', 0) or 0) for i in itens])
+    if soma_bruta_nota == 0: soma_bruta_nota = 1
+    linhas_pedido = []
 
-                    soma_bruta_nota = sum([(i.get('valor', 0) or 0) * (i.get('quantidade', 0) or 0) for i in itens])
-                    if soma_bruta_nota == 0: soma_bruta_nota = 1
+    for item in itens:
+        sku = item.get('produto', {}).get('codigo', '').strip()
+        if not sku: continue
 
-                    for item in itens:
-                        sku = item.get('produto', {}).get('codigo', '').strip()
-                        if not sku: continue
+        qtd = float(item.get('quantidade', 0) or 0)
+        v_unit = float(item.get('valor', 0) or 0)
+        
+        if qtd <= 0: continue
 
-                        qtd = float(item.get('quantidade', 0) or 0)
-                        v_unit = float(item.get('valor', 0) or 0)
-                        
-                        if qtd <= 0: continue
+        # Salva o ID do Pedido + SKU para comparar com o banco depois
+        itens_processados_agora.add((id_pedido, sku))
 
-                        # Salva o ID do Pedido + SKU para comparar com o banco depois
-                        itens_processados_agora.add((id_pedido, sku))
+        # Peso financeiro do item (usado apenas para Frete e Desconto Geral)
+        peso = (v_unit * qtd) / soma_bruta_nota
+        
+        desc_un = (val_desc_nota * peso) / qtd
+        frete_un = (val_frete_nota * peso) / qtd
+        
+        # --- MÁGICA AQUI: O IPI AGORA É CALCULADO EXATAMENTE PARA ESTE ITEM ---
+        # Pega a porcentagem do IPI do item (Ex: 15.85) e transforma em valor (Ex: 149.99 * 0.1585)
+        aliquota_ipi = float(item.get('aliquotaIPI', 0) or 0)
+        ipi_un = v_unit * (aliquota_ipi / 100.0)
 
-                        # Peso financeiro do item (usado apenas para Frete e Desconto Geral)
-                        peso = (v_unit * qtd) / soma_bruta_nota
-                        
-                        desc_un = (val_desc_nota * peso) / qtd
-                        frete_un = (val_frete_nota * peso) / qtd
-                        
-                        # --- MÁGICA AQUI: O IPI AGORA É CALCULADO EXATAMENTE PARA ESTE ITEM ---
-                        # Pega a porcentagem do IPI do item (Ex: 15.85) e transforma em valor (Ex: 149.99 * 0.1585)
-                        aliquota_ipi = float(item.get('aliquotaIPI', 0) or 0)
-                        ipi_un = v_unit * (aliquota_ipi / 100.0)
-
-                        chave_unica = (id_pedido, sku)
-
-                        if chave_unica not in itens_consolidados:
-                            itens_consolidados[chave_unica] = {
-                                "id_pedido": id_pedido,
-                                "numero": str(p.get('numero', '')),
-                                "ordem_compra": str(p.get('ordemCompra', '')),
-                                "sku": sku,
-                                "data_pedido": limpar_data(p.get('data')),
-                                "data_prevista": limpar_data(p.get('dataPrevista')),
-                                "quantidade": qtd,
-                                "preco_unitario": v_unit,
-                                "desconto": desc_un,
-                                "frete": frete_un,
-                                "ipi": ipi_un, # <-- Salva o IPI Exato
-                                "fornecedor": nome_forn,
-                                "loja": loja_nome,
-                                "situacao": SITUACOES_MAP.get(sit_valor, "Outros")
-                            }
-                        else:
-                            existente = itens_consolidados[chave_unica]
-                            qtd_antiga = existente["quantidade"]
-                            qtd_nova = qtd_antiga + qtd
-                            
-                            if qtd_nova > 0:
-                                existente["preco_unitario"] = ((existente["preco_unitario"] * qtd_antiga) + (v_unit * qtd)) / qtd_nova
-                                existente["desconto"] = ((existente["desconto"] * qtd_antiga) + (desc_un * qtd)) / qtd_nova
-                                existente["frete"] = ((existente["frete"] * qtd_antiga) + (frete_un * qtd)) / qtd_nova
-                                existente["ipi"] = ((existente["ipi"] * qtd_antiga) + (ipi_un * qtd)) / qtd_nova
-                                existente["quantidade"] = qtd_nova
-                            
-                            print(f"      🔄 SKU {sku} duplicado no pedido {p.get('numero')}. Consolidado: Qtd {qtd_nova}")
+        linhas_pedido.append({
+            "id_pedido": id_pedido,
+            "numero": str(p.get('numero', '')),
+            "ordem_compra": str(p.get('ordemCompra', '')),
+            "sku": sku,
+            "data_pedido": limpar_data(p.get('data')),
+            "data_prevista": limpar_data(p.get('dataPrevista')),
+            "quantidade": qtd,
+            "preco_unitario": v_unit,
+            "desconto": desc_un,
+            "frete": frete_un,
+            "ipi": ipi_un, # <-- Salva o IPI Exato
+            "fornecedor": nome_forn,
+            "loja": loja_nome,
+            "situacao": SITUACOES_MAP.get(sit_valor, "Outros")
+        })
+
+    # SKU repetido no pedido é consolidado pelo buffer (quantidade somada, valores unitários ponderados)
+    buffer_compras.adicionar(linhas_pedido)
+    print(f"   ✅ Processado: {p.get('numero')} - {nome_forn}")
+
+def reprocessar_documentos(service, documentos):
+    """Usado pela dead-letter: regrava os pedidos de compra já rebuscados. Retorna os ids processados."""
+    buffer_compras = BufferEscrita("compras_pedidos", chave_documento="id_pedido", ao_gravar=motor_custo.marcar_linhas)
+    recuperados = []
+    for id_pedido, p in documentos:
+        try:
+            if p.get('situacao', {}).get('valor') in SITUACOES_SALVAR:
+                processar_pedido_compra(service, p, service.nome_loja, buffer_compras, set())
+            recuperados.append(id_pedido)
+        except Exception as e:
+            registrar_falha(JOB, service.nome_loja, id_pedido, e)
+    buffer_compras.descarregar()
+    motor_custo.recalcular()
+    return recuperados
+
+def _alterados(buffer):
+    """Documentos que mudaram desde a última gravação (os outros foram pulados pelo hash)."""
+    return buffer.hashes.verificados - buffer.hashes.inalterados if buffer.hashes else 0
 
-                    print(f"   ✅ Processado: {p.get('numero')} - {nome_forn}")
+def processar_loja(loja_nome, metricas=None, prazo=None, cursor=None):
+    """
+    Retorna (registros que mudaram no banco, cursor). Com 'prazo', a varredura para entre duas páginas
+    antes do tempo acabar e o cursor (página, itens já vistos, pedidos com falha) volta para ser
+    retomado na próxima execução; a limpeza só roda quando a varredura da conta termina (cursor None).
+    Cursor False: a varredura falhou no meio e a conta não pode ser dada como concluída.
+    """
+    cursor = cursor or {}
+    service = BlingService(loja_nome)
+    
+    # Rastreia a dupla (id_pedido, sku) da varredura inteira, inclusive das execuções anteriores
+    itens_processados_agora = {tuple(i) for i in cursor.get("vistos", [])}
+    pedidos_com_falha = set(cursor.get("falhas", [])) # Pedidos na dead-letter não podem ser apagados pela limpeza
+    buffer_compras = BufferEscrita("compras_pedidos", chave_documento="id_pedido", ao_gravar=motor_custo.marcar_linhas)
+    params = {"limite": 100, "pagina": max(1, cursor.get("pagina", 1) - SOBREPOSICAO_PAGINAS)}
+    removidos = 0
+    if cursor: print(f"\n🚀 Sincronizando {loja_nome} (retomando da página {params['pagina']})...")
+    else: print(f"\n🚀 Sincronizando {loja_nome}...")
+    
+    try:
+        inicio_pagina = time.monotonic() # Passo = listagem + detalhes de uma página
+        for lote in service.get_all_pages("/pedidos/compras", params=params):
+            if not lote: continue
 
+            ids = [p_resumo['id'] for p_resumo in lote if p_resumo.get('situacao', {}).get('valor') in SITUACOES_SALVAR]
+            buffer_compras.pre_carregar(ids)
+            if metricas: metricas.contar("compras_pedidos", loja_nome, documentos=len(ids))
+
+            # Detalhes em paralelo sob o limitador da conta (o retry de 429 fica no BlingService)
+            for id_pedido, p, erro in service.buscar_detalhes("/pedidos/compras/{}", ids):
+                if erro or not p:
+                    print(f"   ❌ Pedido {id_pedido} ignorado: {erro or 'detalhe vazio'}")
+                    registrar_falha(JOB, loja_nome, id_pedido, erro or "Detalhe vazio")
+                    pedidos_com_falha.add(id_pedido)
+                    continue
+                try:
+                    processar_pedido_compra(service, p, loja_nome, buffer_compras, itens_processados_agora)
                 except Exception as e_item:
                     print(f"   ⚠️ Erro item {id_pedido}: {e_item}")
+                    registrar_falha(JOB, loja_nome, id_pedido, e_item)
+                    pedidos_com_falha.add(id_pedido)
 
-            if itens_consolidados:
-                operacao_banco("POST", "compras_pedidos", dados=list(itens_consolidados.values()))
+            if prazo:
+                prazo.passo(time.monotonic() - inicio_pagina)
+                inicio_pagina = time.monotonic()
+                if prazo.esgotado():
+                    buffer_compras.descarregar()
+                    print(f"   ⏸️ {loja_nome}: parando na página {params['pagina']} ({len(itens_processados_agora)} itens vistos até aqui).")
+                    return buffer_compras.total_gravado, {
+                        "pagina": params['pagina'] + 1,
+                        "vistos": [[id_p, sku] for id_p, sku in itens_processados_agora],
+                        "falhas": sorted(pedidos_com_falha)
+                    }
+
+        # Grava o que restou ANTES da limpeza, para o banco refletir tudo que veio do Bling
+        buffer_compras.descarregar()
+        if buffer_compras.resumo(): print(f"   🔁 {buffer_compras.resumo()}")
+        if metricas:
+            metricas.contar("compras_pedidos", loja_nome, divergentes=_alterados(buffer_compras))
+            metricas.marca_dagua("compras_pedidos", loja_nome, datetime.now().astimezone())
 
         # 2. LIMPEZA INTELIGENTE (GARBAGE COLLECTION POR ITEM E PEDIDO)
         if itens_processados_agora:
@@ -205,7 +238,7 @@ def processar_loja(loja_nome):
                     itens_banco = set([(row['id_pedido'], row['sku']) for row in r_banco.json()])
                     
                     # A mágica: Encontra o que está no Banco mas NÃO veio do Bling agora
-                    itens_para_remover = itens_banco - itens_processados_agora
+                    itens_para_remover = {(id_p, sku) for id_p, sku in itens_banco - itens_processados_agora if id_p not in pedidos_com_falha}
                     
                     if itens_para_remover:
                         print(f"   🗑️ Removendo {len(itens_para_remover)} itens obsoletos (excluídos do pedido ou cancelados)...")
@@ -220,6 +253,11 @@ def processar_loja(loja_nome):
                             skus_formatados = ",".join([f'"{s}"' for s in skus])
                             params = f"id_pedido=eq.{id_p}&sku=in.({skus_formatados})"
                             operacao_banco("DELETE", "compras_pedidos", params=params)
+                            motor_custo.marcar_skus(skus)
+                        removidos = len(itens_para_remover)
+
+                        # Pedido com item apagado precisa ser reescrito por inteiro se voltar igual
+                        esquecer_hashes("compras_pedidos", list(remocoes_por_pedido.keys()))
                     else:
                         print("   ✨ Sincronização perfeita. Nenhum item obsoleto.")
             except Exception as e_limp:
@@ -227,25 +265,58 @@ def processar_loja(loja_nome):
 
     except Exception as e:
         print(f"❌ Erro geral {loja_nome}: {e}")
+        if metricas: metricas.erro("compras_pedidos", loja_nome, e)
+        return buffer_compras.total_gravado, False
+    return buffer_compras.total_gravado + removidos, None
+
+@exclusivo(JOB)
+def sincronizar_compras(prazo=None):
+    """
+    Retorna quantos registros mudaram no banco nas duas contas. Sempre continua de um checkpoint
+    deixado por uma execução com prazo; com 'prazo' (PrazoExecucao), pode deixar um novo.
+    """
+    lojas = ["PORTFIO", "PORTCASA"]
+    metricas = MetricasExecucao(JOB)
+    plano = planejar(JOB, lojas)
+    checkpoint = Checkpoint(JOB)
+    cursor = checkpoint.carregar() or {}
+    concluidas = set(cursor.get("concluidas", []))
+    alterados = 0
+    pendente = False
+    for loja in lojas:
+        if loja in concluidas: continue
+        if plano.adiado(loja):
+            pendente = pendente or cursor.get("loja") == loja
+            continue
+        gravados, cursor_loja = processar_loja(loja, metricas, prazo, cursor if cursor.get("loja") == loja else None)
+        alterados += gravados
+        if cursor_loja is False:
+            # Falhou no meio: o cursor dela (se havia) continua no checkpoint para a próxima execução
+            pendente = pendente or cursor.get("loja") == loja
+            continue
+        if cursor_loja is not None:
+            checkpoint.salvar({"concluidas": sorted(concluidas), "loja": loja, **cursor_loja})
+            pendente = True
+            break
+        concluidas.add(loja)
+        # Cada conta concluída vai para o checkpoint na hora, mesmo com o cursor de outra conta adiado
+        if cursor.get("loja") == loja: cursor = {}
+        cursor = {**cursor, "concluidas": sorted(concluidas)}
+        checkpoint.salvar(cursor)
+
+    if not pendente: checkpoint.concluir()
+    motor_custo.recalcular()
+    metricas.gravar()
+    plano.registrar()
+    return alterados
 
 if __name__ == "__main__":
     if not SUPABASE_URL or not SUPABASE_KEY:
         print("❌ Erro: SUPABASE_URL e SUPABASE_KEY são obrigatórios.")
         exit(1)
-        
-    for loja in ["PORTFIO", "PORTCASA"]:
-        processar_loja(loja)
 
-    # --- NOVO: GATILHO DE ATUALIZAÇÃO DA VIEW DO DASHBOARD ---
-    print("\n🔄 Sincronização concluída. Disparando atualização da View Gerencial no Banco...")
-    try:
-        r = requests.post(
-            f"{SUPABASE_URL}/rest/v1/rpc/refresh_mview_dashboard", 
-            headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}", "Content-Type": "application/json"}
-        )
-        if r.status_code in [200, 204]:
-            print("✨ View do Dashboard recarregada com sucesso e pronta para uso!")
-        else:
-            print(f"⚠️ Aviso: Falha ao recarregar a View. O site usará dados do último ciclo. ({r.text})")
-    except Exception as e:
-        print(f"⚠️ Erro ao acionar o gatilho da View: {e}")
\ No newline at end of file
+    # --prazo=MINUTOS: para antes do prazo e continua na próxima execução
+    sincronizar_compras(prazo=ler_prazo())
+
+    # Recarrega a view do dashboard e publica os snapshots afetados por este job
+    atualizar_dashboard(["estoque", "compras"])
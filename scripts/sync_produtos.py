@@ -0,0 +1,174 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from bling_service import BlingService, SUPABASE_URL, SUPABASE_KEY
+from leitura_supabase import buscar_tudo
+from arvore_categorias import obter_arvore
+from buffer_escrita import BufferEscrita
+from dead_letter import registrar_falha
+from metricas_sync import MetricasExecucao
+from orcamento_api import planejar
+from travas import exclusivo
+from snapshots_dashboard import atualizar_dashboard
+
+# --- SYNC INCREMENTAL DO CATÁLOGO DE PRODUTOS ---
+# Lista por data de ALTERAÇÃO (não de inclusão): edição de custo, fornecedor ou categoria entra no mesmo dia.
+# A marca d'água de cada conta é a 'marca_dagua' da última execução sem erro (sync_metricas).
+# Detalhes e variações em paralelo sob o limitador da conta; só os produtos cujo hash mudou são regravados.
+JOB = "sync_produtos"
+LOJAS = ["PORTFIO", "PORTCASA"]
+COLUNA_ID = {"PORTFIO": "id_bling_portfio", "PORTCASA": "id_bling_portcasa", "CASA_MODELO": "id_bling_casamodelo"}
+
+FUSO_BLING = timezone(timedelta(hours=-3)) # As datas da API do Bling são no horário de Brasília
+SOBREPOSICAO = timedelta(minutes=15)       # Folga para alterações gravadas no Bling durante a execução anterior
+DIAS_SEM_MARCA = 2                         # Primeira execução (ou sem métrica): olha só os últimos dias
+
+def processar_produto_json(p, nome_loja):
+    """Produto do Bling -> linha de 'produtos' (mesma regra da carga inicial)."""
+    sku = p.get("codigo")
+    if not sku: return None
+    custo = p.get("precoCusto", 0)
+    if not custo or float(custo) == 0:
+        custo = p.get("fornecedor", {}).get("precoCusto", 0) or p.get("fornecedor", {}).get("precoCompra", 0)
+
+    cat_id = p.get("categoria", {}).get("id")
+    if cat_id == 0: cat_id = None
+
+    item = {
+        "sku": sku, "nome": p.get("nome", ""), "custo_fixo": custo,
+        "preco_venda_padrao": p.get("preco", 0), "situacao": p.get("situacao", "A"),
+        "tipo": p.get("tipo", "P"), "formato": p.get("formato", "S"),
+        "gtin": p.get("gtin"), "gtin_embalagem": p.get("gtinEmbalagem"),
+        "fornecedor": p.get("fornecedor", {}).get("contato", {}).get("nome"),
+        "categoria_id": cat_id
+    }
+    item[COLUNA_ID[nome_loja]] = p.get("id")
+    return item
+
+def linhas_produto(p, nome_loja):
+    """Linhas do produto e das variações. Variação sem custo, fornecedor ou categoria herda do pai."""
+    item = processar_produto_json(p, nome_loja)
+    linhas = [item] if item else []
+
+    for v in p.get("variacoes", []):
+        v_item = processar_produto_json(v, nome_loja)
+        if not v_item: continue
+        if item:
+            if not v_item["custo_fixo"]: v_item["custo_fixo"] = item["custo_fixo"]
+            if not v_item["fornecedor"]: v_item["fornecedor"] = item["fornecedor"]
+            if not v_item["categoria_id"]: v_item["categoria_id"] = item["categoria_id"]
+        linhas.append(v_item)
+    return linhas
+
+def id_pai(p):
+    pai = (p.get("variacao") or {}).get("produtoPai") or {}
+    return pai.get("id")
+
+def gravar_produtos(service, detalhes, buffer_produtos):
+    """Detalhes {id: produto} -> buffer. Variações saem das linhas do pai (já presente em 'detalhes')."""
+    linhas = [l for p in detalhes.values() if not id_pai(p) for l in linhas_produto(p, service.nome_loja)]
+    obter_arvore().resolver(service, {l['categoria_id'] for l in linhas})
+
+    buffer_produtos.pre_carregar({l['sku'] for l in linhas})
+    for linha in linhas:
+        buffer_produtos.adicionar([linha])
+
+def buscar_pais(service, detalhes):
+    """Acrescenta em 'detalhes' o pai de cada variação listada (uma chamada por pai que ainda não veio)."""
+    pais = {id_pai(p) for p in detalhes.values() if id_pai(p)} - set(detalhes)
+    for id_prod, p, erro in service.buscar_detalhes("/produtos/{}", sorted(pais)):
+        if erro or not p:
+            registrar_falha(JOB, service.nome_loja, id_prod, erro or "Detalhe vazio")
+            continue
+        detalhes[id_prod] = p
+
+def reprocessar_documentos(service, documentos):
+    """Usado pela dead-letter: regrava os produtos já rebuscados. Retorna os ids processados."""
+    buffer_produtos = BufferEscrita("produtos", chave_documento="sku", nome_hash=f"produtos_{service.nome_loja}")
+    detalhes = dict(documentos)
+    buscar_pais(service, detalhes)
+    gravar_produtos(service, detalhes, buffer_produtos)
+    buffer_produtos.descarregar()
+    return [id_prod for id_prod, _ in documentos]
+
+def ler_marca_dagua(nome_loja):
+    linhas = buscar_tudo(
+        "sync_metricas", select="marca_dagua",
+        filtros=f"job=eq.{JOB}&tabela=eq.produtos&loja=eq.{nome_loja}&marca_dagua=not.is.null"
+    )
+    if not linhas: return None
+    return datetime.fromisoformat(linhas[0]['marca_dagua'].replace("Z", "+00:00"))
+
+def processar_loja(nome_loja, desde=None, metricas=None):
+    """Sincroniza os produtos alterados desde 'desde' (ou desde a marca d'água). Retorna quantos mudaram."""
+    inicio_execucao = datetime.now(FUSO_BLING)
+    if desde is None:
+        marca = ler_marca_dagua(nome_loja)
+        desde = (marca - SOBREPOSICAO) if marca else inicio_execucao - timedelta(days=DIAS_SEM_MARCA)
+    desde = desde.astimezone(FUSO_BLING)
+
+    print(f"\n🛍️ Produtos {nome_loja}: alterados desde {desde:%Y-%m-%d %H:%M:%S}")
+    service = BlingService(nome_loja)
+    buffer_produtos = BufferEscrita("produtos", chave_documento="sku", nome_hash=f"produtos_{nome_loja}")
+    params = {
+        "dataAlteracaoInicial": desde.strftime("%Y-%m-%d %H:%M:%S"),
+        "dataAlteracaoFinal": inicio_execucao.strftime("%Y-%m-%d %H:%M:%S"),
+        "criterio": 5
+    }
+
+    try:
+        for lote in service.get_all_pages("/produtos", params=params):
+            ids = [p['id'] for p in lote if p.get('id')]
+            if metricas: metricas.contar("produtos", nome_loja, documentos=len(ids))
+
+            detalhes = {}
+            for id_prod, p, erro in service.buscar_detalhes("/produtos/{}", ids):
+                if erro or not p:
+                    registrar_falha(JOB, nome_loja, id_prod, erro or "Detalhe vazio")
+                    continue
+                detalhes[id_prod] = p
+
+            # Variação alterada é regravada pelo pai, para herdar custo/fornecedor/categoria como na carga inicial
+            buscar_pais(service, detalhes)
+            gravar_produtos(service, detalhes, buffer_produtos)
+
+        buffer_produtos.descarregar()
+        if buffer_produtos.resumo(): print(f"   🔁 {buffer_produtos.resumo()}")
+        alterados = buffer_produtos.hashes.verificados - buffer_produtos.hashes.inalterados
+        if metricas:
+            metricas.contar("produtos", nome_loja, divergentes=alterados)
+            metricas.marca_dagua("produtos", nome_loja, inicio_execucao)
+        return alterados
+
+    except Exception as e:
+        print(f"❌ Erro geral {nome_loja}: {e}")
+        if metricas: metricas.erro("produtos", nome_loja, e)
+        return 0
+
+@exclusivo(JOB)
+def sincronizar_produtos(desde=None):
+    """Roda as contas e retorna quantos produtos mudaram (0 = nada a refletir no dashboard)."""
+    metricas = MetricasExecucao(JOB)
+    plano = planejar(JOB, LOJAS)
+    alterados = 0
+    for loja in LOJAS:
+        if plano.adiado(loja): continue
+        alterados += processar_loja(loja, desde, metricas)
+
+    metricas.gravar()
+    plano.registrar()
+    return alterados
+
+if __name__ == "__main__":
+    # Uso: python scripts/sync_produtos.py [--desde=AAAA-MM-DD]
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ Erro: SUPABASE_URL e SUPABASE_KEY são obrigatórios.")
+        exit(1)
+
+    desde = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("--desde="):
+            desde = datetime.strptime(arg.split("=", 1)[1], "%Y-%m-%d").replace(tzinfo=FUSO_BLING)
+
+    if sincronizar_produtos(desde):
+        # Custo, fornecedor e categoria entram na view do dashboard
+        atualizar_dashboard(["estoque"])
@@ -0,0 +1,80 @@
+import os
+import socket
+import threading
+import functools
+import requests
+from bling_service import SUPABASE_URL
+from escrita_supabase import cabecalhos_supabase
+
+# --- TRAVAS ENTRE PROCESSOS ---
+# O cron horário, o noturno, o daemon e uma execução manual podem se sobrepor. A trava fica no banco
+# ('travas_jobs', com validade): o job que a encontra ocupada não roda. Enquanto o job roda, uma
+# thread renova a validade; se o processo morrer, a trava expira sozinha em VALIDADE_TRAVA.
+# Sem a migração (ou com o banco fora), a trava não bloqueia nada: o job roda como antes.
+VALIDADE_TRAVA = 10 * 60 # Segundos. Renovada a cada terço disso
+DONO = f"{socket.gethostname()}:{os.getpid()}"
+
+def adquirir_trava(nome, segundos=VALIDADE_TRAVA, dono=DONO):
+    """True se a trava é nossa, False se outro processo tem, None se não deu para consultar."""
+    try:
+        r = requests.post(
+            f"{SUPABASE_URL}/rest/v1/rpc/adquirir_trava", headers=cabecalhos_supabase(upsert=False),
+            json={"p_nome": nome, "p_dono": dono, "p_segundos": int(segundos)}, timeout=15
+        )
+        if r.status_code != 200:
+            print(f"   ⚠️ Trava {nome} não consultada: {r.text[:200]}")
+            return None
+        return r.json() is True
+    except Exception as e:
+        print(f"   ⚠️ Trava {nome} não consultada: {e}")
+        return None
+
+def liberar_trava(nome, dono=DONO):
+    try:
+        requests.post(
+            f"{SUPABASE_URL}/rest/v1/rpc/liberar_trava", headers=cabecalhos_supabase(upsert=False),
+            json={"p_nome": nome, "p_dono": dono}, timeout=15
+        )
+    except Exception as e:
+        print(f"   ⚠️ Trava {nome} não liberada (expira sozinha): {e}")
+
+class TravaJob:
+    """Trava de um job durante um bloco 'with'. 'obtida' diz se o bloco pode rodar."""
+
+    def __init__(self, job, segundos=VALIDADE_TRAVA):
+        self.nome = f"job:{job}"
+        self.segundos = segundos
+        self.obtida = False
+        self._parar = threading.Event()
+        self._renovacao = None
+
+    def _renovar(self):
+        while not self._parar.wait(self.segundos / 3):
+            adquirir_trava(self.nome, self.segundos)
+
+    def __enter__(self):
+        self.obtida = adquirir_trava(self.nome, self.segundos) is not False
+        if self.obtida:
+            self._renovacao = threading.Thread(target=self._renovar, daemon=True)
+            self._renovacao.start()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.obtida: return False
+        self._parar.set()
+        self._renovacao.join() # Uma renovação em andamento não pode recriar a trava depois de liberada
+        liberar_trava(self.nome)
+        return False
+
+def exclusivo(job):
+    """Decorador: a função só roda se nenhum outro processo estiver rodando o mesmo job. Ocupado -> retorna 0."""
+    def decorar(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            with TravaJob(job) as trava:
+                if not trava.obtida:
+                    print(f"⏭️ {job} já está rodando em outro processo. Esta execução foi pulada.")
+                    return 0
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorar
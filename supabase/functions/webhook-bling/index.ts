@@ -32,6 +32,10 @@ const ID_SIT_FULL = 375989;
 const ID_SIT_ATENDIDO = 9;
 const IDS_NFE_IGNORAR = [1, 2, 4, 8, 9, 10]; // 1 = Pendente (Padrão ignorar)
 
+// Eventos que só vão para a fila (webhook_fila) e são processados em lote pelo worker Python
+// (scripts/fila_webhook.py). Rajadas de pedidos/NFes não estouram mais o tempo da Edge Function.
+const EVENTOS_FILA = ['order.', 'sales.', 'invoice.', 'nfe.'];
+
 Deno.serve(async (req) => {
   try {
     const url = new URL(req.url)
@@ -48,17 +52,56 @@ Deno.serve(async (req) => {
 
     const supabase = createClient(Deno.env.get('SUPABASE_URL')!, Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!);
 
+    // --- FILA: grava o evento e responde na hora. Se a fila falhar, cai no processamento inline abaixo ---
+    if (EVENTOS_FILA.some(prefixo => event.includes(prefixo))) {
+      const { error: errFila } = await supabase.from('webhook_fila').insert({ loja: nomeLoja, evento: event, id_documento: idBling, payload: body });
+      if (!errFila) return new Response("OK", { status: 200 });
+      console.error(`⚠️ Fila indisponível (${errFila.message}). Processando inline...`);
+    }
+
     // --- REFRESH TOKEN ---
-    const { data: integracao } = await supabase.from('integracoes_bling').select('*').eq('nome_loja', nomeLoja).single();
+    // O Bling gira o refresh_token a cada renovação: só quem tem a trava 'token:<loja>' (a mesma dos scripts
+    // Python) chama o Bling, e a gravação só vale se o refresh_token do banco ainda for o que foi usado.
+    // Quem não pega a trava espera o token novo aparecer no banco e reaproveita.
+    const lerIntegracao = async () => (await supabase.from('integracoes_bling').select('*').eq('nome_loja', nomeLoja).single()).data;
+    const expirando = (i) => new Date(i.expires_at) < new Date(Date.now() + 5 * 60000);
+
+    let integracao = await lerIntegracao();
     let token = integracao.access_token;
-    if (new Date(integracao.expires_at) < new Date(Date.now() + 5 * 60000)) {
-       const auth = btoa(`${Deno.env.get(`BLING_CLIENT_ID_${nomeLoja}`)}:${Deno.env.get(`BLING_SECRET_${nomeLoja}`)}`);
-       const r = await fetch(`https://www.bling.com.br/Api/v3/oauth/token`, { 
-          method: 'POST', headers: { 'Authorization': `Basic ${auth}`, 'Content-Type': 'application/x-www-form-urlencoded' }, 
-          body: new URLSearchParams({ grant_type: 'refresh_token', refresh_token: integracao.refresh_token }) 
-       }).then(res => res.json());
-       token = r.access_token;
-       await supabase.from('integracoes_bling').update({ access_token: token, refresh_token: r.refresh_token, expires_at: new Date(Date.now() + r.expires_in * 1000).toISOString() }).eq('nome_loja', nomeLoja);
+    if (expirando(integracao)) {
+      const refreshAnterior = integracao.refresh_token;
+      const trava = `token:${nomeLoja}`;
+      const dono = `edge:${crypto.randomUUID()}`;
+      for (let tentativa = 0; tentativa < 20; tentativa++) {
+        const { data: obtida, error: errTrava } = await supabase.rpc('adquirir_trava', { p_nome: trava, p_dono: dono, p_segundos: 30 });
+        if (obtida || errTrava) { // Sem a tabela de travas, renova como antes
+          try {
+            integracao = await lerIntegracao();
+            if (integracao.refresh_token !== refreshAnterior) { token = integracao.access_token; break; }
+
+            const auth = btoa(`${Deno.env.get(`BLING_CLIENT_ID_${nomeLoja}`)}:${Deno.env.get(`BLING_SECRET_${nomeLoja}`)}`);
+            const r = await fetch(`https://www.bling.com.br/Api/v3/oauth/token`, { 
+               method: 'POST', headers: { 'Authorization': `Basic ${auth}`, 'Content-Type': 'application/x-www-form-urlencoded' }, 
+               body: new URLSearchParams({ grant_type: 'refresh_token', refresh_token: refreshAnterior }) 
+            }).then(res => res.json());
+            if (!r.access_token) {
+              console.error(`❌ Falha ao renovar token de ${nomeLoja}: ${JSON.stringify(r)}`);
+              break; // Não grava nada: o token atual segue no banco
+            }
+            token = r.access_token;
+            const { data: gravadas } = await supabase.from('integracoes_bling')
+              .update({ access_token: token, refresh_token: r.refresh_token, expires_at: new Date(Date.now() + r.expires_in * 1000).toISOString() })
+              .eq('nome_loja', nomeLoja).eq('refresh_token', refreshAnterior).select('nome_loja');
+            if (!gravadas?.length) console.error(`⚠️ Token de ${nomeLoja} renovado por outro processo ao mesmo tempo. Token novo não gravado.`);
+          } finally {
+            if (obtida) await supabase.rpc('liberar_trava', { p_nome: trava, p_dono: dono });
+          }
+          break;
+        }
+        await new Promise(res => setTimeout(res, 1000));
+        const atual = await lerIntegracao();
+        if (atual.refresh_token !== refreshAnterior) { token = atual.access_token; break; }
+      }
     }
 
     const atualizarEstoqueManual = async (sku: string) => {
@@ -108,6 +151,19 @@ Deno.serve(async (req) => {
         }
     };
 
+    // FUNÇÕES AUXILIARES: Rollup diária (vendas_diarias). O caminho inline grava direto no detalhe, sem os
+    // deltas do worker da fila: recalcula os dias que o documento tinha antes e tem depois da gravação.
+    const datasDocumento = async (tabela: string, colData: string) => {
+      const { data } = await supabase.from(tabela).select(colData).eq('id', idBling);
+      return (data || []).map((l) => String(l[colData]).substring(0, 10));
+    };
+    const reconstruirDias = async (datas: string[]) => {
+      for (const dia of new Set(datas.filter(Boolean))) {
+        const { error } = await supabase.rpc('reconstruir_vendas_diarias', { data_inicio: dia, data_fim: dia });
+        if (error) console.error(`⚠️ Rollup de ${dia} não recalculada: ${error.message}`);
+      }
+    };
+
     // FUNÇÃO AUXILIAR: Fetch com Retry Exponencial Anti-429
     const fetchWithRetry = async (url: string, maxRetries = 3) => {
         for (let i = 0; i < maxRetries; i++) {
@@ -144,6 +200,7 @@ Deno.serve(async (req) => {
       const resp = await fetchWithRetry(`https://www.bling.com.br/Api/v3/pedidos/vendas/${idBling}`);
       if (resp.ok) {
         const { data: v } = await resp.json();
+        const datasAntes = await datasDocumento('pedidos_venda', 'data_pedido');
         let origem = (nomeLoja === 'PORTFIO' && v.situacao?.id === ID_SIT_FULL) ? "SITE_FULL" : 
                      (nomeLoja === 'PORTCASA' && v.situacao?.id === ID_SIT_ATENDIDO) ? "LOJA" : null;
 
@@ -178,13 +235,15 @@ Deno.serve(async (req) => {
               quantidade: item.quantidade, preco_unitario: item.valor, 
               desconto: descGlobalRateadoLinha + (item.desconto || 0), // Guardamos o total para fins de log
               frete: freteRateadoLinha,
-              valor_total_liquido: valorLiquidoFinal 
+              valor_total_liquido: valorLiquidoFinal,
+              total_pedido: Number(v.total || 0) // Comparado com a listagem pela reconciliação esparsa
             });
             await atualizarEstoqueManual(item.codigo);
           }
         } else {
           await supabase.from('pedidos_venda').delete().eq('id', idBling);
         }
+        await reconstruirDias([...datasAntes, ...await datasDocumento('pedidos_venda', 'data_pedido')]);
       }
     }
 
@@ -193,6 +252,7 @@ Deno.serve(async (req) => {
       const resp = await fetchWithRetry(`https://www.bling.com.br/Api/v3/nfe/${idBling}`);
       if (resp.ok) {
         const { data: nf } = await resp.json();
+        const datasAntes = [...await datasDocumento('nfe_saida', 'data_emissao'), ...await datasDocumento('devolucoes', 'data_devolucao')];
         const natId = nf.naturezaOperacao?.id;
         const eSerie1 = nf.serie === null || String(nf.serie) === "1";
         
@@ -319,6 +379,9 @@ Deno.serve(async (req) => {
           await supabase.from('nfe_saida').delete().eq('id', idBling);
           await supabase.from('devolucoes').delete().eq('id', idBling);
         }
+        await reconstruirDias([
+          ...datasAntes, ...await datasDocumento('nfe_saida', 'data_emissao'), ...await datasDocumento('devolucoes', 'data_devolucao')
+        ]);
       }
     }
 
@@ -0,0 +1,12 @@
+-- Quarentena de linhas recusadas pelo PostgREST durante os upserts dos scripts de sync.
+-- O lote é dividido ao meio até isolar as linhas ruins; só elas param aqui, com o erro anexado.
+create table if not exists public.sync_quarentena (
+  id bigserial primary key,
+  tabela text not null,
+  on_conflict text,
+  registro jsonb not null,
+  erro text,
+  criado_em timestamptz not null default now()
+);
+
+create index if not exists sync_quarentena_tabela_idx on public.sync_quarentena (tabela);
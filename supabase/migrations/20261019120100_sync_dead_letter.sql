@@ -0,0 +1,12 @@
+-- Documentos do Bling cujo detalhe ou transformação falhou durante um job de sync.
+-- O reprocessamento (scripts/dead_letter.py) rebusca só estes ids.
+create table if not exists public.sync_dead_letter (
+  job text not null,
+  loja text not null,
+  id_documento bigint not null,
+  endpoint text not null,
+  erro text,
+  criado_em timestamptz not null default now(),
+  atualizado_em timestamptz not null default now(),
+  primary key (job, loja, id_documento)
+);
@@ -0,0 +1,9 @@
+-- Hash do payload normalizado de cada documento gravado pelos scripts de sync
+-- (pedido, NF, pedido de compra, SKU de estoque). Documento com hash igual não é reescrito.
+create table if not exists public.sync_hashes (
+  tabela text not null,
+  chave text not null,
+  hash text not null,
+  atualizado_em timestamptz not null default now(),
+  primary key (tabela, chave)
+);
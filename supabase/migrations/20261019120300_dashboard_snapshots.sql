@@ -0,0 +1,26 @@
+-- Ponteiro para a versão atual de cada snapshot pré-agregado do dashboard
+-- (estoque por SKU, rollup de vendas, pipeline de compras), gerados pelos scripts após cada sync.
+create table if not exists public.dashboard_snapshots (
+  dataset text primary key,
+  versao text not null,
+  caminho text not null,
+  linhas integer not null,
+  bytes integer not null,
+  gerado_em timestamptz not null default now()
+);
+
+alter table public.dashboard_snapshots enable row level security;
+
+create policy "dashboard_snapshots leitura autenticada"
+  on public.dashboard_snapshots for select
+  to authenticated
+  using (true);
+
+insert into storage.buckets (id, name, public)
+values ('dashboard-snapshots', 'dashboard-snapshots', false)
+on conflict (id) do nothing;
+
+create policy "dashboard-snapshots leitura autenticada"
+  on storage.objects for select
+  to authenticated
+  using (bucket_id = 'dashboard-snapshots');
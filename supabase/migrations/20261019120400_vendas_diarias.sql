@@ -0,0 +1,71 @@
+-- Rollup diária de vendas por SKU e canal, mantida de forma incremental pelos scripts de sync.
+-- Cada documento gravado/alterado/removido aplica só a sua diferença nos dias afetados;
+-- janelas móveis (giro de 120d, fechamento diário, receita por canal) viram somas sobre poucas linhas.
+create table if not exists public.vendas_diarias (
+  data date not null,
+  sku text not null,
+  canal text not null,
+  qtd_vendida numeric not null default 0,
+  receita numeric not null default 0,
+  qtd_devolvida numeric not null default 0,
+  valor_estorno numeric not null default 0,
+  atualizado_em timestamptz not null default now(),
+  primary key (data, sku, canal)
+);
+
+create index if not exists vendas_diarias_sku_data_idx on public.vendas_diarias (sku, data);
+
+-- Soma deltas (positivos ou negativos) nos baldes do dia. Deltas repetidos no mesmo payload são agregados antes.
+create or replace function public.aplicar_deltas_vendas(deltas jsonb)
+returns void
+language sql
+as $$
+  insert into public.vendas_diarias as v (data, sku, canal, qtd_vendida, receita, qtd_devolvida, valor_estorno, atualizado_em)
+  select d.data, d.sku, d.canal,
+         sum(coalesce(d.qtd_vendida, 0)), sum(coalesce(d.receita, 0)),
+         sum(coalesce(d.qtd_devolvida, 0)), sum(coalesce(d.valor_estorno, 0)), now()
+  from jsonb_to_recordset(deltas) as d(data date, sku text, canal text, qtd_vendida numeric, receita numeric, qtd_devolvida numeric, valor_estorno numeric)
+  group by d.data, d.sku, d.canal
+  on conflict (data, sku, canal) do update set
+    qtd_vendida = v.qtd_vendida + excluded.qtd_vendida,
+    receita = v.receita + excluded.receita,
+    qtd_devolvida = v.qtd_devolvida + excluded.qtd_devolvida,
+    valor_estorno = v.valor_estorno + excluded.valor_estorno,
+    atualizado_em = now();
+$$;
+
+-- Recalcula do zero os baldes de um intervalo a partir das tabelas de detalhe.
+-- Usado na carga inicial e para absorver o que o webhook gravou direto nas tabelas de detalhe.
+create or replace function public.reconstruir_vendas_diarias(data_inicio date, data_fim date)
+returns void
+language sql
+as $$
+  delete from public.vendas_diarias where data between data_inicio and data_fim;
+
+  insert into public.vendas_diarias (data, sku, canal, qtd_vendida, receita, qtd_devolvida, valor_estorno)
+  select data, sku, canal, sum(qtd_vendida), sum(receita), sum(qtd_devolvida), sum(valor_estorno)
+  from (
+    select data_pedido::date as data, sku, origem as canal, quantidade as qtd_vendida, valor_total_liquido as receita, 0 as qtd_devolvida, 0 as valor_estorno
+    from public.pedidos_venda where data_pedido::date between data_inicio and data_fim
+    union all
+    select data_emissao::date, sku, origem, quantidade, valor_total_liquido, 0, 0
+    from public.nfe_saida where data_emissao::date between data_inicio and data_fim
+    union all
+    select data_devolucao::date, sku, origem, 0, 0, quantidade, valor_estorno
+    from public.devolucoes where data_devolucao::date between data_inicio and data_fim
+  ) detalhe
+  where sku is not null and canal is not null
+  group by data, sku, canal;
+$$;
+
+-- Giro de 120 dias por SKU: soma sobre a rollup, sem varrer o histórico de detalhe
+create or replace view public.view_giro_120d as
+select sku,
+       sum(qtd_vendida) as v_qtd_120d,
+       sum(qtd_vendida) filter (where canal = 'LOJA') as v_qtd_120d_loja,
+       sum(qtd_vendida) filter (where canal in ('SITE', 'SITE_FULL')) as v_qtd_120d_site,
+       sum(receita) as receita_120d,
+       sum(qtd_devolvida) as qtd_devolvida_120d
+from public.vendas_diarias
+where data >= current_date - 120
+group by sku;
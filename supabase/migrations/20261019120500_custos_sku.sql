@@ -0,0 +1,30 @@
+-- Custo de entrada (preço - desconto + frete + IPI) médio ponderado por SKU, mantido pelo motor de custo
+-- (scripts/custo_medio.py) a cada sync de pedidos de compra. Só os SKUs afetados são recalculados.
+create table if not exists public.custos_sku (
+  sku text primary key,
+  custo_medio numeric not null,
+  qtd_base numeric not null,
+  custo_ultima_compra numeric,
+  data_ultima_compra date,
+  atualizado_em timestamptz not null default now()
+);
+
+-- Evolução do custo médio: um ponto por SKU e dia de compra, para consultas "custo em tal data"
+create table if not exists public.custos_sku_historico (
+  sku text not null,
+  data date not null,
+  custo_medio numeric not null,
+  qtd_acumulada numeric not null,
+  primary key (sku, data)
+);
+
+create or replace function public.custo_sku_em(p_sku text, p_data date)
+returns numeric
+language sql
+stable
+as $$
+  select custo_medio from public.custos_sku_historico
+  where sku = p_sku and data <= p_data
+  order by data desc
+  limit 1;
+$$;
@@ -0,0 +1,7 @@
+-- Última vez que o saldo de cada SKU foi CONFERIDO no Bling (mesmo quando não mudou e o hash evitou a escrita).
+-- Usada pelo agendador por giro do sync de estoque para decidir quem está vencido.
+create table if not exists public.estoque_verificacao (
+  sku text primary key,
+  faixa text not null,
+  verificado_em timestamptz not null default now()
+);
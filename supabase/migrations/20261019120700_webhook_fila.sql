@@ -0,0 +1,24 @@
+-- Fila de eventos do webhook do Bling (pedidos e NFes). A Edge Function só grava o evento;
+-- o worker scripts/fila_webhook.py drena em lote, colapsando eventos repetidos do mesmo documento.
+create table if not exists public.webhook_fila (
+  id bigserial primary key,
+  loja text not null,
+  evento text not null,
+  id_documento bigint not null,
+  payload jsonb,
+  recebido_em timestamptz not null default now(),
+  processado_em timestamptz,
+  erro text
+);
+
+create index if not exists webhook_fila_pendentes_idx on public.webhook_fila (id) where processado_em is null;
+
+-- Atraso e volume da fila por loja
+create or replace view public.view_webhook_fila as
+select loja,
+       count(*) filter (where processado_em is null) as pendentes,
+       extract(epoch from now() - min(recebido_em) filter (where processado_em is null))::int as atraso_segundos,
+       count(*) filter (where processado_em >= now() - interval '1 hour') as processados_ultima_hora,
+       count(*) filter (where erro is not null and processado_em >= now() - interval '1 day') as erros_ultimo_dia
+from public.webhook_fila
+group by loja;
@@ -0,0 +1,34 @@
+-- Métricas de frescor por job / tabela / conta, gravadas ao fim de cada execução dos scripts de sync.
+-- marca_dagua: até onde (no tempo do Bling) a execução cobriu. divergentes: documentos que o banco
+-- ainda não tinha (ou tinha diferente) e a execução precisou corrigir. atraso_*: tempo entre o evento
+-- no Bling e a gravação no banco, quando a execução consegue medir.
+create table if not exists public.sync_metricas (
+  job text not null,
+  tabela text not null,
+  loja text not null,
+  ultima_execucao timestamptz not null default now(),
+  ultima_execucao_ok timestamptz,
+  duracao_segundos numeric,
+  documentos integer not null default 0,
+  divergentes integer not null default 0,
+  marca_dagua timestamptz,
+  atraso_medio_segundos numeric,
+  atraso_max_segundos numeric,
+  erro text,
+  primary key (job, tabela, loja)
+);
+
+-- Resumo: o quão velha está cada tabela, pela execução bem-sucedida mais recente de qualquer job
+create or replace view public.view_frescor_sync as
+select tabela,
+       loja,
+       max(ultima_execucao_ok) as ultima_execucao_ok,
+       extract(epoch from now() - max(ultima_execucao_ok))::int / 60 as minutos_desde_ok,
+       max(marca_dagua) as marca_dagua,
+       sum(documentos) as documentos,
+       sum(divergentes) as divergentes,
+       max(atraso_max_segundos) as atraso_max_segundos,
+       string_agg(job || ': ' || erro, ' | ') filter (where erro is not null) as erros
+from public.sync_metricas
+group by tabela, loja
+order by tabela, loja;
@@ -0,0 +1,26 @@
+-- Consumo da cota diária da API do Bling por execução de job: planejado x realizado.
+-- O planejador (scripts/orcamento_api.py) usa o histórico para estimar o custo das próximas execuções.
+create table if not exists public.bling_consumo (
+  id bigserial primary key,
+  data date not null default current_date,
+  job text not null,
+  loja text not null,
+  prioridade integer not null,
+  planejado integer not null,
+  autorizado integer not null,
+  realizado integer,
+  adiado boolean not null default false,
+  criado_em timestamptz not null default now()
+);
+
+create index if not exists bling_consumo_data_loja_idx on public.bling_consumo (data, loja);
+create index if not exists bling_consumo_job_idx on public.bling_consumo (job, loja, criado_em desc);
+
+-- Gasto do dia por conta e job
+create or replace view public.view_bling_consumo_hoje as
+select loja, job, count(*) as execucoes, sum(planejado) as planejado, sum(autorizado) as autorizado,
+       sum(coalesce(realizado, 0)) as realizado, count(*) filter (where adiado) as adiadas
+from public.bling_consumo
+where data = current_date
+group by loja, job
+order by loja, realizado desc;
@@ -0,0 +1,22 @@
+-- Momento da última alteração REAL de cada produto (o sync pula os inalterados pelo hash).
+-- Usado pelo índice local de catálogo (ids do Bling <-> SKU) para baixar só o delta.
+alter table public.produtos add column if not exists atualizado_em timestamptz not null default now();
+
+create index if not exists produtos_atualizado_em_idx on public.produtos (atualizado_em);
+
+create or replace function public.tocar_atualizado_em()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.atualizado_em := now();
+  return new;
+end;
+$$;
+
+drop trigger if exists produtos_tocar_atualizado_em on public.produtos;
+create trigger produtos_tocar_atualizado_em
+  before update on public.produtos
+  for each row
+  when (old is distinct from new)
+  execute function public.tocar_atualizado_em();
@@ -0,0 +1,41 @@
+-- Travas entre processos (GitHub Actions, daemon, execuções manuais).
+-- Cada trava tem dono e validade: quem morre sem liberar perde a trava quando ela expira.
+-- Usadas para não rodar o mesmo job duas vezes ao mesmo tempo ('job:<nome>') e para que só um
+-- processo renove o token OAuth de cada conta do Bling ('token:<loja>').
+create table if not exists public.travas_jobs (
+  nome text primary key,
+  dono text not null,
+  adquirida_em timestamptz not null default now(),
+  expira_em timestamptz not null
+);
+
+-- Adquire (ou renova, se já for do mesmo dono) por 'segundos'. Retorna false se outro dono tem a trava válida.
+-- O relógio é o do banco: runners diferentes não precisam estar sincronizados.
+create or replace function public.adquirir_trava(p_nome text, p_dono text, p_segundos integer)
+returns boolean
+language sql
+as $$
+  insert into public.travas_jobs as t (nome, dono, adquirida_em, expira_em)
+  values (p_nome, p_dono, now(), now() + make_interval(secs => p_segundos))
+  on conflict (nome) do update set
+    dono = excluded.dono,
+    adquirida_em = case when t.dono = excluded.dono then t.adquirida_em else now() end,
+    expira_em = excluded.expira_em
+  where t.dono = excluded.dono or t.expira_em < now()
+  returning true;
+$$;
+
+create or replace function public.liberar_trava(p_nome text, p_dono text)
+returns void
+language sql
+as $$
+  delete from public.travas_jobs where nome = p_nome and dono = p_dono;
+$$;
+
+-- Travas válidas agora (quem está rodando o quê)
+create or replace view public.view_travas_ativas as
+select nome, dono, adquirida_em, expira_em,
+       extract(epoch from now() - adquirida_em)::int as segundos_em_execucao
+from public.travas_jobs
+where expira_em >= now()
+order by adquirida_em;
@@ -0,0 +1,10 @@
+-- Cursor de varreduras longas que não cabem numa execução (prazo do GitHub Actions).
+-- O job para antes do prazo, grava aqui onde parou (conta, página, período, ids pendentes...)
+-- e a próxima execução continua dali. A linha é apagada quando a varredura termina.
+create table if not exists public.sync_checkpoints (
+  job text primary key,
+  cursor jsonb not null,
+  execucoes integer not null default 1,
+  iniciado_em timestamptz not null default now(),
+  atualizado_em timestamptz not null default now()
+);
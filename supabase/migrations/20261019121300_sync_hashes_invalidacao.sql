@@ -0,0 +1,44 @@
+-- Invalida o hash de sync_hashes quando a linha do documento é escrita ou apagada por qualquer caminho.
+-- O webhook, a fila e correções manuais gravam direto nas tabelas sem passar pelo cache de hashes:
+-- sem isso, um documento apagado ou alterado por fora continuaria com o hash da última gravação do sync
+-- e a reconciliação pularia a regravação. O próprio sync também dispara o trigger, mas confirma
+-- o hash de novo logo depois do upsert (CacheHashes.confirmar).
+-- O argumento do trigger é a coluna que faz de chave do documento no cache.
+-- 'produtos' fica de fora: os hashes são por conta (produtos_<loja>) sobre o mesmo SKU e o upsert
+-- de uma conta apagaria o hash das outras a cada execução.
+create or replace function public.invalidar_sync_hash()
+returns trigger
+language plpgsql
+as $$
+declare
+  v_chave text;
+begin
+  if tg_op = 'DELETE' then
+    v_chave := to_jsonb(old) ->> tg_argv[0];
+  else
+    v_chave := to_jsonb(new) ->> tg_argv[0];
+  end if;
+  delete from public.sync_hashes where tabela = tg_table_name and chave = v_chave;
+  return null;
+end;
+$$;
+
+drop trigger if exists trg_invalidar_sync_hash on public.pedidos_venda;
+create trigger trg_invalidar_sync_hash after insert or update or delete on public.pedidos_venda
+  for each row execute function public.invalidar_sync_hash('id');
+
+drop trigger if exists trg_invalidar_sync_hash on public.nfe_saida;
+create trigger trg_invalidar_sync_hash after insert or update or delete on public.nfe_saida
+  for each row execute function public.invalidar_sync_hash('id');
+
+drop trigger if exists trg_invalidar_sync_hash on public.devolucoes;
+create trigger trg_invalidar_sync_hash after insert or update or delete on public.devolucoes
+  for each row execute function public.invalidar_sync_hash('id');
+
+drop trigger if exists trg_invalidar_sync_hash on public.estoque;
+create trigger trg_invalidar_sync_hash after insert or update or delete on public.estoque
+  for each row execute function public.invalidar_sync_hash('sku');
+
+drop trigger if exists trg_invalidar_sync_hash on public.compras_pedidos;
+create trigger trg_invalidar_sync_hash after insert or update or delete on public.compras_pedidos
+  for each row execute function public.invalidar_sync_hash('id_pedido');
@@ -0,0 +1,5 @@
+-- Total do pedido como o Bling mostra na listagem (campo 'total'), repetido em cada linha do pedido.
+-- A reconciliação esparsa compara a listagem com este valor: a soma de valor_total_liquido não serve,
+-- porque deixa de fora itens de natureza bloqueada, outras despesas e o que o max(0, ...) cortou.
+-- Linhas antigas ficam nulas e caem na soma até o pedido ser regravado.
+alter table public.pedidos_venda add column if not exists total_pedido numeric;